@@ -7,50 +7,70 @@ app.py - نظام التسعير الذكي مهووس v19.0
 ✅ بحث mahwous.com للمنتجات المفقودة
 ✅ تحديث تلقائي للأسعار عند إعادة رفع المنافس
 ✅ تصدير Make لكل منتج وللمجموعات
-✅ Gemini Chat مباشر
+✅ Gemini Chat مباشر (بث الرد فور وصوله)
 ✅ فلاتر ذكية في كل قسم
 ✅ تاريخ جميل لكل العمليات
 """
 import streamlit as st
 import pandas as pd
-import threading
-import time
-import uuid
+import uuid, time
 from datetime import datetime
 
 from config import *
 from styles import get_styles, stat_card, vs_card
 from engines.engine import (read_file, run_full_analysis, find_missing_products,
-                             extract_brand, extract_size, extract_type, is_sample)
-from engines.ai_engine import (call_ai, gemini_chat, chat_with_ai,
+                             extract_brand, extract_size, extract_type, is_sample,
+                             fingerprint_inputs, RunReport)
+from engines.pipeline import analysis_job, save_price_history
+from engines.circuit import breaker_states, breaker
+from engines.enrichment import (start_enrichment, start_describe_all, enrich_one,
+                                enrichment_key, get_enrichment)
+from engines.ai_engine import (call_ai, gemini_chat_stream, chat_with_ai,
                                 verify_match, analyze_product,
                                 bulk_verify, suggest_price,
                                 search_market_price, search_mahwous,
                                 check_duplicate, process_paste,
                                 fetch_fragrantica_info, generate_mahwous_description,
+                                ai_cache_stats, ai_cache_reset_memory, ai_provider_stats,
                                 analyze_paste)
 from utils.helpers import (apply_filters, get_filter_options, export_to_excel,
                             export_multiple_sheets, parse_pasted_text,
                             safe_float, format_price, format_diff)
+from utils.results_index import AnalysisResults
 from utils.make_helper import (send_price_updates, send_new_products,
                                 send_missing_products, send_single_product,
+                                resend_chunks,
                                 verify_webhook_connection, export_to_make_format)
 from utils.db_manager import (init_db, log_event, log_decision,
                                log_analysis, get_events, get_decisions,
-                               get_analysis_history, upsert_price_history,
-                               get_price_history, get_price_changes,
-                               save_job_progress, get_job_progress, get_last_job)
+                               get_analysis_history,
+                               get_price_history, get_price_history_bulk,
+                               get_price_changes,
+                               get_job_progress, get_last_job,
+                               update_job_progress,
+                               load_job_checkpoint, find_resumable_job,
+                               get_job_status,
+                               get_event_sink_stats,
+                               ai_cache_summary, ai_cache_clear, enrichment_counts)
+from utils.job_manager import get_job_manager
+from utils.make_outbox import (enqueue_make_delivery, start_outbox_dispatcher,
+                               outbox_stats, list_outbox, retry_dead, purge_outbox)
+from utils.db_maintenance import (run_maintenance, last_maintenance,
+                                  maybe_run_maintenance)
 
 # ── إعداد الصفحة ──────────────────────────
 st.set_page_config(page_title=APP_TITLE, page_icon=APP_ICON,
                    layout="wide", initial_sidebar_state="expanded")
 st.markdown(get_styles(), unsafe_allow_html=True)
 init_db()
+maybe_run_maintenance()  # صيانة دورية في الخلفية (كل DB_MAINTENANCE_INTERVAL_HOURS)
+start_outbox_dispatcher()  # يكمل إرسال ما بقي في صندوق Make من تشغيل سابق
 
 # ── Session State ─────────────────────────
 _defaults = {
     "results": None, "missing_df": None, "analysis_df": None,
-    "chat_history": [], "job_id": None, "job_running": False,
+    "chat_history": [], "job_id": None, "job_running": False, "job_loaded": None,
+    "describe_job": None,      # مهمة "وصف الكل" في صفحة المفقودات
     "decisions_pending": {},   # {product_name: action}
     "our_df": None, "comp_dfs": None,  # حفظ الملفات للمنتجات المفقودة
     "hidden_products": set(),  # منتجات أُرسلت لـ Make أو أُزيلت
@@ -82,63 +102,147 @@ def decision_badge(action):
 
 
 # ════════════════════════════════════════════════
-#  المعالجة الخلفية
+#  المعالجة الخلفية — المهمة في utils.job_manager، والواجهة تقرأ التقدم فقط
 # ════════════════════════════════════════════════
-def _run_analysis_background(job_id, our_df, comp_dfs, our_file_name, comp_names):
-    """تعمل في thread منفصل — تحفظ التقدم كل 10 منتجات"""
-    total = len(our_df)
-    processed = 0
-    partial_results = []
-
-    def progress_cb(pct):
-        nonlocal processed
-        processed = int(pct * total)
-        if processed % 10 == 0 or processed >= total:
-            save_job_progress(job_id, total, processed,
-                              partial_results, "running",
-                              our_file_name, comp_names)
-
-    try:
-        analysis_df = run_full_analysis(our_df, comp_dfs,
-                                        progress_callback=progress_cb)
-        # حفظ تاريخ الأسعار
-        for _, row in analysis_df.iterrows():
-            if row.get("نسبة_التطابق", 0) > 0:
-                upsert_price_history(
-                    str(row.get("المنتج", "")),
-                    str(row.get("المنافس", "")),
-                    safe_float(row.get("سعر_المنافس", 0)),
-                    safe_float(row.get("السعر", 0)),
-                    safe_float(row.get("الفرق", 0)),
-                    safe_float(row.get("نسبة_التطابق", 0)),
-                    str(row.get("القرار", ""))
-                )
+# أسماء مراحل وعدادات RunReport في صفحة السجل
+_STAGE_LABELS = {
+    "index_build": "بناء فهارس المنافسين", "features": "تطبيع منتجاتنا",
+    "search": "البحث (rapidfuzz + الفلاتر)", "ai": "انتظار AI", "ai_backoff": "انتظار 429/إعادة",
+    "checkpoint": "نقاط الحفظ", "progress": "تحديث التقدم", "assemble": "تجميع النتائج",
+    "missing_features": "المفقودات: تجهيز", "missing_scan": "المفقودات: المقارنة",
+    "save_history": "حفظ تاريخ الأسعار", "save_job": "حفظ المهمة",
+}
+_NESTED_STAGES = {"ai_backoff"}
+_COUNTER_LABELS = {
+    "products": "منتجات حُللت", "competitor_rows": "صفوف المنافسين",
+    "candidates_scanned": "مرشحون فُحصوا", "candidates_kept": "مرشحون مقبولون",
+    "auto_accepted": "قبول تلقائي (≥97)", "fuzzy_only": "قرار fuzzy فقط",
+    "sent_to_ai": "أُرسل لـ AI", "ai_batches": "دفعات AI", "ai_requests": "طلبات AI",
+    "ai_cache_hits": "دفعات من الكاش", "ai_retries": "جولات إعادة", "ai_429": "ردود 429",
+    "ai_errors": "أخطاء شبكة AI", "ai_failed_batches": "دفعات فشلت", "ai_no_match": "AI: لا تطابق",
+    "ai_no_keys": "AI: بلا مفاتيح", "ai_circuit_open": "AI: القاطع مفتوح",
+    "ai_fallback_accepted": "AI معطل → fuzzy مسعّر", "ai_fallback_fuzzy": "AI معطل → مراجعة", "no_candidates": "بدون مرشحين", "sample_skipped": "عينات/فارغ", "resumed_skipped": "مستأنف",
+    "reject_fast": "رفض: تشابه أولي منخفض", "reject_duplicate": "رفض: مكرر",
+    "reject_brand": "رفض: الماركة", "reject_size": "رفض: الحجم", "reject_type": "رفض: التركيز",
+    "reject_gender": "رفض: الجنس", "reject_class": "رفض: التصنيف (تستر/طقم/عينة)",
+    "reject_product_number": "رفض: رقم الإصدار", "reject_product_line": "رفض: خط الإنتاج",
+    "reject_score": "رفض: الدرجة النهائية",
+    "missing_competitor_rows": "المفقودات: صفوف المنافسين", "missing_sample_skipped": "المفقودات: عينات/فارغ",
+    "missing_candidates_scanned": "المفقودات: مقارنات", "missing_found": "المفقودات: النتيجة",
+}
+
+# fragment يعيد رسم لوحة التقدم وحدها كل ثانيتين (بدون حلقة sleep في السكربت)
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+
+def _job_status(job_id):
+    """من سجل المهام في الذاكرة، أو من قاعدة البيانات (مهمة من عملية سابقة)"""
+    job = get_job_manager().get(job_id)
+    return job.info() if job else get_job_status(job_id)
 
-        missing_df = find_missing_products(our_df, comp_dfs)
-        results = {
-            "price_raise": analysis_df[analysis_df["القرار"].str.contains("أعلى", na=False)].reset_index(drop=True),
-            "price_lower": analysis_df[analysis_df["القرار"].str.contains("أقل",  na=False)].reset_index(drop=True),
-            "approved":    analysis_df[analysis_df["القرار"].str.contains("موافق",na=False)].reset_index(drop=True),
-            "review":      analysis_df[analysis_df["القرار"].str.contains("مراجعة",na=False)].reset_index(drop=True),
-            "missing": missing_df,
-            "all":     analysis_df,
-        }
-        save_job_progress(job_id, total, total,
-                          analysis_df.to_dict("records"),
-                          "done", our_file_name, comp_names,
-                          missing=missing_df.to_dict("records") if not missing_df.empty else [])
-        log_analysis(our_file_name, comp_names, total,
-                     len(analysis_df[analysis_df["نسبة_التطابق"] > 0]),
-                     len(missing_df))
-
-    except Exception as e:
-        save_job_progress(job_id, total, processed,
-                          [], f"error: {str(e)}", our_file_name, comp_names)
+
+def _load_job_results(job_id):
+    job = get_job_manager().get(job_id)
+    if job and job.status == "done" and job.result:
+        df_all, missing_df = job.result["analysis"], job.result["missing"]
+    else:
+        saved = get_job_progress(job_id)
+        if not saved or not saved.get("results"):
+            return False
+        df_all = pd.DataFrame(saved["results"])
+        missing_df = pd.DataFrame(saved["missing"]) if saved.get("missing") else None
+    st.session_state.results = AnalysisResults(df_all, missing_df)
+    st.session_state.analysis_df = df_all
+    st.session_state.job_loaded = job_id
+    return True
+
+
+def _job_panel_body():
+    job_id = st.session_state.job_id
+    info = _job_status(job_id) if job_id else None
+    if not info:
+        return
+    status = info["status"]
+    pos = get_job_manager().position(job_id) if status == "queued" else 0
+    if pos:
+        st.info(f"⏳ في طابور التحليل — الترتيب {pos} "
+                f"({'التالي' if pos == 1 else f'{pos - 1} مهمة قبلك'})")
+        if st.button("⏹️ إلغاء", key="job_cancel_queued"):
+            get_job_manager().cancel(job_id)
+    elif status in ("queued", "running"):
+        pct = info["processed"] / max(info["total"] or 1, 1)
+        st.progress(min(pct, 0.99),
+                    f"⚙️ {info['processed']}/{info['total']} منتج {info.get('message', '')}")
+        if st.button("⏹️ إلغاء التحليل", key="job_cancel"):
+            get_job_manager().cancel(job_id)
+    elif status == "done":
+        if st.session_state.get("job_loaded") != job_id and _load_job_results(job_id):
+            st.rerun()   # تحديث الملخص والأقسام بالنتائج الجديدة
+        st.progress(1.0, "✅ اكتمل!")
+    elif status in ("cancelled", "timeout"):
+        st.warning("⏹️ أُلغي التحليل" if status == "cancelled" else "⌛ تجاوز التحليل المهلة القصوى")
+    elif status.startswith("error"):
+        st.error(f"❌ {info.get('error') or status}")
+    queue = get_job_manager().queue()
+    if len(queue) > 1:
+        with st.expander(f"🗂️ طابور التحليل ({len(queue)} مهمة نشطة)"):
+            st.dataframe(pd.DataFrame([{
+                "المهمة": q["job_id"], "الملف": q.get("our_file", ""),
+                "الحالة": "⚙️ يعمل" if q["status"] == "running" else f"⏳ #{q['position']}",
+                "التقدم": f"{q['processed']}/{q['total']}",
+            } for q in queue]), use_container_width=True, hide_index=True)
+
+
+_job_panel_live = _fragment(run_every=2)(_job_panel_body) if _fragment else None
+
+
+def job_panel():
+    """لوحة تقدم غير حاجبة: حية أثناء التشغيل، ثابتة بعد الانتهاء"""
+    job_id = st.session_state.job_id
+    info = _job_status(job_id) if job_id else None
+    if info and info["status"] in ("queued", "running"):
+        if _job_panel_live:
+            _job_panel_live()
+        else:
+            _job_panel_body()
+            if st.button("🔄 تحديث التقدم", key="job_refresh"):
+                st.rerun()
+    else:
+        _job_panel_body()
 
 
 # ════════════════════════════════════════════════
 #  مكوّن جدول المقارنة البصري (مشترك)
 # ════════════════════════════════════════════════
+def _show_make_result(res, key=""):
+    """رسالة الإرسال + المنتجات/الدفعات التي فشلت؛ key يحفظ الدفعات الفاشلة لإعادة إرسالها"""
+    (st.success if res.get("success") else st.error)(res.get("message", ""))
+    failed = [r for r in res.get("results", []) if not r.get("success")]
+    if failed:
+        with st.expander(f"❌ {len(failed)} منتج لم يُرسل"):
+            st.dataframe(pd.DataFrame([{
+                "المنتج": r.get("name", ""), "الحالة": r.get("status_code", 0),
+                "المحاولات": r.get("attempts", 0), "الخطأ": r.get("message", "")
+            } for r in failed]), use_container_width=True)
+    chunks = res.get("chunks", [])
+    if len(chunks) > 1 or res.get("failed_chunks"):
+        with st.expander(f"📦 {len(chunks)} دفعة"):
+            st.dataframe(pd.DataFrame([{
+                "الدفعة": c["chunk"], "المنتجات": c["items"],
+                "الحالة": "✅" if c["success"] else "❌", "HTTP": c["status_code"],
+                "المحاولات": c["attempts"], "المفتاح": c["key"][:12]
+            } for c in chunks]), use_container_width=True)
+    if key and "failed_chunks" in res:
+        st.session_state[f"{key}_failed_chunks"] = res["failed_chunks"]
+
+
+def _chunk_retry(key):
+    """زر إعادة إرسال الدفعات الفاشلة فقط (يبقى ظاهراً حتى تنجح)"""
+    failed = st.session_state.get(f"{key}_failed_chunks") or []
+    if failed and st.button(f"🔁 إعادة إرسال {len(failed)} دفعة فاشلة", key=f"{key}_resend"):
+        _show_make_result(resend_chunks(failed), key)
+
+
 def render_pro_table(df, prefix, section_type="update", show_search=True):
     """
     جدول احترافي بصري مع:
@@ -211,19 +315,14 @@ def render_pro_table(df, prefix, section_type="update", show_search=True):
                 st.markdown(f'<div class="ai-box">{res["response"]}</div>',
                             unsafe_allow_html=True)
     with ac4:
+        kind = "new" if section_type in ("missing", "new") else "price"
+        only_chg = kind == "price" and st.checkbox(
+            "🔁 المتغيرة فقط", value=True, key=f"{prefix}_chg",
+            help="تخطي المنتجات التي لم يتغير سعرها منذ آخر إرسال ناجح")
         if st.button("📤 إرسال كل لـ Make", key=f"{prefix}_make_all"):
+            # إصلاح: اختيار نوع الإرسال الصحيح حسب نوع القسم — يُضاف لصندوق الإرسال
             products = export_to_make_format(filtered, section_type)
-            # إصلاح: اختيار الدالة الصحيحة حسب نوع القسم
-            if section_type == "update":
-                res = send_price_updates(products)
-            elif section_type in ("missing", "new"):
-                res = send_new_products(products)
-            else:
-                res = send_price_updates(products)
-            if res["success"]:
-                st.success(res["message"])
-            else:
-                st.error(res["message"])
+            _show_make_result(enqueue_make_delivery(kind, products, only_changed=only_chg))
     with ac5:
         # جمع القرارات المعلقة وإرسالها
         pending = {k: v for k, v in st.session_state.decisions_pending.items()
@@ -247,6 +346,11 @@ def render_pro_table(df, prefix, section_type="update", show_search=True):
     start = (page_num - 1) * PAGE_SIZE
     page_df = filtered.iloc[start:start + PAGE_SIZE]
 
+    # تاريخ الأسعار لكل الصفحة باستعلام واحد (بدل استعلام لكل منتج)
+    _ph_map = get_price_history_bulk(
+        [(str(r.get("المنتج", "—")), str(r.get("المنافس", "")))
+         for _, r in page_df.iterrows()], limit=2)
+
        # ── الجدول البصري ─────────────────────
     for idx, row in page_df.iterrows():
         our_name   = str(row.get("المنتج", "—"))
@@ -294,7 +398,7 @@ def render_pro_table(df, prefix, section_type="update", show_search=True):
             risk_html = f'<span style="color:{rc};font-size:.75rem;font-weight:700">⚡{risk}</span>'
 
         # تاريخ آخر تغيير سعر
-        ph = get_price_history(our_name, comp_src, limit=2)
+        ph = _ph_map.get((our_name, comp_src), [])
         price_change_html = ""
         if len(ph) >= 2:
             old_p = ph[1]["price"]
@@ -510,6 +614,20 @@ with st.sidebar:
         unsafe_allow_html=True
     )
 
+    # قواطع الدائرة: مزود فشل مراراً مؤخراً → يُتخطى (المطابقة تكتفي بـ fuzzy)
+    _brs = {k: v for k, v in breaker_states().items() if v["state"] != "closed"}
+    for _bn, _bv in _brs.items():
+        _bc = "#FF1744" if _bv["state"] == "open" else "#FF9800"
+        _bl = (f"⛔ {_bn}: متوقف مؤقتاً — إعادة المحاولة بعد {_bv['retry_in']:.0f}ث"
+               if _bv["state"] == "open" else f"🟠 {_bn}: تجربة الاتصال")
+        st.markdown(
+            f'<div style="background:{_bc}22;border:1px solid {_bc};border-radius:6px;'
+            f'padding:5px;margin-top:4px;text-align:center;color:{_bc};font-size:.78rem"'
+            f' title="{_bv["last_error"]}">{_bl}</div>', unsafe_allow_html=True)
+    if _brs and st.button("🔄 إعادة تفعيل AI", key="breaker_reset"):
+        for _bn in _brs: breaker(_bn).reset()
+        st.rerun()
+
     # زر تشخيص سريع
     if not ai_ok:
         if st.button("🔍 تشخيص المشكلة", key="diag_btn"):
@@ -533,7 +651,7 @@ with st.sidebar:
 
     # حالة المعالجة
     if st.session_state.job_id:
-        job = get_job_progress(st.session_state.job_id)
+        job = _job_status(st.session_state.job_id)
         if job and job["status"] == "running":
             pct = job["processed"] / max(job["total"], 1)
             st.progress(pct, f"⚙️ {job['processed']}/{job['total']} منتج")
@@ -612,14 +730,18 @@ if page == "📊 لوحة التحكم":
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
         with cc2:
             if st.button("📤 إرسال كل شيء لـ Make"):
-                # إصلاح: إرسال تحديثات الأسعار (سعر أعلى وأقل)
+                # إصلاح: إرسال تحديثات الأسعار (سعر أعلى وأقل) — عبر صندوق الإرسال
+                _queued = 0
                 for key in ["price_raise","price_lower"]:
                     if key in r and not r[key].empty:
-                        send_price_updates(export_to_make_format(r[key], "update"))
+                        _queued += enqueue_make_delivery(
+                            "price", export_to_make_format(r[key], "update"), only_changed=True
+                        ).get("items", 0)
                 # إرسال المنتجات المفقودة كمنتجات جديدة
                 if "missing" in r and not r["missing"].empty:
-                    send_new_products(export_to_make_format(r["missing"], "missing"))
-                st.success("✅ تم إرسال جميع البيانات لـ Make!")
+                    _queued += enqueue_make_delivery(
+                        "new", export_to_make_format(r["missing"], "missing")).get("items", 0)
+                st.success(f"📮 أُضيف {_queued} منتج لصندوق الإرسال — تابع الحالة في صفحة أتمتة Make")
     else:
         # استئناف آخر job؟
         last = get_last_job()
@@ -628,13 +750,8 @@ if page == "📊 لوحة التحكم":
             if st.button("🔄 استعادة النتائج المحفوظة"):
                 df_all = pd.DataFrame(last["results"])
                 if not df_all.empty:
-                    st.session_state.results = {
-                        "price_raise": df_all[df_all["القرار"].str.contains("أعلى",na=False)].reset_index(drop=True),
-                        "price_lower": df_all[df_all["القرار"].str.contains("أقل", na=False)].reset_index(drop=True),
-                        "approved":    df_all[df_all["القرار"].str.contains("موافق",na=False)].reset_index(drop=True),
-                        "review":      df_all[df_all["القرار"].str.contains("مراجعة",na=False)].reset_index(drop=True),
-                        "missing": pd.DataFrame(last.get("missing", [])) if last.get("missing") else pd.DataFrame(), "all": df_all,
-                    }
+                    st.session_state.results = AnalysisResults(
+                        df_all, pd.DataFrame(last["missing"]) if last.get("missing") else None)
                     st.session_state.analysis_df = df_all
                     st.rerun()
         else:
@@ -679,88 +796,62 @@ elif page == "📂 رفع الملفات":
                     # حفظ البيانات في session_state لاستخدامها لاحقاً في find_missing_products
                     st.session_state.our_df = our_df
                     st.session_state.comp_dfs = comp_dfs
-                    job_id = str(uuid.uuid4())[:8]
-                    st.session_state.job_id = job_id
                     comp_names = ",".join(comp_dfs.keys())
+                    # نفس الملفات انقطع تحليلها (إعادة تشغيل/Redeploy)؟ → استئناف
+                    fingerprint = fingerprint_inputs(our_df, comp_dfs)
+                    prev = find_resumable_job(fingerprint) if bg_mode else None
+                    resume = None
+                    if prev:
+                        job_id = prev["job_id"]
+                        resume = load_job_checkpoint(job_id)
+                        update_job_progress(job_id, prev["processed"], prev["total"])  # حجز المهمة لهذه العملية
+                        st.info(f"♻️ استئناف التحليل المنقطع (Job: {job_id}) — "
+                                f"{len(resume['rows'])} منتج محسوم مسبقاً")
+                    else:
+                        job_id = str(uuid.uuid4())[:8]
+                    st.session_state.job_id = job_id
 
                     if bg_mode:
-                        # ── خلفية ──
-                        t = threading.Thread(
-                            target=_run_analysis_background,
-                            args=(job_id, our_df, comp_dfs,
-                                  our_file.name, comp_names),
-                            daemon=True
-                        )
-                        t.start()
+                        # ── خلفية ── (الزر يعود فوراً؛ التقدم في اللوحة أدناه)
+                        job = get_job_manager().submit(
+                            analysis_job, our_df, comp_dfs, our_file.name, comp_names,
+                            fingerprint=fingerprint, resume=resume, job_id=job_id,
+                            dedupe_key=fingerprint,
+                            meta={"our_file": our_file.name, "fingerprint": fingerprint})
+                        st.session_state.job_id = job.id
                         st.session_state.job_running = True
-                        st.success(f"✅ بدأ التحليل في الخلفية (Job: {job_id})")
-                        st.info("🔄 تابع التقدم من لوحة التحكم أو انتظر هنا")
-
-                        # polling
-                        progress_bar = st.progress(0, "جاري التحليل...")
-                        for _ in range(300):  # max 5 دقائق
-                            time.sleep(2)
-                            job = get_job_progress(job_id)
-                            if job:
-                                pct = job["processed"] / max(job["total"], 1)
-                                progress_bar.progress(
-                                    min(pct, 0.99),
-                                    f"⚙️ {job['processed']}/{job['total']} منتج"
-                                )
-                                if job["status"] == "done":
-                                    break
-                                elif job["status"].startswith("error"):
-                                    st.error(f"❌ {job['status']}")
-                                    break
-
-                        job = get_job_progress(job_id)
-                        if job and job["status"] == "done" and job.get("results"):
-                            df_all = pd.DataFrame(job["results"])
-                            # استعادة المنتجات المفقودة من قاعدة البيانات
-                            missing_df = pd.DataFrame(job.get("missing", [])) if job.get("missing") else pd.DataFrame()
-                            st.session_state.results = {
-                                "price_raise": df_all[df_all["القرار"].str.contains("أعلى",na=False)].reset_index(drop=True),
-                                "price_lower": df_all[df_all["القرار"].str.contains("أقل", na=False)].reset_index(drop=True),
-                                "approved":    df_all[df_all["القرار"].str.contains("موافق",na=False)].reset_index(drop=True),
-                                "review":      df_all[df_all["القرار"].str.contains("مراجعة",na=False)].reset_index(drop=True),
-                                "missing": missing_df, "all": df_all,
-                            }
-                            st.session_state.analysis_df = df_all
-                            progress_bar.progress(1.0, "✅ اكتمل!")
-                            st.balloons()
+                        if job.id != job_id:
+                            st.info(f"🔗 نفس الملفات قيد التحليل بالفعل — تمت متابعة المهمة {job.id}")
+                        else:
+                            st.success(f"✅ أُضيف التحليل لطابور الخلفية (Job: {job_id})")
+                        st.info("🔄 تابع التقدم هنا أو من الشريط الجانبي — يمكنك التنقل بين الأقسام")
                     else:
                         # ── مباشر ──
                         prog = st.progress(0, "جاري التحليل...")
                         def upd(p): prog.progress(p, f"{p*100:.0f}%")
-                        df_all = run_full_analysis(our_df, comp_dfs, progress_callback=upd)
-                        missing_df = find_missing_products(our_df, comp_dfs)
-
-                        for _, row in df_all.iterrows():
-                            if row.get("نسبة_التطابق", 0) > 0:
-                                upsert_price_history(
-                                    str(row.get("المنتج","")), str(row.get("المنافس","")),
-                                    safe_float(row.get("سعر_المنافس",0)),
-                                    safe_float(row.get("السعر",0)),
-                                    safe_float(row.get("الفرق",0)),
-                                    safe_float(row.get("نسبة_التطابق",0)),
-                                    str(row.get("القرار",""))
-                                )
-
-                        st.session_state.results = {
-                            "price_raise": df_all[df_all["القرار"].str.contains("أعلى",na=False)].reset_index(drop=True),
-                            "price_lower": df_all[df_all["القرار"].str.contains("أقل", na=False)].reset_index(drop=True),
-                            "approved":    df_all[df_all["القرار"].str.contains("موافق",na=False)].reset_index(drop=True),
-                            "review":      df_all[df_all["القرار"].str.contains("مراجعة",na=False)].reset_index(drop=True),
-                            "missing": missing_df, "all": df_all,
-                        }
+                        report = RunReport("analysis")
+                        df_all = run_full_analysis(our_df, comp_dfs, progress_callback=upd,
+                                                   report=report)
+                        missing_df = find_missing_products(our_df, comp_dfs, report=report)
+
+                        with report.stage("save_history"):
+                            save_price_history(df_all)
+
+                        st.session_state.results = AnalysisResults(df_all, missing_df)
                         st.session_state.analysis_df = df_all
                         log_analysis(our_file.name, comp_names, len(our_df),
-                                     len(df_all[df_all["نسبة_التطابق"]>0]), len(missing_df))
+                                     len(df_all[df_all["نسبة_التطابق"]>0]), len(missing_df),
+                                     report=report.to_dict())
+                        if not missing_df.empty:
+                            try: start_enrichment(missing_df)
+                            except Exception: pass
                         prog.progress(1.0, "✅ اكتمل!")
                         st.balloons()
         else:
             st.warning("⚠️ ارفع ملف منتجاتنا وملف منافس واحد على الأقل")
 
+    job_panel()
+
 
 # ════════════════════════════════════════════════
 #  3. سعر أعلى
@@ -886,14 +977,19 @@ elif page == "🔍 منتجات مفقودة":
                 brand_f = c2.selectbox("الماركة", opts["brands"], key="miss_b")
                 comp_f  = c3.selectbox("المنافس", opts["competitors"], key="miss_c")
 
-            filtered = df.copy()
+            # دلالات هذه الصفحة كما هي: البحث في كل الأعمدة والماركة/المنافس "يحتوي"
+            # (فهرس apply_filters يغطي أعمدة النص الثلاثة فقط بمطابقة تامة للفئات)
+            _mask = pd.Series(True, index=df.index)
             if search:
-                filtered = filtered[filtered.apply(
-                    lambda r: search.lower() in str(r.values).lower(), axis=1)]
-            if brand_f != "الكل" and "الماركة" in filtered.columns:
-                filtered = filtered[filtered["الماركة"].str.contains(brand_f, case=False, na=False)]
-            if comp_f != "الكل" and "المنافس" in filtered.columns:
-                filtered = filtered[filtered["المنافس"].str.contains(comp_f, case=False, na=False)]
+                _txt = df[df.columns[0]].astype(str)
+                for _c in df.columns[1:]:
+                    _txt = _txt + " " + df[_c].astype(str)
+                _mask &= _txt.str.lower().str.contains(search.lower(), regex=False)
+            if brand_f != "الكل" and "الماركة" in df.columns:
+                _mask &= df["الماركة"].astype(str).str.contains(brand_f, case=False, regex=False, na=False)
+            if comp_f != "الكل" and "المنافس" in df.columns:
+                _mask &= df["المنافس"].astype(str).str.contains(comp_f, case=False, regex=False, na=False)
+            filtered = df if _mask.all() else df[_mask].reset_index(drop=True)
 
             # تصدير
             cc1, cc2, cc3 = st.columns(3)
@@ -910,20 +1006,47 @@ elif page == "🔍 منتجات مفقودة":
             with cc3:
                 if st.button("📤 إرسال كل لـ Make", key="miss_make_all"):
                     products = export_to_make_format(filtered, "missing")
-                    res = send_missing_products(products)
-                    if res["success"]:
-                        st.success(res["message"])
-                    else:
-                        st.error(res["message"])
+                    _show_make_result(enqueue_make_delivery("missing", products))
 
             st.caption(f"{len(filtered)} منتج — {datetime.now().strftime('%Y-%m-%d %H:%M')}")
 
+            # إثراء Fragrantica في الخلفية (صورة + مكونات + وصف) — يُقرأ من جدول enrichment
+            _ec = enrichment_counts()
+            ce1, ce2, ce3 = st.columns([2, 1, 1])
+            ce1.caption(f"🖼️ مُثرى: {_ec.get('ok', 0)} | فشل: {_ec.get('failed', 0)}")
+            if ce2.button(f"⚡ إثراء أول {ENRICH_TOP_N}", key="miss_enrich"):
+                _job = start_enrichment(filtered)
+                if _job:
+                    st.success(f"✅ مهمة الإثراء {_job.id} في الخلفية")
+                else:
+                    st.warning("لا مفاتيح AI أو الخدمة متوقفة مؤقتاً")
+            if ce3.button(f"✍️ وصف الكل ← Make ({len(filtered)})", key="miss_describe_all"):
+                _job = start_describe_all(filtered)
+                st.session_state.describe_job = _job.id if _job else None
+            _dj = get_job_manager().get(st.session_state.describe_job or "")
+            if _dj:
+                _di = _dj.info()
+                if _di["status"] in ("queued", "running"):
+                    st.progress(min(_di["pct"], 0.99),
+                                f"✍️ {_di.get('message') or 'في الطابور'}")
+                    if st.button("🔄 تحديث", key="miss_describe_refresh"):
+                        st.rerun()
+                elif _di["status"] == "done" and _dj.result:
+                    _r = _dj.result
+                    st.caption(f"✍️ {_r['described']} وصف جديد | Fragrantica: {_r['ok']} ✅ {_r['failed']} ❌"
+                               + (" | ⏸️ AI متوقف مؤقتاً" if _r["stopped"] else ""))
+                    _show_make_result(_r["make"])
+                elif _di["status"] != "done":
+                    st.error(f"❌ وصف الكل: {_di.get('error') or _di['status']}")
+
             # عرض كل منتج
             PAGE_SIZE = 20
             total_p = len(filtered)
             tp = max(1, (total_p + PAGE_SIZE - 1) // PAGE_SIZE)
             pn = st.number_input("الصفحة", 1, tp, 1, key="miss_pg") if tp > 1 else 1
             page_df = filtered.iloc[(pn-1)*PAGE_SIZE:pn*PAGE_SIZE]
+            _enr = get_enrichment(page_df["منتج_المنافس"].astype(str).tolist()) \
+                if "منتج_المنافس" in page_df.columns else {}
 
             for idx, row in page_df.iterrows():
                 name   = str(row.get("منتج_المنافس", ""))
@@ -932,11 +1055,17 @@ elif page == "🔍 منتجات مفقودة":
                 comp   = str(row.get("المنافس", ""))
                 size   = row.get("الحجم", "")
                 ptype  = str(row.get("النوع", ""))
+                enr    = _enr.get(name) or {}
+                fi     = enr.get("info") if enr.get("status") == "ok" else None
+                _thumb = (fi or {}).get("image_url", "")
+                _thumb = (f'<img src="{_thumb}" style="height:56px;border-radius:6px;margin-left:10px">'
+                          if _thumb.startswith("http") else "")
 
                 st.markdown(f"""
                 <div style="border:1px solid #007bff44;border-radius:8px;padding:12px;
                             margin:4px 0;background:linear-gradient(90deg,#0a1628,#0e1a30);">
                   <div style="display:flex;justify-content:space-between;align-items:center">
+                    {_thumb}
                     <div style="flex:1">
                       <div style="font-weight:700;color:#4fc3f7;font-size:.95rem">{name}</div>
                       <div style="font-size:.75rem;color:#888;margin-top:3px">
@@ -954,7 +1083,9 @@ elif page == "🔍 منتجات مفقودة":
                 with b1:  # صورة + مكونات
                     if st.button("🖼️ صورة", key=f"img_{idx}"):
                         with st.spinner("يجلب من Fragrantica Arabia..."):
-                            fi = fetch_fragrantica_info(name)
+                            if not fi:
+                                fi = (enrich_one(enrichment_key(name), name, price,
+                                                 describe=False) or {}).get("info") or {}
                             if fi.get("success"):
                                 img = fi.get("image_url","")
                                 if img and img.startswith("http"):
@@ -974,8 +1105,10 @@ elif page == "🔍 منتجات مفقودة":
                 with b2:  # وصف مهووس
                     if st.button("✍️ وصف مهووس", key=f"mhdesc_{idx}"):
                         with st.spinner("يولّد الوصف..."):
-                            fi2 = fetch_fragrantica_info(name)
-                            desc = generate_mahwous_description(name, price, fi2)
+                            desc = enr.get("description") or (enrich_one(
+                                enrichment_key(name), name, price) or {}).get("description")
+                            if not desc:   # Fragrantica فشل → وصف بدون بيانات المكونات
+                                desc = generate_mahwous_description(name, price, fi)
                             st.text_area("وصف المنتج — نسخ للمتجر:", desc, height=250, key=f"mhd_ta_{idx}")
 
                 with b3:  # تحقق تكرار AI
@@ -1026,7 +1159,8 @@ elif page == "🔍 منتجات مفقودة":
                             "أسم المنتج": name,
                             "سعر المنتج": _suggested_price,
                             "brand": brand,
-                            "الوصف": f"عطر {brand} {_size_str}" if brand else f"عطر {_size_str}",
+                            "الوصف": enr.get("description") or
+                                     (f"عطر {brand} {_size_str}" if brand else f"عطر {_size_str}"),
                         }])
                         if res["success"]:
                             st.success(res["message"])
@@ -1182,17 +1316,31 @@ elif page == "🤖 الذكاء الصناعي":
         _msg_to_send = _quick or (_user_in if _send and _user_in else None)
         if _msg_to_send:
             _full = f"سياق البيانات: {_ctx_str}\n\n{_msg_to_send}"
-            with st.spinner("🤖 Gemini يفكر..."):
-                _res = gemini_chat(_full, st.session_state.chat_history)
-            if _res["success"]:
+            # بث الرد: كل جزء يُعرض فور وصوله (تحديث الفقاعة كل ~80ms على الأكثر)
+            _live, _meta, _buf, _last = st.empty(), {}, "", 0.0
+            _live.caption("🤖 Gemini يكتب...")
+            for _chunk in gemini_chat_stream(_full, st.session_state.chat_history, meta=_meta):
+                _buf += _chunk
+                if time.time() - _last >= 0.08:
+                    _last = time.time()
+                    _live.markdown(
+                        f'''<div style="background:#080f1e;border:1px solid #1a3050;color:#d0d0d0;
+                            padding:10px 14px;border-radius:14px;font-size:.88rem;line-height:1.65;
+                            direction:rtl"><span style="color:#00C853;font-size:.65rem;font-weight:700">
+                            ● {_meta.get('source','Gemini')} · ⏱️ {_meta.get('ttft') or 0:.2f}s</span><br>
+                            {_buf.replace(chr(10),'<br>')}▌</div>''', unsafe_allow_html=True)
+            if _meta.get("success"):
                 st.session_state.chat_history.append({
-                    "user": _msg_to_send, "ai": _res["response"],
-                    "source": _res.get("source","Gemini"),
+                    "user": _msg_to_send, "ai": _meta["text"],
+                    "source": _meta.get("source","Gemini"),
                     "ts": datetime.now().strftime("%H:%M")
                 })
                 st.rerun()
             else:
-                st.error(_res["response"])
+                _live.empty()
+                st.error(f"❌ فشل الاتصال — {_meta.get('error') or 'لا رد من أي مزود'}")
+                if any(b["state"] == "open" for b in breaker_states().values()):
+                    st.caption("⏸️ مزود معطل مؤقتاً — زر «🔄 إعادة تفعيل AI» في الشريط الجانبي")
 
         _dc1, _dc2 = st.columns([4,1])
         with _dc2:
@@ -1401,7 +1549,8 @@ elif page == "⚡ أتمتة Make":
     st.header("⚡ أتمتة Make.com")
     db_log("make", "view")
 
-    tab1, tab2, tab3 = st.tabs(["🔗 حالة الاتصال", "📤 إرسال", "📦 القرارات المعلقة"])
+    tab1, tab2, tab3, tab4 = st.tabs(["🔗 حالة الاتصال", "📤 إرسال", "📦 القرارات المعلقة",
+                                      "📮 صندوق الإرسال"])
 
     with tab1:
         if st.button("🔍 فحص الاتصال"):
@@ -1424,17 +1573,24 @@ elif page == "⚡ أتمتة Make":
             df_s = st.session_state.results.get(sec_key, pd.DataFrame())
             if not df_s.empty:
                 st.info(f"سيتم إرسال {len(df_s)} منتج")
+                direct = st.checkbox("⏳ إرسال مباشر (انتظار النتيجة بدل صندوق الإرسال)",
+                                     key="make_direct")
+                only_chg = wh == "تحديث أسعار" and st.checkbox(
+                    "🔁 الأسعار المتغيرة فقط (منذ آخر إرسال ناجح)", value=True, key="make_chg")
                 if st.button("📤 إرسال الآن"):
                     sec_type = section_type_map[sec_key]
                     products = export_to_make_format(df_s, sec_type)
-                    func = {"تحديث أسعار": send_price_updates,
-                            "منتجات جديدة": send_new_products,
-                            "مفقودة": send_missing_products}
-                    res = func[wh](products)
-                    if res["success"]:
-                        st.success(res["message"])
+                    if direct:
+                        func = {"تحديث أسعار": lambda p: send_price_updates(p, only_changed=only_chg),
+                                "منتجات جديدة": send_new_products,
+                                "مفقودة": send_missing_products}
+                        _show_make_result(func[wh](products), "make_send")
                     else:
-                        st.error(res["message"])
+                        kind = {"تحديث أسعار": "price", "منتجات جديدة": "new",
+                                "مفقودة": "missing"}[wh]
+                        _show_make_result(enqueue_make_delivery(kind, products,
+                                                                only_changed=only_chg))
+            _chunk_retry("make_send")
 
     with tab3:
         pending = st.session_state.decisions_pending
@@ -1462,6 +1618,38 @@ elif page == "⚡ أتمتة Make":
         else:
             st.info("لا توجد قرارات معلقة")
 
+    with tab4:
+        _ob = outbox_stats()
+        o1, o2, o3, o4 = st.columns(4)
+        for col, (stt, label) in zip([o1, o2, o3, o4], [
+                ("pending", "⏳ بالانتظار"), ("sending", "📤 قيد الإرسال"),
+                ("sent", "✅ أُرسلت"), ("dead", "☠️ فشلت نهائياً")]):
+            v = _ob.get(stt, {"n": 0, "items": 0})
+            col.metric(label, v["n"], f"{v['items']} منتج", delta_color="off")
+
+        _f = st.selectbox("الحالة", ["الكل", "pending", "sending", "sent", "dead"], key="ob_f")
+        _rows = list_outbox(None if _f == "الكل" else _f)
+        if _rows:
+            st.dataframe(pd.DataFrame(_rows).rename(columns={
+                "created_at": "أُضيف", "updated_at": "آخر تحديث", "kind": "النوع",
+                "label": "الوصف", "items": "المنتجات", "status": "الحالة",
+                "attempts": "المحاولات", "next_attempt_at": "المحاولة التالية",
+                "status_code": "HTTP", "last_error": "آخر خطأ", "sent_at": "أُرسل"
+            }), use_container_width=True, height=320)
+        else:
+            st.info("الصندوق فارغ")
+
+        b1, b2, b3 = st.columns(3)
+        with b1:
+            if st.button("🔁 إعادة الرسائل الفاشلة", disabled=not _ob.get("dead", {}).get("n")):
+                st.success(f"✅ أُعيد {retry_dead()} رسالة للانتظار")
+        with b2:
+            if st.button("🧹 حذف المُرسلة الأقدم من 7 أيام"):
+                st.success(f"✅ حُذفت {purge_outbox(7)} رسالة")
+        with b3:
+            if st.button("🔄 تحديث"):
+                st.rerun()
+
 
 # ════════════════════════════════════════════════
 #  10. الإعدادات
@@ -1470,7 +1658,8 @@ elif page == "⚙️ الإعدادات":
     st.header("⚙️ الإعدادات")
     db_log("settings", "view")
 
-    tab1, tab2, tab3 = st.tabs(["🔑 المفاتيح", "⚙️ المطابقة", "📜 السجل"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["🔑 المفاتيح", "⚙️ المطابقة", "📜 السجل", "🧹 الصيانة",
+                                             "🧠 كاش AI"])
 
     with tab1:
         gemini_s = f"✅ {len(GEMINI_API_KEYS)} مفتاح" if GEMINI_API_KEYS else "❌"
@@ -1486,6 +1675,17 @@ elif page == "⚙️ الإعدادات":
                     st.success(f"✅ AI يعمل ({r['source']}): {r['response'][:80]}")
                 else:
                     st.error(r["response"])
+        _pst = ai_provider_stats()
+        if _pst:
+            st.markdown("#### ⏱️ زمن مزودي AI (منذ تشغيل التطبيق)")
+            st.caption("السباق: المزود الأول يبدأ وحده، وبعد مهلة التحوط أو الفشل يبدأ التالي "
+                       "بالتوازي — أول رد صالح يفوز")
+            st.dataframe(pd.DataFrame([{
+                "المزود": k, "نجاح": v["ok"], "فشل": v["fail"], "فاز": v["won"],
+                "تجاوزته المهلة": v["hedged"], "p50 (ث)": v["p50"], "p90 (ث)": v["p90"],
+                "p99 (ث)": v["p99"], "مهلة التحوط (ث)": v["hedge_delay"],
+                **{f"زمن {b}": v["hist"].get(b, 0) for b in sorted(v["hist"])},
+            } for k, v in _pst.items()]).fillna(0), use_container_width=True, hide_index=True)
 
     with tab2:
         st.info(f"حد التطابق الأدنى: {MIN_MATCH_SCORE}%")
@@ -1505,6 +1705,52 @@ elif page == "⚙️ الإعدادات":
         else:
             st.info("لا توجد قرارات مسجلة")
 
+    with tab4:
+        st.caption("مدة الاحتفاظ (أيام): " + " | ".join(f"{k}: {v}" for k, v in DB_RETENTION.items()))
+        if st.button("🧹 تشغيل الصيانة الآن", key="db_maint"):
+            with st.spinner("ضغط قاعدة البيانات..."):
+                _rep = run_maintenance()
+            if _rep.get("skipped"):
+                st.warning("⏳ الصيانة تعمل حالياً في الخلفية")
+            else:
+                st.success(f"✅ تم استعادة {_rep['bytes_reclaimed']/1024/1024:,.2f} MB "
+                           f"في {_rep['duration_s']} ث")
+        _last = last_maintenance()
+        if _last:
+            _jobs = _last.get("jobs", {})
+            st.info(f"🕐 آخر صيانة: {_last['ran_at']}\n\n"
+                    f"📦 الحجم: {_last.get('bytes_before',0)/1024/1024:,.2f} → "
+                    f"{_last.get('bytes_after',0)/1024/1024:,.2f} MB "
+                    f"(مستعاد {_last.get('bytes_reclaimed',0)/1024/1024:,.2f} MB)\n\n"
+                    f"🗑️ أحداث: {_last.get('events_deleted',0)} | "
+                    f"تاريخ أسعار مضغوط: {_last.get('price_history_downsampled',0)} | "
+                    f"مهام مؤرشفة: {_jobs.get('archived',0)} | "
+                    f"تحليلات: {_last.get('analysis_history_deleted',0)} | "
+                    f"كاش AI: {_last.get('ai_cache_deleted',0)}")
+        else:
+            st.info("لم تُشغّل الصيانة بعد")
+
+    with tab5:
+        st.caption("ردود AI تُخزّن حسب (الدالة، المدخلات، نسخة الـ prompt، النموذج) — "
+                   "الإحصاءات منذ آخر تشغيل للتطبيق")
+        _cst, _crows = ai_cache_stats(), ai_cache_summary()
+        _hits = sum(v["mem_hits"] + v["db_hits"] for v in _cst.values())
+        _miss = sum(v["misses"] for v in _cst.values())
+        _cc = st.columns(3)
+        _cc[0].metric("نسبة الإصابة", f"{_hits / (_hits + _miss) * 100:.0f}%" if _hits + _miss else "—")
+        _cc[1].metric("طلبات وُفّرت", _hits)
+        _cc[2].metric("ردود مخزنة", sum(v["rows"] for v in _crows.values()))
+        st.dataframe(pd.DataFrame([{
+            "الدالة": fn, "TTL (ساعة)": v["ttl_hours"],
+            "من الذاكرة": v["mem_hits"], "من القاعدة": v["db_hits"],
+            "استدعاء فعلي": v["misses"], "نسبة الإصابة": f"{v['hit_rate'] * 100:.0f}%",
+            "مخزن": _crows.get(fn, {}).get("rows", 0),
+            "آخر تخزين": _crows.get(fn, {}).get("newest", "—"),
+        } for fn, v in _cst.items()]), use_container_width=True, hide_index=True)
+        if st.button("🗑️ مسح كاش AI", key="ai_cache_clear"):
+            _n = ai_cache_clear(); ai_cache_reset_memory()
+            st.success(f"✅ حُذف {_n} رد مخزن")
+
 
 # ════════════════════════════════════════════════
 #  11. السجل
@@ -1513,7 +1759,8 @@ elif page == "📜 السجل":
     st.header("📜 السجل الكامل")
     db_log("log", "view")
 
-    tab1, tab2, tab3 = st.tabs(["📊 التحليلات", "💰 تغييرات الأسعار", "📝 الأحداث"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 التحليلات", "💰 تغييرات الأسعار", "📝 الأحداث",
+                                      "⏱️ تقارير التشغيل"])
 
     with tab1:
         history = get_analysis_history(20)
@@ -1542,6 +1789,12 @@ elif page == "📜 السجل":
             st.info(f"لا توجد تغييرات في آخر {days} يوم")
 
     with tab3:
+        # يُعرض المكتوب فعلاً فقط — العرض لا ينتظر كاتب الأحداث الخلفي (دفعات كل ثوانٍ قليلة)
+        _es = get_event_sink_stats()
+        if _es["queued"]:
+            st.caption(f"⏳ {_es['queued']} حدث بانتظار الكتابة — يظهر خلال ثوانٍ")
+        if _es["dropped"] or _es["failed"]:
+            st.caption(f"⚠️ أحداث مُسقطة: {_es['dropped']} | فشل الكتابة: {_es['failed']}")
         events = get_events(limit=50)
         if events:
             df_e = pd.DataFrame(events)
@@ -1551,3 +1804,41 @@ elif page == "📜 السجل":
             }).head(200), use_container_width=True)
         else:
             st.info("لا توجد أحداث")
+
+    with tab4:
+        runs = [h for h in get_analysis_history(50) if h.get("report")]
+        if runs:
+            labels = {f"{h['timestamp']} — {h['our_file']} ({h['total_products']} منتج)": h
+                      for h in runs}
+            _run_rep = labels[st.selectbox("التحليل", list(labels))]["report"]
+            stages, cnt = _run_rep.get("stages", {}), _run_rep.get("counters", {})
+            total = _run_rep.get("total_wall") or sum(v["wall"] for v in stages.values()) or 1
+            # ai_backoff جزء من ai (مرحلة متداخلة) — لا تُجمع مرتين
+            measured = sum(v["wall"] for k, v in stages.items() if k not in _NESTED_STAGES)
+
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("⏱️ الزمن الكلي", f"{total:.1f}ث")
+            m2.metric("📦 المنتجات", cnt.get("products", 0))
+            m3.metric("🤖 أُرسل لـ AI", cnt.get("sent_to_ai", 0),
+                      f"{cnt.get('ai_cache_hits', 0)} من الكاش", delta_color="off")
+            m4.metric("🔁 إعادات / 429", f"{cnt.get('ai_retries', 0)} / {cnt.get('ai_429', 0)}")
+
+            rows = [{"المرحلة": _STAGE_LABELS.get(k, k), "الزمن (ث)": round(v["wall"], 2),
+                     "CPU (ث)": round(v["cpu"], 2), "النسبة %": round(v["wall"] / total * 100, 1),
+                     "المرات": v["calls"]}
+                    for k, v in sorted(stages.items(), key=lambda kv: -kv[1]["wall"])]
+            if total - measured > 0.05:
+                rows.append({"المرحلة": "غير مقاس", "الزمن (ث)": round(total - measured, 2),
+                             "CPU (ث)": None, "النسبة %": round((total - measured) / total * 100, 1),
+                             "المرات": None})
+            df_st = pd.DataFrame(rows)
+            st.bar_chart(df_st.set_index("المرحلة")["الزمن (ث)"])
+            st.dataframe(df_st, use_container_width=True, hide_index=True)
+
+            st.markdown("**العدادات**")
+            st.dataframe(pd.DataFrame([
+                {"العداد": _COUNTER_LABELS.get(k, k), "القيمة": v}
+                for k, v in sorted(cnt.items(), key=lambda kv: (kv[0].startswith("reject_"), kv[0]))
+            ]), use_container_width=True, hide_index=True)
+        else:
+            st.info("لا توجد تقارير تشغيل بعد — تُسجَّل مع كل تحليل جديد")
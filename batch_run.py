@@ -0,0 +1,232 @@
+"""
+batch_run.py - تشغيل التحليل الكامل من سطر الأوامر (بدون Streamlit) v1.0
+- للتشغيل الليلي: cron أو Railway scheduled job
+- read_file → run_full_analysis → find_missing_products → حفظ (DB + Parquet/CSV) → Make (اختياري)
+- --workers N: تقسيم منتجاتنا على N عملية (كل عملية تبني فهارس المنافسين مرة واحدة)
+- الاستيراد الثقيل (pandas/rapidfuzz/المحرك) بعد قراءة الوسائط فقط → --help فوري
+- stdout: سطر JSON واحد بالملخص | stderr: السجل | رمز الخروج:
+    0 نجاح · 1 فشل التحليل · 2 خطأ في المدخلات · 3 اكتمل التحليل وفشل جزء من إرسال Make
+
+أمثلة:
+    python batch_run.py our.xlsx competitors/ --workers 4 --no-ai
+    python batch_run.py our.csv comp1.csv comp2.xlsx --out results --push changed
+"""
+import argparse, json, os, sys, time, uuid
+
+EXIT_OK, EXIT_FAILED, EXIT_INPUT, EXIT_PUSH = 0, 1, 2, 3
+COMP_EXTS = (".csv", ".xlsx", ".xls")
+
+
+def _log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}", file=sys.stderr, flush=True)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(
+        prog="batch_run",
+        description="تحليل أسعار مهووس ضد ملفات المنافسين بدون الواجهة")
+    p.add_argument("our_file", help="ملف منتجاتنا (csv/xlsx)")
+    p.add_argument("competitors", nargs="+",
+                   help="ملفات المنافسين أو مجلد يحتويها")
+    p.add_argument("--out", default="batch_output", help="مجلد النتائج (افتراضي: batch_output)")
+    p.add_argument("--format", choices=("parquet", "csv"), default="parquet",
+                   help="صيغة الملفات (parquet يرجع لـ csv إذا لم تتوفر pyarrow)")
+    p.add_argument("--workers", type=int, default=1,
+                   help="عدد العمليات للمطابقة (افتراضي 1 = نفس العملية)")
+    p.add_argument("--no-ai", action="store_true", help="مطابقة fuzzy فقط بدون AI")
+    p.add_argument("--max-rows", type=int, default=0, help="حد أقصى لمنتجاتنا (0 = الكل)")
+    p.add_argument("--no-db", action="store_true", help="بدون حفظ في قاعدة البيانات")
+    p.add_argument("--push", choices=("none", "changed", "all"), default="none",
+                   help="إرسال تحديثات الأسعار لـ Make: changed = المتغيرة فقط")
+    p.add_argument("--push-missing", action="store_true",
+                   help="إرسال المنتجات المفقودة لـ Make كمنتجات جديدة")
+    return p.parse_args(argv)
+
+
+def _competitor_paths(items):
+    paths = []
+    for it in items:
+        if os.path.isdir(it):
+            paths += sorted(os.path.join(it, f) for f in os.listdir(it)
+                            if f.lower().endswith(COMP_EXTS) and not f.startswith((".", "~$")))
+        else:
+            paths.append(it)
+    return paths
+
+
+def _read(path):
+    from engines.engine import read_file
+    if not os.path.isfile(path):
+        return None, "الملف غير موجود"
+    with open(path, "rb") as f:
+        return read_file(f)
+
+
+def _analyze_chunk(our_df, comp_dfs, use_ai):
+    """تعمل داخل عملية فرعية — دالة على مستوى الوحدة حتى تُمرَّر بـ pickle"""
+    from engines.engine import run_full_analysis
+    return run_full_analysis(our_df, comp_dfs, use_ai=use_ai)
+
+
+def analyze(our_df, comp_dfs, workers=1, use_ai=True, report=None):
+    """
+    المطابقة + المفقودات؛ مع workers>1 تُقسم منتجاتنا وتعمل المفقودات بالتوازي معها
+    report: RunReport — تقارير الأجزاء تُدمج فيه (الزمن = مجموع أزمنة العمليات)
+    """
+    import numpy as np
+    import pandas as pd
+    from engines.engine import (run_full_analysis, find_missing_products, decision_categorical,
+                                RunReport)
+    report = report if report is not None else RunReport("analysis")
+
+    workers = max(1, min(int(workers), len(our_df) or 1))
+    if workers == 1:
+        last = [0]
+        def progress(p):
+            if p - last[0] >= 0.1 or p >= 1:
+                last[0] = p; _log(f"المطابقة {p * 100:.0f}%")
+        return (run_full_analysis(our_df, comp_dfs, progress_callback=progress, use_ai=use_ai,
+                                  report=report),
+                find_missing_products(our_df, comp_dfs, report=report))
+
+    from concurrent.futures import ProcessPoolExecutor
+    parts = [our_df.iloc[ix] for ix in np.array_split(np.arange(len(our_df)), workers)]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futs = [ex.submit(_analyze_chunk, part, comp_dfs, use_ai) for part in parts]
+        missing_f = ex.submit(find_missing_products, our_df, comp_dfs)
+        frames = []
+        for k, f in enumerate(futs, 1):
+            frames.append(f.result())
+            _log(f"المطابقة: اكتمل الجزء {k}/{workers}")
+        missing_df = missing_f.result()
+    for f in frames + [missing_df]:
+        report.merge(f.attrs.get("run_report"))
+    report.inc("workers", workers)
+    frames = [f for f in frames if not f.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if not df.empty:
+        # كل جزء له فئات قرار خاصة به → توحيدها بعد الدمج
+        df["القرار"] = decision_categorical(df["القرار"].astype(str).tolist())
+    return df, missing_df
+
+
+def write_outputs(out_dir, stamp, frames, fmt):
+    """DataFrames → ملفات؛ parquet يرجع لـ csv إذا لم تتوفر مكتبة parquet"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name, df in frames.items():
+        base = os.path.join(out_dir, f"{name}_{stamp}")
+        if fmt == "parquet":
+            try:
+                df.to_parquet(base + ".parquet", index=False)
+                paths[name] = base + ".parquet"; continue
+            except ImportError:
+                fmt = "csv"
+                _log("⚠️ pyarrow/fastparquet غير متوفرة → CSV")
+        df.to_csv(base + ".csv", index=False, encoding="utf-8-sig")
+        paths[name] = base + ".csv"
+    return paths
+
+
+def push_to_make(results, mode, push_missing):
+    """إرسال مباشر (العملية تنتهي بعده، فلا يُستخدم صندوق الإرسال الخلفي)"""
+    from utils.make_helper import export_to_make_format, send_price_updates, send_new_products
+    out, ok = {}, True
+    if mode != "none":
+        products = []
+        for key in ("price_raise", "price_lower"):
+            if results.count(key):
+                products += export_to_make_format(results[key].to_frame(), "update")
+        res = send_price_updates(products, only_changed=(mode == "changed")) if products \
+            else {"success": True, "message": "لا توجد تحديثات أسعار"}
+        out["prices"] = {k: res.get(k) for k in
+                         ("success", "message", "sent_items", "unchanged", "skipped")}
+        out["prices"]["failed_chunks"] = len(res.get("failed_chunks") or [])
+        ok &= bool(res.get("success"))
+    if push_missing and results.count("missing"):
+        res = send_new_products(export_to_make_format(results["missing"], "missing"))
+        out["missing"] = {"success": res.get("success"), "message": res.get("message"),
+                          "failed": sum(1 for r in res.get("results", []) if not r.get("success"))}
+        ok &= bool(res.get("success"))
+    return out, ok
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    t0 = time.time()
+    summary = {"status": "error", "our_file": args.our_file}
+
+    def done(code, **extra):
+        summary.update(extra, exit_code=code, elapsed_secs=round(time.time() - t0, 2))
+        print(json.dumps(summary, ensure_ascii=False, default=str), flush=True)
+        return code
+
+    # ── المدخلات ──
+    comp_paths = _competitor_paths(args.competitors)
+    if not comp_paths:
+        return done(EXIT_INPUT, error="لا توجد ملفات منافسين")
+    our_df, err = _read(args.our_file)
+    if err or our_df is None or our_df.empty:
+        return done(EXIT_INPUT, error=f"{args.our_file}: {err or 'ملف فارغ'}")
+    if args.max_rows > 0:
+        our_df = our_df.head(args.max_rows)
+    comp_dfs, skipped = {}, {}
+    for path in comp_paths:
+        cdf, cerr = _read(path)
+        if cerr or cdf is None or cdf.empty:
+            skipped[path] = cerr or "ملف فارغ"; _log(f"⚠️ {path}: {skipped[path]}")
+        else:
+            comp_dfs[os.path.basename(path)] = cdf
+    if not comp_dfs:
+        return done(EXIT_INPUT, error="تعذرت قراءة كل ملفات المنافسين", skipped_files=skipped)
+    summary.update(competitors=list(comp_dfs), skipped_files=skipped, rows=len(our_df))
+    _log(f"{len(our_df)} منتج × {len(comp_dfs)} منافس — workers={args.workers} "
+         f"ai={'off' if args.no_ai else 'on'}")
+
+    # ── التحليل ──
+    from engines.engine import RunReport
+    report = RunReport("batch")
+    try:
+        analysis_df, missing_df = analyze(our_df, comp_dfs, args.workers,
+                                          use_ai=not args.no_ai, report=report)
+    except Exception as e:
+        return done(EXIT_FAILED, error=f"التحليل: {e}")
+
+    from utils.results_index import AnalysisResults
+    results = AnalysisResults(analysis_df, missing_df)
+    matched = int((analysis_df["نسبة_التطابق"] > 0).sum()) if not analysis_df.empty else 0
+    summary.update(matched=matched, missing=len(missing_df),
+                   sections={k: results.count(k) for k in results.SECTIONS})
+
+    # ── الحفظ ──
+    job_id, stamp = str(uuid.uuid4())[:8], time.strftime("%Y%m%d_%H%M%S")
+    summary["job_id"] = job_id
+    try:
+        summary["outputs"] = write_outputs(args.out, stamp,
+                                           {"analysis": analysis_df, "missing": missing_df},
+                                           args.format)
+        if not args.no_db:
+            from engines.engine import fingerprint_inputs
+            from engines.pipeline import finish_analysis
+            from utils.db_manager import save_job_progress
+            comp_names = ",".join(comp_dfs)
+            save_job_progress(job_id, len(our_df), 0, [], "running",
+                              os.path.basename(args.our_file), comp_names,
+                              fingerprint=fingerprint_inputs(our_df, comp_dfs))
+            finish_analysis(job_id, len(our_df), analysis_df, missing_df,
+                            os.path.basename(args.our_file), comp_names, report=report)
+    except Exception as e:
+        return done(EXIT_FAILED, error=f"الحفظ: {e}")
+    summary["report"] = report.to_dict()
+    _log(f"✅ {matched} مطابق · {len(missing_df)} مفقود → {args.out}")
+
+    # ── Make ──
+    if args.push != "none" or args.push_missing:
+        summary["push"], ok = push_to_make(results, args.push, args.push_missing)
+        if not ok:
+            return done(EXIT_PUSH, status="push_failed")
+    return done(EXIT_OK, status="ok")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+bench/accuracy.py - دقة + سرعة المطابقة على أزواج مُعلَّمة (match_pairs.jsonl)
+- كل سطر: {"our", "comp", "label": match | non_match | line_conflict, "tag"}
+  line_conflict = نفس الماركة وخط إنتاج مختلف (Hero/London، No 5/No 19، فلانكر) → يجب رفضه
+- فهرس واحد مشترك لكل أسماء comp المختلفة + ضجيج اصطناعي (bench.catalog) بحجم --distractors
+- الزوج "مقبول" إذا ظهر comp بين مرشحي CompIndex لاسم our (نفس قرار الـ fuzzy قبل AI)
+- الأوضاع: serial (search) · cdist (search_many) · parallel (عمليات fork)
+  · cached (كاش match_service._prepared لـ prepare_query دافئاً + search — مسار الخدمة الفعلي)
+- يفشل (exit 1) إذا اختلفت قرارات أي وضع عن serial، أو تراجعت precision/recall عن baseline
+- accuracy_baseline.json مُثبّت في المستودع: الدقة حتمية لا تعتمد على الجهاز فتُقارن دائماً
+- السرعة تُقارن فقط مع --timing (ضجيج الجهاز/الحمل يجعلها غير صالحة كبوابة افتراضية):
+  سجّل baseline محلياً على نفس الجهاز ثم قارن بـ --timing --baseline <ملفك>
+
+    python -m bench.accuracy
+    python -m bench.accuracy --save-baseline
+    python -m bench.accuracy --modes serial cdist --accuracy-tolerance 0.02
+    python -m bench.accuracy --timing --tolerance 0.25 --baseline /tmp/acc_local.json
+"""
+import argparse, json, os, platform, sys, time
+from collections import Counter
+
+import pandas as pd
+
+import engines.engine as engine
+from bench.catalog import make_catalogs
+
+HERE     = os.path.dirname(os.path.abspath(__file__))
+PAIRS    = os.path.join(HERE, "match_pairs.jsonl")
+BASELINE = os.path.join(HERE, "accuracy_baseline.json")
+MODES    = ["serial", "cdist", "parallel", "cached"]
+LABELS   = ("match", "non_match", "line_conflict")
+TOP_N    = 5
+NOISE_MS = 0.05   # فروق أصغر من هذا (ms/استعلام) لا تُعد تراجعاً — وضع cached يقيس ميكروثوانٍ
+
+_INDEX = None    # الفهرس المشترك — عام حتى ترثه العمليات الفرعية مع fork بدون pickle
+
+
+def load_pairs(path):
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            p = json.loads(line)
+            if p.get("label") not in LABELS or not p.get("our") or not p.get("comp"):
+                raise ValueError(f"{path}:{n}: زوج غير صالح")
+            pairs.append(p)
+    return pairs
+
+
+def build_index(pairs, distractors=2000, seed=0):
+    """أسماء comp المختلفة + منتجات اصطناعية كضجيج → CompIndex واحد"""
+    names = list(dict.fromkeys(p["comp"] for p in pairs))
+    if distractors > 0:
+        _, comps = make_catalogs(distractors, competitors=1, seed=seed)
+        seen = set(names)
+        names += [x for x in dict.fromkeys(comps["comp_1"]["المنتج"].tolist()) if x not in seen]
+    df = pd.DataFrame({"المنتج": names, "السعر": [100.0] * len(names),
+                       "رقم المنتج": [f"B-{i}" for i in range(len(names))]})
+    return engine.CompIndex.from_df(df, "bench")
+
+
+# ─── الأوضاع: كل وضع → قائمة أسماء المرشحين لكل استعلام ───
+def _names(cands):
+    return [c["name"] for c in cands]
+
+
+def _search_one(name):
+    return _names(_INDEX.search(**engine.prepare_query(name), top_n=TOP_N))
+
+
+def run_serial(queries):
+    return [_search_one(q) for q in queries]
+
+
+def run_cdist(queries):
+    return [_names(c) for c in
+            _INDEX.search_many([engine.prepare_query(q) for q in queries], top_n=TOP_N)]
+
+
+def run_parallel(queries, workers=None):
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    try:
+        ctx = mp.get_context("fork")
+    except ValueError:     # ويندوز: بدون fork → الفهرس لا يُورَّث
+        return run_serial(queries)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        return list(ex.map(_search_one, queries, chunksize=max(1, len(queries) // (workers * 4))))
+
+
+def run_cached(queries):
+    """
+    كاش الخدمة الحقيقي (match_service._prepared = lru_cache لـ prepare_query):
+    تشغيل بارد يملؤه ثم دافئ يُقاس — البحث نفسه بلا كاش كما في match()
+    """
+    from match_service import _prepared
+    _prepared.cache_clear()
+    for q in queries: _prepared(q.strip())
+    t0 = time.perf_counter()
+    out = [_names(_INDEX.search(**dict(_prepared(q.strip())), top_n=TOP_N)) for q in queries]
+    return out, time.perf_counter() - t0
+
+
+def run_mode(mode, queries):
+    t0 = time.perf_counter()
+    if mode == "cached":
+        out, secs = run_cached(queries)
+    else:
+        out = {"serial": run_serial, "cdist": run_cdist, "parallel": run_parallel}[mode](queries)
+        secs = time.perf_counter() - t0
+    return out, secs
+
+
+# ─── المقاييس ───
+def score(pairs, results):
+    """
+    positive = label match. accepted = comp بين المرشحين، top1 = comp هو المرشح الأول
+    تُرجع precision/recall/f1 + دقة الرفض لكل نوع + top1 + الأخطاء
+    """
+    tp = fp = fn = top1 = 0
+    rejected, seen = Counter(), Counter(p["label"] for p in pairs)
+    errors = []
+    for p, cands in zip(pairs, results):
+        acc = p["comp"] in cands
+        if p["label"] == "match":
+            if acc: tp += 1
+            else:   fn += 1; errors.append(("FN", p))
+            top1 += bool(cands) and cands[0] == p["comp"]
+        elif acc:
+            fp += 1; errors.append(("FP", p))
+        else:
+            rejected[p["label"]] += 1
+    prec = tp / (tp + fp) if tp + fp else 1.0
+    rec  = tp / (tp + fn) if tp + fn else 1.0
+    return {"precision": round(prec, 4), "recall": round(rec, 4),
+            "f1": round(2 * prec * rec / (prec + rec), 4) if prec + rec else 0.0,
+            "top1": round(top1 / max(seen["match"], 1), 4),
+            "reject_non_match": round(rejected["non_match"] / max(seen["non_match"], 1), 4),
+            "reject_line_conflict": round(rejected["line_conflict"] / max(seen["line_conflict"], 1), 4),
+            "tp": tp, "fp": fp, "fn": fn}, errors
+
+
+def compare(results, baseline, tolerance, acc_tolerance, timing=True):
+    """
+    [(mode, metric, base, now, regressed)] — الزمن بنسبة tolerance والدقة بفرق مطلق
+    timing=False (الافتراضي في main): الدقة فقط
+    """
+    base = {r["mode"]: r for r in baseline.get("results", [])}
+    rows = []
+    for r in results:
+        b = base.get(r["mode"])
+        if not b: continue
+        for m in ("precision", "recall", "reject_line_conflict"):
+            rows.append((r["mode"], m, b[m], r[m], r[m] < b[m] - acc_tolerance))
+        if not timing: continue
+        slow = r["ms_per_query"] > b["ms_per_query"] * (1 + tolerance) and \
+            r["ms_per_query"] - b["ms_per_query"] > NOISE_MS
+        rows.append((r["mode"], "ms_per_query", b["ms_per_query"], r["ms_per_query"], slow))
+    return rows
+
+
+def main(argv=None):
+    global _INDEX
+    p = argparse.ArgumentParser(prog="bench.accuracy", description="دقة وسرعة محرك المطابقة")
+    p.add_argument("--pairs", default=PAIRS)
+    p.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    p.add_argument("--distractors", type=int, default=2000,
+                   help="منتجات اصطناعية تُضاف للفهرس كضجيج (0 = الأزواج فقط)")
+    p.add_argument("--repeat", type=int, default=20,
+                   help="تكرار الاستعلامات لقياس السرعة (القرارات من الدورة الأولى)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--baseline", default=BASELINE)
+    p.add_argument("--timing", action="store_true",
+                   help="مقارنة السرعة أيضاً (baseline من نفس الجهاز فقط)")
+    p.add_argument("--tolerance", type=float, default=0.25,
+                   help="تراجع السرعة المسموح مع --timing (0.25 = أبطأ 25%%)")
+    p.add_argument("--accuracy-tolerance", type=float, default=0.0,
+                   help="تراجع precision/recall المسموح (فرق مطلق)")
+    p.add_argument("--save-baseline", action="store_true")
+    p.add_argument("-v", "--verbose", action="store_true", help="طباعة الأزواج الخاطئة")
+    args = p.parse_args(argv)
+
+    pairs = load_pairs(args.pairs)
+    t0 = time.perf_counter()
+    _INDEX = build_index(pairs, args.distractors, args.seed)
+    print(f"📚 {len(pairs)} زوج · فهرس {len(_INDEX.valid_idx)} منتج "
+          f"({time.perf_counter() - t0:.2f}s)", file=sys.stderr)
+
+    queries = [q["our"] for q in pairs]
+    ref = run_serial(queries)     # المرجع للمقارنة بين الأوضاع + تسخين قبل القياس
+    results, decisions, failed = [], {}, []
+    for mode in args.modes:
+        out, secs = run_mode(mode, queries * max(args.repeat, 1))
+        decisions[mode] = out[:len(queries)]
+        metrics, errors = score(pairs, decisions[mode])
+        n = len(queries) * max(args.repeat, 1)
+        results.append({"mode": mode, **metrics, "queries": n, "secs": round(secs, 4),
+                        "qps": round(n / max(secs, 1e-9), 1),
+                        "ms_per_query": round(secs / max(n, 1) * 1000, 3)})
+        if args.verbose and mode == args.modes[0]:
+            for kind, pr in errors:
+                print(f"  {kind} [{pr['label']}/{pr.get('tag', '')}] {pr['our']}  ↔  {pr['comp']}",
+                      file=sys.stderr)
+
+    print(f"\n{'mode':<9} {'prec':>6} {'recall':>6} {'top1':>6} {'rejLC':>6} {'rejNM':>6}"
+          f" {'qps':>9} {'ms/q':>8}")
+    for r in results:
+        print(f"{r['mode']:<9} {r['precision']:>6.3f} {r['recall']:>6.3f} {r['top1']:>6.3f}"
+              f" {r['reject_line_conflict']:>6.3f} {r['reject_non_match']:>6.3f}"
+              f" {r['qps']:>9.1f} {r['ms_per_query']:>8.3f}")
+
+    # كل الأوضاع يجب أن تعطي نفس المرشحين (بنفس الترتيب) مثل serial
+    for mode, out in decisions.items():
+        diff = [queries[i] for i, (a, b) in enumerate(zip(ref, out)) if a != b]
+        if diff:
+            failed.append(f"{mode}: {len(diff)} استعلام يختلف عن serial (مثال: {diff[0]})")
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "pairs": len(pairs),
+              "params": {"distractors": args.distractors, "repeat": args.repeat,
+                         "seed": args.seed, "top_n": TOP_N,
+                         "match_threshold": engine.MATCH_THRESHOLD},
+              "cpus": os.cpu_count(), "machine": platform.node(), "results": results}
+    if args.save_baseline and not failed:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"📌 baseline → {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        if args.timing and base.get("machine") != platform.node():
+            print(f"⚠️ baseline من جهاز آخر ({base.get('machine', '?')}) — أرقام السرعة غير قابلة "
+                  f"للمقارنة", file=sys.stderr)
+        rows = compare(results, base, args.tolerance, args.accuracy_tolerance, args.timing)
+        print(f"\n{'mode':<9} {'metric':<21} {'base':>9} {'now':>9}")
+        for mode, m, b, now, bad in rows:
+            print(f"{mode:<9} {m:<21} {b:>9} {now:>9}{'  ❌' if bad else ''}")
+        failed += [f"{mode}: {m} {b} → {now}" for mode, m, b, now, bad in rows if bad]
+
+    for f in failed:
+        print(f"❌ {f}")
+    print("✅ لا تراجع" if not failed else f"❌ {len(failed)} فشل")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
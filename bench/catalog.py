@@ -0,0 +1,107 @@
+"""
+bench/catalog.py - مولّد كتالوجات عطور اصطناعية (حتمي بالـ seed)
+- الماركات من KNOWN_BRANDS، والصيغ العربية/الإنجليزية من مرادفات _SYN في المحرك
+- خطوط إنتاج متشابهة عمداً (No 10 / No 11، Hero / London) + أحجام + تركيزات
+- تستر / طقم / عينات بنسب ثابتة، وضجيج مضبوط: حذف التركيز، أخطاء إملائية، "عطر"، مسافات
+- منافس = نسبة تداخل من منتجاتنا (بكتابة مختلفة) + منتجات غير موجودة عندنا (→ مفقودات)
+"""
+import random
+import pandas as pd
+
+from engines.engine import KNOWN_BRANDS, _SYN
+
+LINES = ["Sauvage", "Bleu", "Hero", "London", "Eros", "Aventus", "Oud Wood", "Code",
+         "No 10", "No 11", "212", "Bloom", "Y", "Boss Bottled", "Light Blue", "Black Opium",
+         "Good Girl", "Invictus", "Luna Rossa", "Terre", "Vetiver", "Amber", "Musk", "Rose"]
+FLANKERS = ["", "", "", "Intense", "Elixir", "Noir", "Absolu", "Sport", "Night", "Gold"]
+SIZES    = [30, 50, 75, 90, 100, 100, 100, 125, 150, 200]
+CONCS    = {"EDP": ["EDP", "Eau de Parfum", "او دو بارفان", "بارفان"],
+            "EDT": ["EDT", "Eau de Toilette", "او دو تواليت", "تواليت"]}
+GENDERS  = {"رجالي": ["for men", "للرجال", "pour homme"],
+            "نسائي": ["for women", "للنساء", "pour femme"], "": [""]}
+
+# ماركة إنجليزية → صيغها العربية من _SYN ("ديور" → "dior")
+_AR = {}
+for _k, _v in _SYN.items():
+    if any("؀" <= ch <= "ۿ" for ch in _k):
+        _AR.setdefault(_v, []).append(_k)
+
+
+def _brands():
+    seen, out = set(), []
+    for b in KNOWN_BRANDS:
+        if b.isascii() and b.lower() not in seen:
+            seen.add(b.lower()); out.append(b)
+    return out
+
+
+def _universe(rng, n):
+    """n منتج فريد: (brand, line, conc, size, gender, variant)"""
+    brands, items, keys = _brands(), [], set()
+    while len(items) < n:
+        line = f"{rng.choice(LINES)} {rng.choice(FLANKERS)}".strip()
+        p = (rng.choice(brands), line, rng.choice(list(CONCS)), rng.choice(SIZES),
+             rng.choice(list(GENDERS)),
+             rng.choices(["retail", "tester", "set"], weights=[85, 12, 3])[0])
+        if p not in keys:
+            keys.add(p); items.append(p)
+    return items
+
+
+def _typo(rng, s):
+    if len(s) < 5: return s
+    i = rng.randrange(1, len(s) - 2)
+    return s[:i] + s[i + 1] + s[i] + s[i + 2:]
+
+
+def render(rng, p, noise=0.3, arabic=None):
+    """منتج → اسم كما يكتبه متجر (عربي أو إنجليزي + ضجيج)"""
+    brand, line, conc, size, gender, variant = p
+    arabic = rng.random() < 0.5 if arabic is None else arabic
+    b = rng.choice(_AR.get(brand.lower(), [brand])) if arabic else brand
+    parts = (["عطر"] if arabic and rng.random() < 0.7 else []) + [b, line]
+    if rng.random() >= noise * 0.5:
+        parts.append(rng.choice(CONCS[conc][2:] if arabic else CONCS[conc][:2]))
+    parts.append(f"{size} مل" if arabic else f"{size}ml")
+    g = rng.choice(GENDERS[gender])
+    if g: parts.append(g)
+    if variant == "tester": parts.append("تستر" if arabic else "Tester")
+    if variant == "set":    parts.insert(0, "طقم" if arabic else "Gift Set")
+    name = " ".join(parts)
+    if rng.random() < noise * 0.3: name = _typo(rng, name)
+    if rng.random() < noise * 0.3: name = name.replace(" ", "  ", 1)
+    if rng.random() < noise * 0.2: name = name.upper()
+    return name
+
+
+def make_catalogs(n_ours, n_comp=None, competitors=2, overlap=0.6, noise=0.3,
+                  samples=0.02, seed=0):
+    """
+    يُرجع (our_df, {"comp_1": df, ...}) بأعمدة المحرك: المنتج / السعر / رقم المنتج
+    overlap: نسبة منتجات المنافس الموجودة عندنا | samples: نسبة العينات (تُستبعد في المحرك)
+    """
+    rng = random.Random(seed)
+    n_comp = n_comp or n_ours
+    shared = int(n_comp * overlap)
+    universe = _universe(rng, n_ours + (n_comp - shared) * competitors)
+    ours, extra = universe[:n_ours], universe[n_ours:]
+    base = {p: rng.randint(90, 1500) for p in universe}
+
+    our_df = pd.DataFrame({
+        "المنتج": [render(rng, p, noise=noise / 2) for p in ours],
+        "السعر": [base[p] for p in ours],
+        "رقم المنتج": [100000 + i for i in range(len(ours))],
+    })
+    comp_dfs = {}
+    for c in range(competitors):
+        picked = rng.sample(ours, min(shared, len(ours)))
+        picked += extra[c * (n_comp - shared):(c + 1) * (n_comp - shared)]
+        names = [render(rng, p, noise=noise) for p in picked]
+        for i in rng.sample(range(len(names)), int(len(names) * samples)):
+            names[i] += rng.choice([" sample 2ml", " عينة", " decant"])
+        comp_dfs[f"comp_{c + 1}"] = pd.DataFrame({
+            "المنتج": names,
+            "السعر": [round(base[p] * rng.uniform(0.8, 1.2), 2) for p in picked],
+            "رقم المنتج": [f"C{c + 1}-{i}" for i in range(len(picked))],
+        })
+    return our_df, comp_dfs
@@ -0,0 +1,179 @@
+"""
+bench/run.py - قياس أداء المحرك من البداية للنهاية
+- كتالوجات اصطناعية حتمية (bench.catalog) بأحجام 1k / 10k / 100k
+- المراحل: normalize · بناء CompIndex · search · run_full_analysis (AI وهمي) ·
+  find_missing_products · export_to_make_format · export_excel · كتابة DB (ملف مؤقت)
+- المراحل التربيعية (تحليل/مفقودات) تُقاس على عينة --analysis-rows والمقياس لكل صف
+- النتائج JSON في bench/results، والمقارنة مع baseline تفشل (exit 1) عند التراجع
+- baseline.json خاص بالجهاز (أزمنة مطلقة) → غير مُتتبَّع في git؛ أنشئه مرة على جهاز القياس
+  بـ --save-baseline قبل أي تعديل، ثم قارن بعده. بدونه يُحفظ التقرير فقط ولا مقارنة
+
+    python -m bench.run                            # 1k + 10k
+    python -m bench.run --sizes 1000 10000 100000  # الحجم الكامل (بطيء: بناء الفهارس)
+    python -m bench.run --save-baseline            # تثبيت الأرقام الحالية كمرجع
+    python -m bench.run --baseline bench/baseline.json --tolerance 0.25
+"""
+import argparse, json, os, platform, sys, tempfile, time
+from contextlib import contextmanager
+
+import pandas as pd
+
+import engines.engine as engine
+from bench.catalog import make_catalogs
+
+HERE     = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+STAGES   = ["normalize", "index_build", "search", "full_analysis", "missing",
+            "export_make", "export_excel", "db_write"]
+NOISE_US = 5.0    # فروق أصغر من هذا (µs/صف) لا تُعد تراجعاً
+
+
+@contextmanager
+def mocked_ai():
+    """AI وهمي: يختار أول مرشح فوراً — يقيس مسار الدفعات بدون شبكة"""
+    real = engine._ai_batch
+    engine._ai_batch = lambda batch, report=None: [0] * len(batch)
+    try: yield
+    finally: engine._ai_batch = real
+
+
+@contextmanager
+def temp_db():
+    import utils.db_manager as db
+    real = db.DB_PATH
+    with tempfile.TemporaryDirectory() as d:
+        db.DB_PATH = os.path.join(d, "bench.db")
+        db.init_db()
+        try: yield
+        finally:
+            db.close_db(); db.DB_PATH = real
+
+
+def _tile(df, n):
+    """تكرار نتائج العينة حتى n صف (لقياس التصدير والكتابة بالحجم الكامل)"""
+    if df.empty: return df
+    reps = -(-n // len(df))
+    return pd.concat([df] * reps, ignore_index=True).head(n)
+
+
+def run_size(n, analysis_rows, search_rows, stages, seed=0):
+    our_df, comp_dfs = make_catalogs(n, seed=seed)
+    comp_rows = sum(len(c) for c in comp_dfs.values())
+    out = []
+
+    def timed(stage, rows, fn):
+        if stage not in stages: return None
+        t0, c0 = time.perf_counter(), time.process_time()
+        res = fn()
+        secs, cpu = time.perf_counter() - t0, time.process_time() - c0
+        out.append({"size": n, "stage": stage, "rows": rows, "secs": round(secs, 4),
+                    "cpu_secs": round(cpu, 4), "us_per_row": round(secs / max(rows, 1) * 1e6, 2)})
+        print(f"  {n:>7} {stage:<14} {rows:>7} صف  {secs:8.3f}s  "
+              f"{out[-1]['us_per_row']:>10.1f} µs/صف", file=sys.stderr, flush=True)
+        return res
+
+    names = [x for c in comp_dfs.values() for x in c["المنتج"].tolist()]
+    timed("normalize", len(names), lambda: [engine.normalize(x) for x in names])
+
+    indices = timed("index_build", comp_rows,
+                    lambda: [engine.CompIndex.from_df(c, k) for k, c in comp_dfs.items()])
+    if indices is None:
+        indices = [engine.CompIndex.from_df(c, k) for k, c in comp_dfs.items()]
+    queries = our_df["المنتج"].head(search_rows).tolist()
+
+    def search_all():
+        for q in queries:
+            p = engine.prepare_query(q)
+            for idx in indices: idx.search(**p, top_n=5)
+    timed("search", len(queries), search_all)
+
+    sample = our_df.head(analysis_rows)
+    comp_sample = {k: c.head(analysis_rows) for k, c in comp_dfs.items()}
+    with mocked_ai():
+        analysis = timed("full_analysis", len(sample),
+                         lambda: engine.run_full_analysis(sample, comp_dfs))
+        if analysis is None:   # المرحلة غير مختارة — النتائج لازمة للتصدير
+            analysis = engine.run_full_analysis(sample, comp_dfs)
+    timed("missing", len(sample) + sum(len(c) for c in comp_sample.values()),
+          lambda: engine.find_missing_products(sample, comp_sample))
+
+    full = _tile(analysis, n)
+    from utils.make_helper import export_to_make_format
+    timed("export_make", len(full), lambda: export_to_make_format(full, "update"))
+    timed("export_excel", len(full), lambda: engine.export_excel(full))
+    if "db_write" in stages:
+        from engines.pipeline import save_price_history
+        with temp_db():
+            timed("db_write", len(full), lambda: save_price_history(full))
+    return out
+
+
+def compare(results, baseline, tolerance):
+    """[(size, stage, base_us, new_us, ratio, regressed)] للمراحل المشتركة"""
+    base = {(r["size"], r["stage"]): r for r in baseline.get("results", [])}
+    rows = []
+    for r in results:
+        b = base.get((r["size"], r["stage"]))
+        if not b: continue
+        ratio = r["us_per_row"] / max(b["us_per_row"], 1e-9)
+        bad = ratio > 1 + tolerance and r["us_per_row"] - b["us_per_row"] > NOISE_US
+        rows.append((r["size"], r["stage"], b["us_per_row"], r["us_per_row"], round(ratio, 2), bad))
+    return rows
+
+
+def _env():
+    import numpy, rapidfuzz
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "pandas": pd.__version__, "numpy": numpy.__version__,
+            "rapidfuzz": rapidfuzz.__version__}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="bench.run", description="قياس أداء محرك المطابقة")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    p.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    p.add_argument("--analysis-rows", type=int, default=500,
+                   help="عينة منتجاتنا لمرحلتي التحليل والمفقودات")
+    p.add_argument("--search-rows", type=int, default=2000, help="عدد استعلامات search")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", default=os.path.join(HERE, "results"))
+    p.add_argument("--baseline", default=BASELINE)
+    p.add_argument("--tolerance", type=float, default=0.25,
+                   help="نسبة التراجع المسموحة لكل مرحلة (0.25 = أبطأ 25%%)")
+    p.add_argument("--save-baseline", action="store_true")
+    args = p.parse_args(argv)
+
+    results = []
+    for n in args.sizes:
+        results += run_size(n, args.analysis_rows, args.search_rows, set(args.stages), args.seed)
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "env": _env(),
+              "params": {"analysis_rows": args.analysis_rows, "search_rows": args.search_rows,
+                         "seed": args.seed}, "results": results}
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"💾 {path}", file=sys.stderr)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"📌 baseline → {args.baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️ لا يوجد baseline ({args.baseline}) — أنشئه بـ --save-baseline", file=sys.stderr)
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        rows = compare(results, json.load(f), args.tolerance)
+    bad = [r for r in rows if r[5]]
+    print(f"\n{'size':>7} {'stage':<14} {'base µs':>10} {'now µs':>10} {'ratio':>6}")
+    for size, stage, b, now, ratio, regressed in rows:
+        print(f"{size:>7} {stage:<14} {b:>10.1f} {now:>10.1f} {ratio:>6.2f}"
+              f"{'  ❌' if regressed else ''}")
+    print(f"\n{'❌ تراجع في ' + str(len(bad)) + ' مرحلة' if bad else '✅ لا تراجع'}")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -125,6 +125,61 @@ PRICE_TOLERANCE    = 5
 MIN_MATCH_SCORE    = MATCH_THRESHOLD
 HIGH_MATCH_SCORE   = HIGH_CONFIDENCE
 PRICE_DIFF_THRESHOLD = PRICE_TOLERANCE
+# AI غير متاح (قاطع مفتوح / بلا مفاتيح): أفضل مرشح fuzzy بهذه الدرجة فأعلى يُسعّر تلقائياً
+# والأقل منها → "تحت المراجعة" (المرشحون أصلاً ≥ MATCH_THRESHOLD)
+AI_FALLBACK_ACCEPT_SCORE = 90
+
+# ══════════════════════════════════════════════
+#  صيانة قاعدة البيانات (مدة الاحتفاظ بالأيام)
+# ══════════════════════════════════════════════
+DB_RETENTION = {
+    "events":           90,   # أحداث الواجهة → حذف
+    "price_history":    90,   # يومي → أسبوعي (مع الاحتفاظ بنقاط تغير السعر)
+    "job_payloads":     14,   # نتائج المهام القديمة → أرشيف مضغوط
+    "job_archive":      180,  # الأرشيف المضغوط → حذف
+    "analysis_history": 365,
+    "make_outbox":      30,   # رسائل Make المُرسلة/الميتة → حذف
+    "ai_cache":         30,   # ردود AI المخزنة (أطول من أي TTL في AI_CACHE_TTL) → حذف
+}
+DB_MAINTENANCE_INTERVAL_HOURS = 24
+
+# ══════════════════════════════════════════════
+#  كاش ردود AI (بالساعات لكل دالة) — الأسعار تتغير، المكونات والأوصاف ثابتة
+# ══════════════════════════════════════════════
+AI_CACHE_TTL = {
+    "verify_match":                 24 * 30,
+    "search_market_price":          6,
+    "fetch_fragrantica_info":       24 * 30,
+    "search_mahwous":               24,
+    "generate_mahwous_description": 24 * 30,
+}
+AI_CACHE_MEMORY_ITEMS = 512   # LRU داخل العملية أمام SQLite
+
+# سباق مزودي AI: بعد هذه المهلة (ثوانٍ) بلا رد يبدأ المزود التالي بالتوازي
+# 0 = تلقائي (p90 لزمن المزود الأخير بين 1.5 و 8 ثوانٍ)
+AI_HEDGE_DELAY_SECS   = 0
+AI_RACE_DEADLINE_SECS = 45    # الحد الأقصى لانتظار call_ai مهما كان عدد المزودين
+
+# إثراء المنتجات المفقودة في الخلفية (صورة + مكونات + وصف مهووس)
+ENRICH_TOP_N      = 50    # أعلى N مفقود بالأولوية بعد كل تحليل
+ENRICH_WORKERS    = 3     # طلبات متزامنة داخل مهمة الإثراء
+ENRICH_STALE_DAYS = 30    # أقدم من هذا → يُعاد جلبه
+MAHWOUS_BATCH_SIZE    = 6   # أوصاف مهووس في طلب Gemini واحد (مصفوفة JSON)
+MAHWOUS_BATCH_WORKERS = 0   # دفعات متزامنة (0 = بعدد مفاتيح Gemini)
+
+# قاطع الدائرة لكل مزود AI: فشل متكرر → رفض فوري (fuzzy فقط في المطابقة) حتى انتهاء التهدئة
+AI_BREAKER = {
+    "failure_threshold": 5,     # عدد الإخفاقات ...
+    "window_secs":       60,    # ... خلال هذه النافذة → فتح
+    "cooldown_secs":     30,    # مدة الفتح قبل طلب تجريبي (تتضاعف مع كل تجربة فاشلة)
+    "max_cooldown_secs": 300,
+}
+
+# ══════════════════════════════════════════════
+#  المهام الخلفية
+# ══════════════════════════════════════════════
+JOB_CONCURRENCY  = 2            # تحليلات تعمل بالتوازي (الباقي ينتظر)
+JOB_TIMEOUT_SECS = 3 * 3600     # مهلة قصوى لكل تحليل
 
 # ══════════════════════════════════════════════
 #  فلاتر المنتجات
@@ -1,12 +1,38 @@
 """
-engines/ai_engine.py v19.0
+engines/ai_engine.py v19.2
 - Gemini مباشر + Grounding (بحث حقيقي)
+- بث الردود (SSE): gemini_chat_stream / call_ai_stream → أجزاء فور وصولها (Gemini ثم OpenRouter)
 - fragranticarabia.com → صور + مكونات العطور
-- Mahwous وصف خاص للمنتجات المفقودة
+- Mahwous وصف خاص للمنتجات المفقودة — فردي أو دفعات (عدة منتجات في طلب واحد → مصفوفة JSON)
 - تحقق منتج | بحث سوق | تحليل مجمع | دردشة
+- كاش الردود: LRU في الذاكرة ← جدول ai_cache (TTL لكل دالة من AI_CACHE_TTL)
+- call_ai: سباق مزودين بالتحوط (Gemini ثم OpenRouter ثم Cohere بعد مهلة أو فشل) بدل التسلسل
+- كل طلب يمر عبر قاطع دائرة المزود (engines.circuit): المزود المعطل يُتخطى فوراً
 """
-import requests, json, re, time
+import requests, json, re, time, hashlib, threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from functools import wraps
 from config import GEMINI_API_KEYS, OPENROUTER_API_KEY, COHERE_API_KEY
+from engines.circuit import breaker, http_failed
+try:
+    from config import AI_CACHE_TTL, AI_CACHE_MEMORY_ITEMS
+except:
+    AI_CACHE_TTL = {"verify_match": 720, "search_market_price": 6, "fetch_fragrantica_info": 720,
+                    "search_mahwous": 24, "generate_mahwous_description": 720}
+    AI_CACHE_MEMORY_ITEMS = 512
+try:
+    from config import AI_HEDGE_DELAY_SECS, AI_RACE_DEADLINE_SECS
+except:
+    AI_HEDGE_DELAY_SECS, AI_RACE_DEADLINE_SECS = 0, 45
+try:
+    from config import MAHWOUS_BATCH_SIZE, MAHWOUS_BATCH_WORKERS
+except:
+    MAHWOUS_BATCH_SIZE, MAHWOUS_BATCH_WORKERS = 6, 0
+try:
+    from utils.db_manager import ai_cache_get, ai_cache_put
+except:
+    ai_cache_get = ai_cache_put = None
 
 _GM  = "gemini-2.0-flash"
 _GU  = f"https://generativelanguage.googleapis.com/v1beta/models/{_GM}:generateContent"
@@ -37,27 +63,138 @@ PAGE_PROMPTS = {
 أجب JSON: {"market_price":0,"price_range":{"min":0,"max":0},"competitors":[{"name":"","price":0}],"recommendation":""}""",
 }
 
+# ══ كاش الردود ══════════════════════════════
+# المفتاح = sha256(الدالة، المدخلات بعد التطبيع، PROMPT_VERSION، النموذج)
+# غيّر PROMPT_VERSION عند تعديل أي prompt مخزّن → تُهمل الردود القديمة تلقائياً
+PROMPT_VERSION = 1
+_MEM      = OrderedDict()     # key → (وقت التخزين epoch, الرد)
+_MEM_LOCK = threading.Lock()
+CACHE_STATS = {}              # fn → Counter(mem_hits, db_hits, misses, stores)
+
+def _norm_arg(v):
+    if isinstance(v, str):   return " ".join(v.lower().split())
+    if isinstance(v, bool) or v is None: return v
+    if isinstance(v, (int, float)): return round(float(v), 2)
+    if isinstance(v, dict):  return {str(k): _norm_arg(x) for k, x in sorted(v.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(v, (list, tuple)): return [_norm_arg(x) for x in v]
+    return str(v)
+
+def _cache_key(fn, args):
+    raw = json.dumps([fn, _norm_arg(list(args)), PROMPT_VERSION, _GM],
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _mem_put(key, value, at):
+    with _MEM_LOCK:
+        _MEM[key] = (at, value); _MEM.move_to_end(key)
+        while len(_MEM) > AI_CACHE_MEMORY_ITEMS:
+            _MEM.popitem(last=False)
+
+def _cache_get(fn_name, key):
+    """الذاكرة ← SQLite → القيمة أو None"""
+    ttl = AI_CACHE_TTL.get(fn_name, 0) * 3600
+    st = CACHE_STATS.setdefault(fn_name, Counter())
+    with _MEM_LOCK:
+        hit = _MEM.get(key)
+        if hit and time.time() - hit[0] < ttl:
+            _MEM.move_to_end(key); st["mem_hits"] += 1
+            return json.loads(hit[1])
+    row = ai_cache_get(key, ttl / 3600) if ai_cache_get else None
+    if row:
+        try:
+            at = time.mktime(time.strptime(row[1], "%Y-%m-%d %H:%M:%S"))
+            value = json.loads(row[0])
+            _mem_put(key, row[0], at); st["db_hits"] += 1
+            return value
+        except: pass
+    return None
+
+def _cache_put(fn_name, key, value):
+    """يخزّن الرد الناجح فقط: dict فيه success، أو نص غير فارغ"""
+    ok = value.get("success") if isinstance(value, dict) else bool(value)
+    if not ok: return
+    raw = json.dumps(value, ensure_ascii=False)
+    _mem_put(key, raw, time.time())
+    if ai_cache_put: ai_cache_put(key, fn_name, raw, _GM)
+    CACHE_STATS.setdefault(fn_name, Counter())["stores"] += 1
+
+def _cached(fn_name):
+    """
+    يخزّن الرد الناجح فقط (None/فشل لا يُخزّن)
+    الترتيب: الذاكرة ← SQLite ← الشبكة. refresh=True يتجاوز الكاش ويحدّثه
+    """
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, refresh=False, **kwargs):
+            if AI_CACHE_TTL.get(fn_name, 0) <= 0:
+                return fn(*args, **kwargs)
+            key = _cache_key(fn_name, args + tuple(sorted(kwargs.items())))
+            if not refresh:
+                value = _cache_get(fn_name, key)
+                if value is not None: return value
+            CACHE_STATS.setdefault(fn_name, Counter())["misses"] += 1
+            value = fn(*args, **kwargs)
+            _cache_put(fn_name, key, value)
+            return value
+        return wrapper
+    return deco
+
+def ai_cache_stats():
+    """{fn: {ttl_hours, mem_hits, db_hits, misses, stores, hit_rate}} — منذ بدء العملية"""
+    out = {}
+    for fn in AI_CACHE_TTL:
+        c = CACHE_STATS.get(fn, Counter())
+        hits = c["mem_hits"] + c["db_hits"]
+        out[fn] = {"ttl_hours": AI_CACHE_TTL[fn], "mem_hits": c["mem_hits"],
+                   "db_hits": c["db_hits"], "misses": c["misses"], "stores": c["stores"],
+                   "hit_rate": round(hits / (hits + c["misses"]), 3) if hits + c["misses"] else 0.0}
+    return out
+
+def ai_cache_reset_memory():
+    with _MEM_LOCK: _MEM.clear()
+
 # ══ استدعاء Gemini ══════════════════════════
-def _call_gemini(prompt, system="", grounding=False, stream=False):
+def _post(provider, url, **kw):
+    """requests.post عبر قاطع المزود → الاستجابة، أو None (القاطع مفتوح / خطأ اتصال)"""
+    br = breaker(provider)
+    if not br.allow(): return None
+    try:
+        r = requests.post(url, **kw)
+    except Exception as ex:
+        br.failure(type(ex).__name__); return None
+    if http_failed(r.status_code, getattr(r, "text", "") if r.status_code == 400 else ""):
+        br.failure(f"HTTP {r.status_code}")
+    else: br.success()
+    return r
+
+def _call_gemini(prompt, system="", grounding=False, stream=False, keys=None,
+                 max_tokens=4096, json_mode=False):
+    """keys: ترتيب المفاتيح المجربة (للتوزيع على المفاتيح بالتوازي) — الافتراضي GEMINI_API_KEYS"""
     full = f"{system}\n\n{prompt}" if system else prompt
     payload = {
         "contents": [{"parts": [{"text": full}]}],
-        "generationConfig": {"temperature": 0.3, "maxOutputTokens": 4096, "topP": 0.85}
+        "generationConfig": {"temperature": 0.3, "maxOutputTokens": max_tokens, "topP": 0.85}
     }
+    if json_mode:
+        payload["generationConfig"]["responseMimeType"] = "application/json"
     if grounding:
         payload["tools"] = [{"google_search": {}}]
+    if stream:
+        return _stream_gemini(payload, timeout=35)   # مولّد أجزاء نصية
 
-    for key in GEMINI_API_KEYS:
+    for key in (GEMINI_API_KEYS if keys is None else keys):
         if not key: continue
         try:
-            r = requests.post(f"{_GU}?key={key}", json=payload, timeout=35)
+            r = _post("gemini", f"{_GU}?key={key}", json=payload, timeout=35)
+            if r is None: continue
             if r.status_code == 200:
                 data = r.json()
                 if data.get("candidates"):
                     parts = data["candidates"][0]["content"]["parts"]
                     return "".join(p.get("text","") for p in parts)
             elif r.status_code == 429:
-                time.sleep(1); continue
+                if not breaker("gemini").is_open(): time.sleep(1)
+                continue
         except: continue
     return None
 
@@ -67,11 +204,11 @@ def _call_openrouter(prompt, system=""):
         msgs = []
         if system: msgs.append({"role":"system","content":system})
         msgs.append({"role":"user","content":prompt})
-        r = requests.post(_OR, json={
+        r = _post("openrouter", _OR, json={
             "model":"google/gemini-2.0-flash-001",
             "messages":msgs,"temperature":0.3,"max_tokens":4096
         }, headers={"Authorization":f"Bearer {OPENROUTER_API_KEY}"}, timeout=35)
-        if r.status_code == 200:
+        if r is not None and r.status_code == 200:
             return r.json()["choices"][0]["message"]["content"]
     except: pass
     return None
@@ -80,31 +217,207 @@ def _call_cohere(prompt, system=""):
     if not COHERE_API_KEY: return None
     try:
         full = f"{system}\n\n{prompt}" if system else prompt
-        r = requests.post(_CO, json={
+        r = _post("cohere", _CO, json={
             "model":"command-r-plus","prompt":full,"max_tokens":4096,"temperature":0.3
         }, headers={"Authorization":f"Bearer {COHERE_API_KEY}"}, timeout=35)
-        if r.status_code == 200:
+        if r is not None and r.status_code == 200:
             return r.json().get("generations",[{}])[0].get("text","")
     except: pass
     return None
 
+# ══ سباق المزودين (hedging) ═════════════════
+# الأساسي يبدأ وحده؛ إذا لم يرد خلال مهلة التحوط أو فشل → يبدأ التالي بالتوازي
+# وأول رد صالح يفوز. الخاسرون: غير المبدوء يُلغى، والجاري تُهمل نتيجته (requests لا تُقاطع)
+_HEDGE_POOL    = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai-hedge")
+_LAT_BUCKETS   = (0.5, 1, 2, 4, 8, 16, 32)
+_PSTATS        = {}          # مزود → {"lat": deque, "hist": Counter, "ok", "fail", "won", "hedged"}
+_PSTATS_LOCK   = threading.Lock()
+HEDGE_MIN_SECS, HEDGE_MAX_SECS, HEDGE_DEFAULT_SECS, HEDGE_MIN_SAMPLES = 1.5, 8.0, 4.0, 20
+
+def _providers(system):
+    """[(اسم, دالة(prompt))] بترتيب الأولوية — المزود بلا مفتاح أو بقاطع مفتوح لا يدخل السباق"""
+    out = []
+    if any(GEMINI_API_KEYS) and not breaker("gemini").is_open():
+        out.append(("Gemini", lambda p: _call_gemini(p, system)))
+    if OPENROUTER_API_KEY and not breaker("openrouter").is_open():
+        out.append(("OpenRouter", lambda p: _call_openrouter(p, system)))
+    if COHERE_API_KEY and not breaker("cohere").is_open():
+        out.append(("Cohere", lambda p: _call_cohere(p, system)))
+    return out
+
+def _pstat(name):
+    """إحصاءات المزود (تُنشأ عند أول استخدام) — تحت _PSTATS_LOCK"""
+    return _PSTATS.setdefault(name, {"lat": deque(maxlen=200), "hist": Counter(),
+                                     "ok": 0, "fail": 0, "won": 0, "hedged": 0})
+
+def _record(name, secs, ok):
+    with _PSTATS_LOCK:
+        s = _pstat(name)
+        s["ok" if ok else "fail"] += 1
+        if ok: s["lat"].append(secs)
+        s["hist"][next((f"≤{b}s" for b in _LAT_BUCKETS if secs <= b), f">{_LAT_BUCKETS[-1]}s")] += 1
+
+def _pct(values, p):
+    v = sorted(values)
+    return v[min(len(v) - 1, int(p * len(v)))] if v else 0.0
+
+def hedge_delay(name):
+    """مهلة التحوط: AI_HEDGE_DELAY_SECS إذا حُددت، وإلا p90 لزمن نجاح المزود (محصورة)"""
+    if AI_HEDGE_DELAY_SECS > 0: return AI_HEDGE_DELAY_SECS
+    with _PSTATS_LOCK:
+        lat = list(_PSTATS.get(name, {}).get("lat", ()))
+    if len(lat) < HEDGE_MIN_SAMPLES: return HEDGE_DEFAULT_SECS
+    return max(HEDGE_MIN_SECS, min(HEDGE_MAX_SECS, _pct(lat, 0.9)))
+
+def _timed(name, fn, prompt):
+    t0 = time.time()
+    try: r = fn(prompt)
+    except: r = None
+    _record(name, time.time() - t0, bool(r))
+    return r
+
+def _race(prompt, system="", deadline=AI_RACE_DEADLINE_SECS):
+    """(النص، اسم المزود) لأول رد صالح، أو (None, "none") — كل مزود يُجرَّب مرة واحدة فقط"""
+    queue_, running, t_end = list(_providers(system)), {}, time.time() + deadline
+    def launch():
+        name, fn = queue_.pop(0)
+        running[_HEDGE_POOL.submit(_timed, name, fn, prompt)] = name
+        return name
+    if not queue_: return None, "none"
+    current = launch()
+    while running:
+        timeout = min(hedge_delay(current), t_end - time.time()) if queue_ else t_end - time.time()
+        if timeout <= 0: break
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for f in done:
+            name = running.pop(f)
+            r = f.result()
+            if r:
+                for other in running: other.cancel()
+                with _PSTATS_LOCK: _pstat(name)["won"] += 1
+                return r, name
+        if queue_:
+            # مهلة التحوط انتهت (الجاري بطيء) أو فشل مزود → التالي بالتوازي
+            if not done:
+                with _PSTATS_LOCK: _pstat(current)["hedged"] += 1
+            current = launch()
+    for other in running: other.cancel()
+    return None, "none"
+
+def ai_provider_stats():
+    """لكل مزود: ok/fail/won/hedged + p50/p90/p99 (ثوانٍ) + هيستوغرام الزمن + مهلة التحوط الحالية"""
+    with _PSTATS_LOCK:
+        snap = {k: dict(v, lat=list(v["lat"]), hist=dict(v["hist"])) for k, v in _PSTATS.items()}
+    return {k: {"ok": v["ok"], "fail": v["fail"], "won": v["won"], "hedged": v["hedged"],
+                "p50": round(_pct(v["lat"], 0.5), 2), "p90": round(_pct(v["lat"], 0.9), 2),
+                "p99": round(_pct(v["lat"], 0.99), 2), "hist": v["hist"],
+                "hedge_delay": round(hedge_delay(k), 2)} for k, v in snap.items()}
+
 def call_ai(prompt, page="general"):
     sys = PAGE_PROMPTS.get(page, PAGE_PROMPTS["general"])
-    for fn in [lambda: _call_gemini(prompt, sys),
-               lambda: _call_openrouter(prompt, sys),
-               lambda: _call_cohere(prompt, sys)]:
-        r = fn()
-        if r: return {"success":True,"response":r,"source":fn.__name__ if hasattr(fn,"__name__") else "AI"}
-    # fallback source names
-    for r, src in [(_call_gemini(prompt,sys),"Gemini"),
-                   (_call_openrouter(prompt,sys),"OpenRouter"),
-                   (_call_cohere(prompt,sys),"Cohere")]:
-        if r: return {"success":True,"response":r,"source":src}
+    r, src = _race(prompt, sys)
+    if r: return {"success":True,"response":r,"source":src}
     return {"success":False,"response":"❌ فشل الاتصال بجميع مزودي AI","source":"none"}
 
+# ══ البث (SSE) ══════════════════════════════
+def _sse_events(r):
+    """سطور 'data: {...}' من استجابة requests(stream=True) → dicts (يتجاهل التعليقات و[DONE])"""
+    for line in r.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"): continue
+        data = line[5:].strip()
+        if data == "[DONE]": return
+        try: yield json.loads(data)
+        except: continue
+
+def _stream_gemini(payload, timeout=40):
+    """streamGenerateContent?alt=sse — يجرب المفاتيح بالترتيب حتى يصل أول جزء؛
+    بعد بدء البث لا يُعاد الطلب (النص المعروض لا يُسحب)"""
+    for key in GEMINI_API_KEYS:
+        if not key: continue
+        started = False
+        r = _post("gemini", f"{_GUS}?alt=sse&key={key}", json=payload,
+                  timeout=(5, timeout), stream=True)
+        if r is None: continue
+        try:
+            with r:
+                if r.status_code != 200:   # 429/خطأ → المفتاح التالي فوراً (بدون sleep)
+                    continue
+                for ev in _sse_events(r):
+                    for c in ev.get("candidates") or []:
+                        for p in (c.get("content") or {}).get("parts") or []:
+                            if p.get("text"):
+                                started = True
+                                yield p["text"]
+        except:
+            if started: return
+            continue
+        if started: return
+
+def _stream_openrouter(prompt, system="", timeout=40):
+    if not OPENROUTER_API_KEY: return
+    msgs = []
+    if system: msgs.append({"role":"system","content":system})
+    msgs.append({"role":"user","content":prompt})
+    r = _post("openrouter", _OR, json={
+        "model":"google/gemini-2.0-flash-001",
+        "messages":msgs,"temperature":0.3,"max_tokens":4096,"stream":True
+    }, headers={"Authorization":f"Bearer {OPENROUTER_API_KEY}"},
+       timeout=(5, timeout), stream=True)
+    if r is None: return
+    try:
+        with r:
+            if r.status_code != 200: return
+            for ev in _sse_events(r):
+                for c in ev.get("choices") or []:
+                    t = (c.get("delta") or {}).get("content")
+                    if t: yield t
+    except: return
+
+def _why_silent(name):
+    """سبب عدم رد المصدر (للعرض): بلا مفتاح / القاطع مفتوح / آخر خطأ مسجل"""
+    provider = name.split()[0].lower()
+    has_key = {"gemini": any(GEMINI_API_KEYS), "openrouter": bool(OPENROUTER_API_KEY),
+               "cohere": bool(COHERE_API_KEY)}.get(provider, True)
+    if not has_key: return "لا يوجد مفتاح"
+    snap = breaker(provider).snapshot()
+    if snap["state"] == "open":
+        return f"القاطع مفتوح (إعادة المحاولة بعد {snap['retry_in']:.0f}s)"
+    return snap["last_error"] or "لا رد"
+
+def _relay(sources, meta):
+    """
+    يمرر أجزاء أول مصدر يبث فعلاً؛ meta (dict اختياري) يُملأ بـ
+    source · ttft (ثوانٍ حتى أول جزء) · secs · text · success
+    · errors {مصدر: سبب} لكل مصدر لم يرد · error (ملخصها للعرض)
+    sources: [(اسم, دالة تُرجع مولّداً)] — المصدر الذي لا يعطي أي جزء يُتجاوز للتالي
+    """
+    meta = meta if meta is not None else {}
+    meta.update(success=False, source="none", ttft=None, text="", errors={}, error="")
+    t0, buf = time.time(), []
+    for name, gen in sources:
+        for chunk in gen():
+            if meta["ttft"] is None:
+                meta.update(ttft=round(time.time() - t0, 3), source=name, success=True)
+            buf.append(chunk)
+            yield chunk
+        if buf: break
+        meta["errors"][name] = _why_silent(name)
+    meta.update(text="".join(buf), secs=round(time.time() - t0, 3),
+                error=" | ".join(f"{n}: {e}" for n, e in meta["errors"].items()))
+
+def call_ai_stream(prompt, page="general", meta=None):
+    """call_ai مع البث: Gemini ← OpenRouter ← Cohere (دفعة واحدة، بدون بث)"""
+    sys = PAGE_PROMPTS.get(page, PAGE_PROMPTS["general"])
+    def cohere():
+        r = _call_cohere(prompt, sys)
+        if r: yield r
+    return _relay([("Gemini", lambda: _call_gemini(prompt, sys, stream=True)),
+                   ("OpenRouter", lambda: _stream_openrouter(prompt, sys)),
+                   ("Cohere", cohere)], meta)
+
 # ══ Gemini Chat مع History ══════════════════
-def gemini_chat(message, history=None, system_extra=""):
-    """دردشة Gemini مع كامل تاريخ المحادثة"""
+def _chat_request(message, history=None, system_extra=""):
+    """(payload لـ Gemini, system prompt) — مشتركة بين gemini_chat و gemini_chat_stream"""
     sys = PAGE_PROMPTS["general"]
     if system_extra:
         sys = f"{sys}\n\nسياق إضافي: {system_extra}"
@@ -117,18 +430,34 @@ def gemini_chat(message, history=None, system_extra=""):
 
     payload = {"contents":contents,
                "generationConfig":{"temperature":0.4,"maxOutputTokens":4096,"topP":0.9}}
+    return payload, sys
+
+def gemini_chat_stream(message, history=None, system_extra="", meta=None):
+    """
+    مثل gemini_chat لكن مولّد: يُرجع أجزاء النص فور وصولها (Gemini SSE ← OpenRouter stream)
+    meta: dict يُملأ بالمصدر وزمن أول جزء والنص الكامل بعد انتهاء المولّد
+    """
+    payload, sys = _chat_request(message, history, system_extra)
+    return _relay([("Gemini Flash", lambda: _stream_gemini(payload, timeout=40)),
+                   ("OpenRouter", lambda: _stream_openrouter(message, sys))], meta)
+
+def gemini_chat(message, history=None, system_extra=""):
+    """دردشة Gemini مع كامل تاريخ المحادثة"""
+    payload, sys = _chat_request(message, history, system_extra)
 
     for key in GEMINI_API_KEYS:
         if not key: continue
         try:
-            r = requests.post(f"{_GU}?key={key}", json=payload, timeout=40)
+            r = _post("gemini", f"{_GU}?key={key}", json=payload, timeout=40)
+            if r is None: continue
             if r.status_code == 200:
                 data = r.json()
                 if data.get("candidates"):
                     text = data["candidates"][0]["content"]["parts"][0]["text"]
                     return {"success":True,"response":text,"source":"Gemini Flash"}
             elif r.status_code == 429:
-                time.sleep(1); continue
+                if not breaker("gemini").is_open(): time.sleep(1)
+                continue
         except: continue
 
     r = _call_openrouter(message, sys)
@@ -136,13 +465,14 @@ def gemini_chat(message, history=None, system_extra=""):
     return {"success":False,"response":"❌ فشل الاتصال","source":"none"}
 
 # ══ تحقق منتج ═══════════════════════════════
+@_cached("verify_match")
 def verify_match(p1, p2, pr1=0, pr2=0):
     prompt = f"""تحقق من تطابق هذين المنتجين:
 منتج 1: {p1} | السعر: {pr1:.0f} ر.س
 منتج 2: {p2} | السعر: {pr2:.0f} ر.س
 هل هما نفس العطر؟ (ماركة + اسم + حجم + نوع EDP/EDT)"""
     sys = PAGE_PROMPTS["verify"]
-    txt = _call_gemini(prompt, sys) or _call_openrouter(prompt, sys)
+    txt, _ = _race(prompt, sys)
     if not txt: return {"success":False,"match":False,"confidence":0,"reason":"فشل AI"}
     try:
         clean = re.sub(r'```json|```','',txt).strip()
@@ -153,6 +483,7 @@ def verify_match(p1, p2, pr1=0, pr2=0):
         return {"success":True,"match":"true" in txt.lower(),"confidence":70,"reason":txt[:200]}
 
 # ══ بحث أسعار السوق ═════════════════════════
+@_cached("search_market_price")
 def search_market_price(product_name, our_price=0):
     prompt = (f"ما هو سعر السوق السعودي الحالي لـ: «{product_name}»؟\n"
               f"سعرنا الحالي: {our_price:.0f} ر.س\n"
@@ -169,6 +500,7 @@ def search_market_price(product_name, our_price=0):
     return {"success":True,"market_price":our_price,"recommendation":txt[:300]}
 
 # ══ بحث صورة ومكونات من Fragrantica Arabia ══
+@_cached("fetch_fragrantica_info")
 def fetch_fragrantica_info(product_name):
     """
     يبحث عن صورة + مكونات العطر من Fragrantica Arabia
@@ -209,27 +541,19 @@ def fetch_fragrantica_info(product_name):
     return {"success":False,"description_ar":txt[:200] if txt else ""}
 
 # ══ وصف مهووس للمنتجات المفقودة ════════════
-def generate_mahwous_description(product_name, price, fragrantica_data=None):
+def generate_mahwous_description(product_name, price, fragrantica_data=None, refresh=False,
+                                 fallback=True):
     """
     يولّد وصفاً بتنسيق مهووس الاحترافي:
     اسم العطر، الماركة، المكونات، الوصف الشعري، السعر المقترح
+    fallback=False → None عند فشل AI بدل القالب المختصر (للتخزين)
     """
-    frag_info = ""
-    if fragrantica_data and fragrantica_data.get("success"):
-        top = ", ".join(fragrantica_data.get("top_notes",[])[:4])
-        mid = ", ".join(fragrantica_data.get("middle_notes",[])[:4])
-        base = ", ".join(fragrantica_data.get("base_notes",[])[:4])
-        desc = fragrantica_data.get("description_ar","")
-        frag_info = f"\nالمكونات - قمة: {top} | قلب: {mid} | قاعدة: {base}\nوصف: {desc}"
-
-    prompt = f"""اكتب وصفاً احترافياً وجذاباً لهذا العطر بتنسيق متجر مهووس:
+    txt = _mahwous_description(product_name, price, fragrantica_data, refresh=refresh)
+    if txt or not fallback: return txt
+    return f"🌟 {product_name}\n💰 السعر: {price:.0f} ر.س"
 
-العطر: {product_name}
-السعر: {price:.0f} ر.س{frag_info}
-
-التنسيق المطلوب (اتبعه بدقة):
----
-🌟 [اسم العطر الكامل]
+def _mahwous_format(price="[السعر]"):
+    return f"""🌟 [اسم العطر الكامل]
 
 ✨ [جملة تسويقية جذابة بالعربية - سطر واحد]
 
@@ -242,14 +566,135 @@ def generate_mahwous_description(product_name, price, fragrantica_data=None):
 
 👤 مناسب لـ: [الجنس] | 🕐 المناسبة: [النهار/المساء/المختلطة]
 
-💰 السعر: {price:.0f} ر.س
+💰 السعر: {price} ر.س"""
+
+def _frag_info(fragrantica_data):
+    if not (fragrantica_data and fragrantica_data.get("success")): return ""
+    top = ", ".join(fragrantica_data.get("top_notes",[])[:4])
+    mid = ", ".join(fragrantica_data.get("middle_notes",[])[:4])
+    base = ", ".join(fragrantica_data.get("base_notes",[])[:4])
+    desc = fragrantica_data.get("description_ar","")
+    return f"المكونات - قمة: {top} | قلب: {mid} | قاعدة: {base}\nوصف: {desc}"
+
+@_cached("generate_mahwous_description")
+def _mahwous_description(product_name, price, fragrantica_data=None):
+    """النص من AI أو None (القالب الاحتياطي لا يُخزّن)"""
+    frag_info = _frag_info(fragrantica_data)
+    prompt = f"""اكتب وصفاً احترافياً وجذاباً لهذا العطر بتنسيق متجر مهووس:
+
+العطر: {product_name}
+السعر: {price:.0f} ر.س{chr(10) + frag_info if frag_info else ""}
+
+التنسيق المطلوب (اتبعه بدقة):
+---
+{_mahwous_format(f"{price:.0f}")}
 ---
 أجب بالعربية فقط."""
 
-    txt = _call_gemini(prompt) or _call_openrouter(prompt) or _call_cohere(prompt)
-    return txt or f"🌟 {product_name}\n💰 السعر: {price:.0f} ر.س"
+    return _race(prompt)[0]
+
+# ─── دفعات: عدة منتجات في طلب Gemini واحد ───
+# كل وصف يُتحقق منه منفرداً؛ الفاشل فقط يُعاد في دفعات أصغر (6 → 3 → فردي عبر _race)
+# الدفعات تتوزع على مفاتيح Gemini بالتوازي، والناجح يُخزّن بنفس مفتاح كاش الوصف الفردي
+_DESC_MIN_CHARS = 120
+
+def _price(v):
+    try: return float(v or 0)
+    except: return 0.0
+
+def _valid_description(desc, price):
+    """وصف كامل لهذا المنتج: طول معقول + سطر السعر الصحيح (يكشف تبديل الأوصاف بين المنتجات)"""
+    return isinstance(desc, str) and len(desc.strip()) >= _DESC_MIN_CHARS and \
+        "💰" in desc and f"{_price(price):.0f}" in desc
+
+def _describe_batch(batch, keys):
+    """batch = [(i, name, price, info)] → {i: وصف صالح} — الناقص/غير الصالح يُهمل"""
+    items = [{"id": n, "name": name, "price": round(_price(price)),
+              **({"notes": _frag_info(info)} if _frag_info(info) else {})}
+             for n, (_, name, price, info) in enumerate(batch, 1)]
+    prompt = f"""اكتب وصفاً احترافياً وجذاباً لكل عطر في القائمة بتنسيق متجر مهووس.
+
+العطور (JSON):
+{json.dumps(items, ensure_ascii=False, indent=1)}
+
+التنسيق المطلوب لكل وصف (اتبعه بدقة، وضع سعر العطر نفسه في سطر 💰):
+{_mahwous_format()}
+
+أجب بمصفوفة JSON فقط، عنصر لكل عطر بنفس id وبالعربية:
+[{{"id":1,"description":"..."}}]"""
+    txt = _call_gemini(prompt, keys=keys, max_tokens=8192, json_mode=True)
+    if not txt: return {}
+    try:
+        clean = re.sub(r'```json|```','',txt).strip()
+        s=clean.find('['); e=clean.rfind(']')+1
+        data = json.loads(clean[s:e]) if s>=0 and e>s else []
+    except: return {}
+    out = {}
+    for d in data if isinstance(data, list) else []:
+        try: n = int(d.get("id"))
+        except: continue
+        if 1 <= n <= len(batch):
+            i, _, price, _ = batch[n-1]
+            desc = str(d.get("description","")).strip().strip("-").strip()
+            if _valid_description(desc, price): out[i] = desc
+    return out
+
+def generate_mahwous_descriptions(items, batch_size=None, workers=None, refresh=False,
+                                  progress=None):
+    """
+    items = [(product_name, price, fragrantica_data)] → [وصف أو None] بنفس الترتيب
+    - الكاش أولاً (مشترك مع generate_mahwous_description)
+    - الباقي في دفعات batch_size على مفاتيح Gemini بالتوازي (workers = عدد المفاتيح افتراضياً)
+    - الفاشل فقط يُعاد بدفعات أصغر حتى الفردي (سباق المزودين)
+    progress(done, total) اختيارية
+    """
+    fn = "generate_mahwous_description"
+    use_cache = AI_CACHE_TTL.get(fn, 0) > 0      # TTL 0 = الكاش معطل (كما في _cached)
+    out, keys_of = [None] * len(items), {}
+    for i, (name, price, info) in enumerate(items):
+        keys_of[i] = _cache_key(fn, (name, price, info))
+        if use_cache and not refresh:
+            out[i] = _cache_get(fn, keys_of[i])
+    pending = [i for i, v in enumerate(out) if not v]
+    total, done = len(pending), 0
+    if progress: progress(0, total)
+    if not pending: return out
+    if use_cache: CACHE_STATS.setdefault(fn, Counter())["misses"] += total
+
+    gkeys = [k for k in GEMINI_API_KEYS if k]
+    size  = max(1, int(batch_size or MAHWOUS_BATCH_SIZE))
+    with ThreadPoolExecutor(max_workers=max(1, int(workers or MAHWOUS_BATCH_WORKERS or len(gkeys)))) as ex:
+        while pending:
+            single = size == 1 or not gkeys or breaker("gemini").is_open()
+            if single:
+                # فردي: _race يجرب Gemini ثم OpenRouter/Cohere — الدالة بدون غلاف الكاش
+                # (الإخفاق حُسب أعلاه مرة واحدة، والتخزين أدناه كالدفعات)
+                futs = {ex.submit(_mahwous_description.__wrapped__, *items[i]): [i]
+                        for i in pending}
+            else:
+                chunks = [pending[j:j+size] for j in range(0, len(pending), size)]
+                # كل دفعة تبدأ بمفتاح مختلف → توازٍ حقيقي على حصص المفاتيح
+                futs = {ex.submit(_describe_batch, [(i, *items[i]) for i in c],
+                                  gkeys[n % len(gkeys):] + gkeys[:n % len(gkeys)]): c
+                        for n, c in enumerate(chunks)}
+            failed = []
+            for f in as_completed(futs):
+                try: got = f.result()
+                except: got = None
+                for i in futs[f]:
+                    desc = got.get(i) if isinstance(got, dict) else got
+                    if desc:
+                        out[i] = desc; done += 1
+                        if use_cache: _cache_put(fn, keys_of[i], desc)
+                    else:
+                        failed.append(i)
+                if progress: progress(done, total)
+            if single: break
+            pending, size = sorted(failed), max(1, size // 2)
+    return out
 
 # ══ بحث mahwous.com ══════════════════════════
+@_cached("search_mahwous")
 def search_mahwous(product_name):
     prompt = f"""هل العطر «{product_name}» متوفر في متجر مهووس؟
 أجب JSON: {{"likely_available":true/false,"confidence":0-100,
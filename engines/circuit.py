@@ -0,0 +1,139 @@
+"""
+engines/circuit.py - قواطع دائرة لمزودي AI (مشتركة بين engine و ai_engine)
+- closed: الطلبات تمر، والفشل يُعد في نافذة زمنية
+- open: بعد failure_threshold فشل خلال window_secs → رفض فوري بدون شبكة حتى انتهاء التهدئة
+- half_open: بعد التهدئة يمر طلب تجريبي واحد: نجاح → closed | فشل → open بتهدئة مضاعفة
+- الفشل = خطأ شبكة/مهلة، 5xx، 401/403 و400 بمفتاح غير صالح (Gemini)، 429 — والنجاح = أي رد آخر
+"""
+import threading, time
+from collections import deque
+
+try:
+    from config import AI_BREAKER
+except:
+    AI_BREAKER = {"failure_threshold": 5, "window_secs": 60,
+                  "cooldown_secs": 30, "max_cooldown_secs": 300}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, window_secs=60, cooldown_secs=30,
+                 max_cooldown_secs=300):
+        self.name              = name
+        self.failure_threshold = failure_threshold
+        self.window_secs       = window_secs
+        self.base_cooldown     = cooldown_secs
+        self.max_cooldown      = max_cooldown_secs
+        self.cooldown          = cooldown_secs
+        self._state    = CLOSED
+        self._fails    = deque()     # أزمنة الفشل داخل النافذة
+        self._opened   = 0.0
+        self._probing  = False
+        self.last_error = ""
+        self.rejected  = 0           # طلبات رُفضت فوراً أثناء الفتح
+        self.trips     = 0
+        self._lock     = threading.Lock()
+
+    def _tick(self, now):
+        """open → half_open بعد التهدئة — تحت القفل"""
+        if self._state == OPEN and now - self._opened >= self.cooldown:
+            self._state, self._probing = HALF_OPEN, False
+
+    @property
+    def state(self):
+        with self._lock:
+            self._tick(time.time())
+            return self._state
+
+    def is_open(self):
+        """مفتوح ولم تنتهِ التهدئة — لا يستهلك الطلب التجريبي (للقرار المسبق بالتخطي)"""
+        return self.state == OPEN
+
+    def allow(self):
+        """هل يُرسل الطلب؟ في half_open يمر طلب واحد فقط حتى تُعرف نتيجته"""
+        with self._lock:
+            self._tick(time.time())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self._state, self._probing = CLOSED, False
+            self._fails.clear()
+            self.cooldown = self.base_cooldown
+
+    def failure(self, error=""):
+        now = time.time()
+        with self._lock:
+            self.last_error = str(error)[:200]
+            if self._state == HALF_OPEN:
+                # التجربة فشلت → فتح مجدداً بتهدئة أطول
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self._trip(now)
+                return
+            self._fails.append(now)
+            while self._fails and now - self._fails[0] > self.window_secs:
+                self._fails.popleft()
+            if self._state == CLOSED and len(self._fails) >= self.failure_threshold:
+                self._trip(now)
+
+    def _trip(self, now):
+        self._state, self._opened, self._probing = OPEN, now, False
+        self._fails.clear()
+        self.trips += 1
+
+    def release(self):
+        """إنهاء طلب سُمح به بلا حكم (خطأ غير متوقع قبل success/failure) → لا يعلق half_open"""
+        with self._lock:
+            if self._state == HALF_OPEN: self._probing = False
+
+    def reset(self):
+        self.success()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.time()
+            self._tick(now)
+            return {"name": self.name, "state": self._state,
+                    "failures": len(self._fails), "trips": self.trips,
+                    "rejected": self.rejected, "last_error": self.last_error,
+                    "retry_in": round(max(0.0, self._opened + self.cooldown - now), 1)
+                                if self._state == OPEN else 0.0}
+
+
+_BREAKERS = {}
+_REG_LOCK = threading.Lock()
+
+
+def breaker(name):
+    """قاطع المزود (gemini / openrouter / cohere) — واحد لكل عملية"""
+    with _REG_LOCK:
+        b = _BREAKERS.get(name)
+        if b is None:
+            b = _BREAKERS[name] = CircuitBreaker(name, **AI_BREAKER)
+        return b
+
+
+def breaker_states():
+    with _REG_LOCK:
+        items = list(_BREAKERS.values())
+    return {b.name: b.snapshot() for b in items}
+
+
+_INVALID_KEY = ("API_KEY_INVALID", "API key not valid", "API_KEY_SERVICE_BLOCKED")
+
+
+def http_failed(status_code, body=""):
+    """
+    هل رمز HTTP يُعد فشلاً للمزود؟ (4xx أخرى = خطأ في الطلب نفسه لا في المزود)
+    Gemini يرد 400 (لا 401) على المفتاح غير الصالح → يُعد فشلاً إذا ذكره النص
+    """
+    if status_code == 400:
+        return any(m in (body or "") for m in _INVALID_KEY)
+    return status_code in (401, 403, 429) or status_code >= 500
@@ -9,14 +9,22 @@ engines/engine.py  v21.1 — محرك المطابقة الفائق السرعة
   2. لكل منتجنا → cdist vectorized دفعة واحدة (بدل loop)
   3. أفضل 5 مرشحين → Gemini فقط إذا score بين 62-96%
   4. score ≥97% → تلقائي فوري  |  score <62% → مفقود
+  5. AI غير متاح (قاطع Gemini مفتوح / بلا مفاتيح) → أفضل مرشح fuzzy فوراً بدل انتظار المهلات
+     score ≥ AI_FALLBACK_ACCEPT_SCORE → قرار مسعّر (مصدر "auto") كما في use_ai=False
+     أقل منه → مصدر "fuzzy" → "⚠️ تحت المراجعة" (لا تسعير لمطابقة ضعيفة لم يتحقق منها AI)
 """
 import re, io, json, hashlib, sqlite3, time
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
+import numpy as np
 import pandas as pd
 from rapidfuzz import fuzz, process as rf_process
 from rapidfuzz.distance import Indel
 import requests as _req
 
+from engines.circuit import breaker, http_failed
+
 # ─── استيراد الإعدادات ───────────────────────
 try:
     from config import (REJECT_KEYWORDS, KNOWN_BRANDS, WORD_REPLACEMENTS,
@@ -69,6 +77,11 @@ WORD_REPLACEMENTS = {}
 MATCH_THRESHOLD = 85; HIGH_CONFIDENCE = 95; REVIEW_THRESHOLD = 75
 PRICE_TOLERANCE = 5; TESTER_KEYWORDS = ["tester","تستر"]; SET_KEYWORDS = ["set","طقم","مجموعة"]
 
+try:
+    from config import AI_FALLBACK_ACCEPT_SCORE
+except:
+    AI_FALLBACK_ACCEPT_SCORE = 90
+
 # ─── قراءة مفاتيح Gemini من Railway Environment Variables ───
 import os as _os
 def _load_gemini_keys():
@@ -190,6 +203,49 @@ def _cset(k, v):
 
 _init_db()
 
+
+# ─── تقرير التشغيل: زمن المراحل + العدادات ───
+class RunReport:
+    """
+    wall/CPU لكل مرحلة + عدادات (مرشحون، رفض كل فلتر، AI، كاش، إعادات 429)
+    CPU = thread_time → صحيح حتى مع تحليلين متوازيين في نفس العملية
+    يُرفق بالنتيجة في df.attrs["run_report"] ويُحفظ في analysis_history.report_json
+    """
+    def __init__(self, kind="analysis"):
+        self.kind     = kind
+        self.started  = time.time()
+        self.stages   = {}          # name → {"wall", "cpu", "calls"}
+        self.counters = Counter()
+
+    @contextmanager
+    def stage(self, name):
+        w, c = time.perf_counter(), time.thread_time()
+        try: yield
+        finally: self.add_time(name, time.perf_counter() - w, time.thread_time() - c)
+
+    def add_time(self, name, wall, cpu=0.0, calls=1):
+        s = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        s["wall"] += wall; s["cpu"] += cpu; s["calls"] += calls
+
+    def inc(self, key, n=1):
+        self.counters[key] += n
+
+    def merge(self, other):
+        """دمج تقرير آخر (dict أو RunReport) — لأجزاء batch_run المتوازية"""
+        d = other.to_dict() if isinstance(other, RunReport) else (other or {})
+        for name, st in d.get("stages", {}).items():
+            self.add_time(name, st.get("wall", 0), st.get("cpu", 0), st.get("calls", 0))
+        self.counters.update(d.get("counters", {}))
+        return self
+
+    def to_dict(self):
+        return {"kind": self.kind,
+                "started": datetime.fromtimestamp(self.started).strftime("%Y-%m-%d %H:%M:%S"),
+                "total_wall": round(time.time() - self.started, 3),
+                "stages": {k: {"wall": round(v["wall"], 4), "cpu": round(v["cpu"], 4),
+                               "calls": v["calls"]} for k, v in self.stages.items()},
+                "counters": dict(self.counters)}
+
 # ─── دوال أساسية ────────────────────────────
 def read_file(f):
     try:
@@ -332,6 +388,9 @@ def extract_product_line(text, brand=""):
         'ابسولو','ابسوليو','absolue','absolute','absolu',
         'اكستريت','اكسترايت','extrait','extract',
         'دو','de','du','la','le','les','the',
+        'eau',  # بقية "eau de toilette" بعد إزالة toilette أولاً
+        # بادئات الرقم — الرقم نفسه يُقارن في _extract_product_numbers (N°5 = No 5 = نمبر 5)
+        'no','n','number','نمبر','رقم',
         # أسماء ماركات فرعية تبقى بعد إزالة الماركة الرئيسية
         'تيرينزي','ترينزي','terenzi','terenzio',  # Tiziana Terenzi
         'كوركدجيان','كركدجيان','kurkdjian',  # MFK
@@ -447,6 +506,67 @@ def _fcol(df, cands):
         if c in df.columns: return c
     return df.columns[0] if len(df.columns) else ""
 
+NAME_COLS  = ["المنتج","اسم المنتج","Product","Name","name"]
+PRICE_COLS = ["السعر","سعر","Price","price","PRICE"]
+ID_COLS    = [
+    "رقم المنتج","معرف المنتج","المعرف","معرف","رقم_المنتج","معرف_المنتج",
+    "product_id","Product ID","Product_ID","ID","id","Id",
+    "SKU","sku","Sku","رمز المنتج","رمز_المنتج","رمز المنتج sku",
+    "الكود","كود","Code","code","الرقم","رقم","Barcode","barcode","الباركود"
+]
+
+
+def prepare_query(product):
+    """اسم منتجنا → وسائط CompIndex.search (نفس التطبيع المستخدم في run_full_analysis)"""
+    product = str(product or "").strip()
+    brand = extract_brand(product)
+    return {"our_norm": normalize(product), "our_br": brand,
+            "our_sz": extract_size(product), "our_tp": extract_type(product),
+            "our_gd": extract_gender(product),
+            "our_pline": extract_product_line(normalize(product), brand)}
+
+# ─── أرقام خط المنتج (نمبر 11 ≠ نمبر 10) ───
+_NUM_WORDS = {
+    'ون':'1','تو':'2','ثري':'3','فور':'4','فايف':'5',
+    'سكس':'6','سفن':'7','ايت':'8','ناين':'9','تن':'10',
+    'one':'1','two':'2','three':'3','four':'4','five':'5',
+    'six':'6','seven':'7','eight':'8','nine':'9','ten':'10',
+    'i':'1','ii':'2','iii':'3','iv':'4','v':'5',
+    'vi':'6','vii':'7','viii':'8','ix':'9','x':'10',
+}
+def _extract_product_numbers(text):
+    """Extract product-identifying numbers (not sizes)"""
+    nums = set()
+    # استخراج الأرقام الرقمية
+    for m in re.finditer(r'(?:no|num|number|نمبر|رقم|№|#)\s*(\d+)', text.lower()):
+        nums.add(m.group(1))
+    # استخراج الأرقام النصية (ون، تو، سفن...)
+    tl = text.lower()
+    for word, num in _NUM_WORDS.items():
+        if f'نمبر {word}' in tl or f'number {word}' in tl or f'no {word}' in tl or f'رقم {word}' in tl:
+            nums.add(num)
+    # استخراج أرقام ملتصقة بكلمات (مثل سفن7)
+    for m in re.finditer(r'[a-z؀-ۿ](\d+)', text.lower()):
+        v = m.group(1)
+        if v not in {'100','50','30','200','150','75','80','125','250','300','ml'}:
+            nums.add(v)
+    # أرقام مستقلة ليست أحجام (مثل 212, 360, 9)
+    for m in re.finditer(r'\b(\d{1,3})\b', text.lower()):
+        v = m.group(1)
+        # استثناء الأحجام الشائعة فقط إذا كانت متبوعة بـ ml/مل
+        pos = m.end()
+        after = text.lower()[pos:pos+5].strip()
+        if after.startswith('ml') or after.startswith('مل'):
+            continue  # هذا حجم
+        if v in {'212','360','1','2','3','4','5','6','7','8','9','11','12','13','14','15','16','17','18','19','21'}:
+            nums.add(v)
+    return nums
+
+
+# حد المرحلة الأولى (token_set_ratio): ما تحته يُرفض دائماً — يُمرر كـ score_cutoff لـ rapidfuzz
+FAST_CUTOFF = max(MATCH_THRESHOLD - 15, 40)
+
+
 # ═══════════════════════════════════════════════════════
 #  الكلاس الجديد: Pre-normalized Competitor Index
 #  يُبنى مرة واحدة لكل ملف منافس ← يسرّع الـ matching 5x
@@ -466,34 +586,82 @@ class CompIndex:
         self.types      = [extract_type(n) for n in self.raw_names]
         self.genders    = [extract_gender(n) for n in self.raw_names]
         # خطوط الإنتاج — لمنع مطابقة 'بربري هيرو' مع 'بربري لندن'
-        self.plines     = [extract_product_line(n, self.brands[i]) for i, n in enumerate(self.raw_names)]
+        # من الاسم الموحد: سوفاج/Sauvage → نفس الخط بين العربي والإنجليزي
+        self.plines     = [extract_product_line(n, self.brands[i]) for i, n in enumerate(self.norm_names)]
         self.prices     = [_price(row) for _, row in df.iterrows()]
         self.ids        = [_pid(row, id_col) for _, row in df.iterrows()]
-
-    def search(self, our_norm, our_br, our_sz, our_tp, our_gd, our_pline="", top_n=6):
-        """بحث vectorized بـ rapidfuzz process.extract مع مقارنة خط الإنتاج"""
-        if not self.norm_names: return []
-
+        # خصائص ثابتة لكل صف — كانت تُحسب لكل مرشح في كل بحث
+        self.norm_brands = [normalize(b) if b else "" for b in self.brands]
+        self.classes     = [classify_product(n) for n in self.raw_names]
+        self.pnums       = [_extract_product_numbers(n) for n in self.norm_names]
         # استبعاد العينات مسبقاً
-        valid_idx = [i for i, n in enumerate(self.raw_names) if not is_sample(n)]
-        if not valid_idx: return []
+        self.valid_idx   = [i for i, n in enumerate(self.raw_names) if not is_sample(n)]
+        self.valid_norms = [self.norm_names[i] for i in self.valid_idx]
+
+    @classmethod
+    def from_df(cls, df, comp_name):
+        """فهرس من ملف منافس بتخمين عمودي الاسم والمعرّف"""
+        return cls(df, _fcol(df, NAME_COLS), _fcol(df, ID_COLS), comp_name)
 
-        valid_norms = [self.norm_names[i] for i in valid_idx]
+    FAST_LIMIT = 25   # مرشحو المرحلة الأولى (token_set_ratio) قبل الفلاتر والتقييم التفصيلي
 
+    def search(self, our_norm, our_br, our_sz, our_tp, our_gd, our_pline="", top_n=6,
+               report=None):
+        """بحث vectorized بـ rapidfuzz process.extract مع مقارنة خط الإنتاج
+        report: RunReport اختياري — عدد المرشحين المفحوصين والمرفوضين بكل فلتر"""
+        if not self.valid_idx: return []
         # extract بالطريقة الأسرع
         fast = rf_process.extract(
-            our_norm, valid_norms,
+            our_norm, self.valid_norms,
             scorer=fuzz.token_set_ratio,
-            limit=min(25, len(valid_norms))
+            limit=min(self.FAST_LIMIT, len(self.valid_norms)),
+            score_cutoff=FAST_CUTOFF
         )
+        return self._rank([(sc, vi) for _, sc, vi in fast], our_norm, our_br, our_sz,
+                          our_tp, our_gd, our_pline, top_n, report)
+
+    def search_many(self, queries, top_n=6, report=None, workers=-1, max_cells=2_000_000):
+        """
+        نفس search لعدة استعلامات دفعة واحدة: cdist (كل الأنوية) بدل extract لكل منتج
+        queries: [prepare_query(name)] → [[candidates]] بنفس الترتيب
+        المصفوفة تُحسب على كتل ≤ max_cells خلية لضبط الذاكرة
+        """
+        n = len(self.valid_norms)
+        if not n: return [[] for _ in queries]
+        k = min(self.FAST_LIMIT, n)
+        block = max(1, max_cells // n)
+        out = []
+        for s in range(0, len(queries), block):
+            part = queries[s:s + block]
+            mat = rf_process.cdist([q["our_norm"] for q in part], self.valid_norms,
+                                   scorer=fuzz.token_set_ratio, dtype=np.float64,
+                                   score_cutoff=FAST_CUTOFF, workers=workers)
+            for q, row in zip(part, mat):
+                top = np.argpartition(-row, k - 1)[:k] if k < n else np.arange(n)
+                top = top[row[top] >= FAST_CUTOFF]   # تحت الحد = 0 (نفس extract مع score_cutoff)
+                top = top[np.lexsort((top, -row[top]))]   # نفس ترتيب extract: الدرجة ثم الموضع
+                out.append(self._rank([(float(row[vi]), int(vi)) for vi in top],
+                                      top_n=top_n, report=report, **q))
+        return out
+
+    def _rank(self, fast, our_norm, our_br, our_sz, our_tp, our_gd, our_pline="", top_n=6,
+              report=None):
+        """المرحلة الثانية: فلاتر الماركة/الحجم/التصنيف/خط الإنتاج + الدرجة التفصيلية"""
+        valid_idx = self.valid_idx
+        rej = Counter()
+
+        # خصائص منتجنا — مرة واحدة لكل بحث
+        our_nbr   = normalize(our_br) if our_br else ""
+        our_class = classify_product(our_norm)
+        our_pnums = _extract_product_numbers(our_norm)
 
         cands = []
         seen  = set()
-        for _, fast_score, vi in fast:
-            if fast_score < max(MATCH_THRESHOLD - 15, 40): continue
+        for fast_score, vi in fast:
+            if fast_score < FAST_CUTOFF: rej["reject_fast"] += 1; continue
             idx  = valid_idx[vi]
             name = self.raw_names[idx]
-            if name in seen: continue
+            if name in seen: rej["reject_duplicate"] += 1; continue
 
             c_br = self.brands[idx]
             c_sz = self.sizes[idx]
@@ -502,68 +670,33 @@ class CompIndex:
             c_pl = self.plines[idx]
 
             # ═══ فلاتر سريعة ═══
-            if our_br and c_br and normalize(our_br) != normalize(c_br): continue
-            if our_sz > 0 and c_sz > 0 and abs(our_sz - c_sz) > 30: continue
+            if our_br and c_br and our_nbr != self.norm_brands[idx]:
+                rej["reject_brand"] += 1; continue
+            if our_sz > 0 and c_sz > 0 and abs(our_sz - c_sz) > 30:
+                rej["reject_size"] += 1; continue
             if our_tp and c_tp and our_tp != c_tp:
-                if our_sz > 0 and c_sz > 0 and abs(our_sz - c_sz) > 3: continue
-            if our_gd and c_gd and our_gd != c_gd: continue
+                if our_sz > 0 and c_sz > 0 and abs(our_sz - c_sz) > 3:
+                    rej["reject_type"] += 1; continue
+            if our_gd and c_gd and our_gd != c_gd:
+                rej["reject_gender"] += 1; continue
 
             # ═══ فلتر تصنيف المنتج (retail/tester/set/hair_mist) ═══
-            our_class = classify_product(our_norm)
-            c_class = classify_product(name)
+            c_class = self.classes[idx]
             if our_class != c_class:
                 # العينات تُستثنى تماماً
                 if our_class == 'rejected' or c_class == 'rejected':
-                    continue
+                    rej["reject_class"] += 1; continue
                 # المجموعات ومعطرات الشعر/الجسم لا تقارن مع العطور
                 if our_class in ('hair_mist','body_mist','set','other') or \
                    c_class in ('hair_mist','body_mist','set','other'):
-                    continue
+                    rej["reject_class"] += 1; continue
                 # التستر يقارن فقط مع التستر، العطر الأساسي فقط مع الأساسي
                 if (our_class == 'tester') != (c_class == 'tester'):
-                    continue
-
-            # ═══ مقارنة الأرقام في أسماء المنتجات (نمبر 11 ≠ نمبر 10) ═══
-            _NUM_WORDS = {
-                'ون':'1','تو':'2','ثري':'3','فور':'4','فايف':'5',
-                'سكس':'6','سفن':'7','ايت':'8','ناين':'9','تن':'10',
-                'one':'1','two':'2','three':'3','four':'4','five':'5',
-                'six':'6','seven':'7','eight':'8','nine':'9','ten':'10',
-                'i':'1','ii':'2','iii':'3','iv':'4','v':'5',
-                'vi':'6','vii':'7','viii':'8','ix':'9','x':'10',
-            }
-            def _extract_product_numbers(text):
-                """Extract product-identifying numbers (not sizes)"""
-                nums = set()
-                # استخراج الأرقام الرقمية
-                for m in re.finditer(r'(?:no|num|number|نمبر|رقم|№|#)\s*(\d+)', text.lower()):
-                    nums.add(m.group(1))
-                # استخراج الأرقام النصية (ون، تو، سفن...)
-                tl = text.lower()
-                for word, num in _NUM_WORDS.items():
-                    if f'نمبر {word}' in tl or f'number {word}' in tl or f'no {word}' in tl or f'رقم {word}' in tl:
-                        nums.add(num)
-                # استخراج أرقام ملتصقة بكلمات (مثل سفن7)
-                for m in re.finditer(r'[a-z؀-ۿ](\d+)', text.lower()):
-                    v = m.group(1)
-                    if v not in {'100','50','30','200','150','75','80','125','250','300','ml'}:
-                        nums.add(v)
-                # أرقام مستقلة ليست أحجام (مثل 212, 360, 9)
-                for m in re.finditer(r'\b(\d{1,3})\b', text.lower()):
-                    v = m.group(1)
-                    # استثناء الأحجام الشائعة فقط إذا كانت متبوعة بـ ml/مل
-                    pos = m.end()
-                    after = text.lower()[pos:pos+5].strip()
-                    if after.startswith('ml') or after.startswith('مل'):
-                        continue  # هذا حجم
-                    if v in {'212','360','1','2','3','4','5','6','7','8','9','11','12','13','14','15','16','17','18','19','21'}:
-                        nums.add(v)
-                return nums
-
-            our_pnums = _extract_product_numbers(our_norm)
-            c_pnums = _extract_product_numbers(self.norm_names[idx])
+                    rej["reject_class"] += 1; continue
+
+            c_pnums = self.pnums[idx]
             if our_pnums and c_pnums and our_pnums != c_pnums:
-                continue
+                rej["reject_product_number"] += 1; continue
 
             # ═══ مقارنة خط الإنتاج (الحل الجذري) ═══
             pline_penalty = 0
@@ -573,7 +706,9 @@ class CompIndex:
                     # نفس الماركة → مقارنة خط الإنتاج صارمة جداً
                     # باروندا≠باردون(77%), الاباي≠اسبريت(75%)
                     # سوفاج=سوفاج(100%), عود مود=عود سيلك مود(85%)
-                    if pl_score < 78:
+                    # خط قصير (≤4 حروف): حرف واحد يغيّر المنتج (Her≠Hero) → التطابق التام فقط
+                    if pl_score < 78 or (pl_score < 100 and min(len(our_pline), len(c_pl)) <= 4):
+                        rej["reject_product_line"] += 1
                         continue  # رفض نهائي - خطوط إنتاج مختلفة
                     elif pl_score < 88:
                         pline_penalty = -20
@@ -595,7 +730,7 @@ class CompIndex:
 
             # ═══ تعديلات الماركة ═══
             if our_br and c_br:
-                base += 10 if normalize(our_br)==normalize(c_br) else -25
+                base += 10 if our_nbr == self.norm_brands[idx] else -25
             elif our_br and not c_br:
                 base -= 25  # منتجنا له ماركة لكن المنافس بدون → خصم كبير
             elif not our_br and c_br:
@@ -610,6 +745,7 @@ class CompIndex:
                 base += 10 if d==0 else (-5 if d<=5 else -18 if d<=20 else -30)
             if our_tp and c_tp and our_tp != c_tp: base -= 14
             if our_gd and c_gd and our_gd != c_gd:
+                rej["reject_gender"] += 1
                 continue  # رفض نهائي - رجالي ≠ نسائي
             elif (our_gd or c_gd) and our_gd != c_gd:
                 base -= 15  # أحدهما محدد والآخر فارغ
@@ -618,7 +754,7 @@ class CompIndex:
             base += pline_penalty
 
             score = round(max(0, min(100, base)), 1)
-            if score < MATCH_THRESHOLD: continue
+            if score < MATCH_THRESHOLD: rej["reject_score"] += 1; continue
 
             seen.add(name)
             cands.append({
@@ -628,6 +764,10 @@ class CompIndex:
                 "competitor": self.comp_name,
             })
 
+        if report is not None:
+            report.counters.update(rej)
+            report.counters["candidates_scanned"] += len(fast)
+            report.counters["candidates_kept"] += len(cands)
         cands.sort(key=lambda x: x["score"], reverse=True)
         return cands[:top_n]
 
@@ -637,19 +777,32 @@ class CompIndex:
 # ═══════════════════════════════════════════════════════
 _GURL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
 
-def _ai_batch(batch):
+def ai_down():
+    """قاطع Gemini مفتوح (فشل متكرر حديث) → المطابقة تكتفي بـ fuzzy حتى انتهاء التهدئة"""
+    return breaker("gemini").is_open()
+
+def _ai_batch(batch, report=None):
     """
     batch: [{"our":str, "price":float, "candidates":[...]}]
     → [int]  (0-based index | -1=no match)
+    → None: AI غير متاح (بلا مفاتيح / القاطع مفتوح / فشلت كل المحاولات) → قرار fuzzy
+    report: RunReport اختياري — كاش، محاولات، 429 وزمن الانتظار
     """
-    if not GEMINI_API_KEYS or not batch: return [0]*len(batch)
+    rep = report or RunReport("ai")
+    if not batch: return []
+    if not GEMINI_API_KEYS:
+        rep.inc("ai_no_keys"); return None
+    br = breaker("gemini")
+    if br.is_open():
+        rep.inc("ai_circuit_open"); return None
 
     # cache key
     ck = hashlib.md5(json.dumps(
         [{"o":x["our"], "c":[c["name"] for c in x["candidates"]]} for x in batch],
         ensure_ascii=False, sort_keys=True).encode()).hexdigest()
     cached = _cget(ck)
-    if cached is not None: return cached
+    if cached is not None:
+        rep.inc("ai_cache_hits"); return cached
 
     lines = []
     for i, it in enumerate(batch):
@@ -673,9 +826,16 @@ def _ai_batch(batch):
     for attempt in range(3):
         for key in GEMINI_API_KEYS:
             if not key: continue
+            if not br.allow():
+                # فُتح القاطع أثناء المحاولات → توقف فوري بدل 3 جولات × كل المفاتيح
+                rep.inc("ai_circuit_open"); rep.inc("ai_failed_batches"); return None
+            rep.inc("ai_requests")
             try:
                 r = _req.post(f"{_GURL}?key={key}", json=payload, timeout=22)
+                bad = http_failed(r.status_code,
+                                  getattr(r, "text", "") if r.status_code == 400 else "")
                 if r.status_code == 200:
+                    br.success()
                     txt = r.json()["candidates"][0]["content"]["parts"][0]["text"]
                     clean = re.sub(r'```json|```','',txt).strip()
                     s = clean.find('{'); e = clean.rfind('}')+1
@@ -692,15 +852,41 @@ def _ai_batch(batch):
                         _cset(ck, out)
                         return out
                 elif r.status_code==429:
-                    time.sleep(2**attempt)
-            except: continue
-        time.sleep(1)
-    return [0]*len(batch)
+                    rep.inc("ai_429"); br.failure("HTTP 429")
+                    if br.is_open(): continue
+                    with rep.stage("ai_backoff"): time.sleep(2**attempt)
+                else:
+                    rep.inc(f"ai_http_{r.status_code}")
+                    # المزود رد: فشل (مفتاح غير صالح/5xx) أو نجاح اتصال (خطأ في الطلب نفسه)
+                    if bad: br.failure(f"HTTP {r.status_code}")
+                    else: br.success()
+                    if br.is_open(): break
+            except Exception as ex:
+                rep.inc("ai_errors"); br.failure(type(ex).__name__); continue
+            finally:
+                br.release()   # كل allow() يُقابله حكم — طلب half_open لا يبقى معلقاً
+        if br.is_open(): break
+        rep.inc("ai_retries")
+        with rep.stage("ai_backoff"): time.sleep(1)
+    rep.inc("ai_failed_batches")
+    return None
 
 
 # ═══════════════════════════════════════════════════════
 #  بناء صف النتيجة
 # ═══════════════════════════════════════════════════════
+# القرارات الثابتة — عمود القرار يُخرج كـ Categorical عليها (رمز int8 لكل صف)
+DECISIONS = ["🔴 سعر أعلى", "🟢 سعر أقل", "✅ موافق",
+             "⚠️ تحت المراجعة", "🔍 منتجات مفقودة"]
+
+
+def decision_categorical(values):
+    """قيم القرار → Categorical بفئات DECISIONS (+ أي قرار override غير معروف)"""
+    vals  = pd.Series(values, dtype=object).fillna("").astype(str)
+    extra = sorted(set(vals.unique()) - set(DECISIONS))
+    return pd.Categorical(vals, categories=DECISIONS + extra)
+
+
 def _row(product, our_price, our_id, brand, size, ptype, gender,
          best=None, override=None, src="", all_cands=None):
     sz_str = f"{int(size)}ml" if size else ""
@@ -766,59 +952,127 @@ def _row(product, our_price, our_id, brand, size, ptype, gender,
 # ═══════════════════════════════════════════════════════
 #  التحليل الكامل — v21 الهجين الفائق السرعة
 # ═══════════════════════════════════════════════════════
-def run_full_analysis(our_df, comp_dfs, progress_callback=None, use_ai=True):
+def fingerprint_inputs(our_df, comp_dfs):
+    """بصمة ثابتة لملفات الإدخال — تربط المهمة المنقطعة بنفس الملفات عند إعادة الرفع"""
+    h = hashlib.sha1()
+    for name, df in [("__our__", our_df)] + sorted(comp_dfs.items()):
+        h.update(str(name).encode())
+        h.update("|".join(map(str, df.columns)).encode())
+        try:
+            h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+        except Exception:
+            h.update(df.to_csv(index=False).encode())
+    return h.hexdigest()[:16]
+
+
+def run_full_analysis(our_df, comp_dfs, progress_callback=None, use_ai=True,
+                      resume=None, checkpoint_callback=None, checkpoint_every=200,
+                      report=None):
     """
     1. بناء CompIndex لكل منافس (تطبيع مسبق)
     2. لكل منتجنا → search vectorized
     3. score≥97 → تلقائي | 62-96 → AI batch | <62 → مفقود
+
+    الاستئناف:
+      resume              → {"rows": [(row_idx, row)], "pending": [...]} من نقطة حفظ سابقة
+                            الصفوف المحسومة لا يُعاد حسابها، ودفعة AI المعلقة تُستكمل
+      checkpoint_callback → fn(new_rows, pending, processed) كل checkpoint_every صف
+                            وبعد كل دفعة AI — new_rows = [(row_idx, row)] منذ آخر نقطة
+    report: RunReport (يُنشأ إذا لم يُمرر) → df.attrs["run_report"]
     """
-    results = []
-    our_col       = _fcol(our_df, ["المنتج","اسم المنتج","Product","Name","name"])
-    our_price_col = _fcol(our_df, ["السعر","سعر","Price","price","PRICE"])
-    our_id_col    = _fcol(our_df, [
-        "رقم المنتج","معرف المنتج","المعرف","معرف","رقم_المنتج","معرف_المنتج",
-        "product_id","Product ID","Product_ID","ID","id","Id",
-        "SKU","sku","Sku","رمز المنتج","رمز_المنتج","رمز المنتج sku",
-        "الكود","كود","Code","code","الرقم","رقم","Barcode","barcode","الباركود"
-    ])
+    report  = report or RunReport("analysis")
+    cnt     = report.counters
+    resume  = resume or {}
+    results = [(int(i), r) for i, r in resume.get("rows", [])]   # (row_idx, row)
+    done    = {i for i, _ in results}
+    fresh   = []  # [(row_idx, row)] منذ آخر نقطة حفظ
+    our_col       = _fcol(our_df, NAME_COLS)
+    our_price_col = _fcol(our_df, PRICE_COLS)
+    our_id_col    = _fcol(our_df, ID_COLS)
 
     # ── بناء الفهارس المسبقة ──
-    indices = {}
-    for cname, cdf in comp_dfs.items():
-        ccol = _fcol(cdf, ["المنتج","اسم المنتج","Product","Name","name"])
-        icol = _fcol(cdf, [
-            "رقم المنتج","معرف المنتج","المعرف","معرف","رقم_المنتج","معرف_المنتج",
-            "product_id","Product ID","Product_ID","ID","id","Id",
-            "SKU","sku","Sku","رمز المنتج","رمز_المنتج","رمز المنتج sku",
-            "الكود","كود","Code","code","الرقم","رقم","Barcode","barcode","الباركود"
-        ])
-        indices[cname] = CompIndex(cdf, ccol, icol, cname)
+    with report.stage("index_build"):
+        indices = {cname: CompIndex.from_df(cdf, cname) for cname, cdf in comp_dfs.items()}
+    cnt["competitor_rows"] += sum(len(x.raw_names) for x in indices.values())
 
     total   = len(our_df)
-    pending = []
+    pending = list(resume.get("pending", []))
+    queued  = {int(it["i"]) for it in pending if "i" in it}
     BATCH   = 12  # زيادة الـ batch لتقليل استدعاءات API
+    last_ckpt = 0
+
+    def _emit(i, row):
+        results.append((i, row))
+        fresh.append((i, row))
+        done.add(i)
+
+    def _checkpoint(processed):
+        nonlocal last_ckpt
+        if not checkpoint_callback: return
+        try:
+            with report.stage("checkpoint"):
+                checkpoint_callback(list(fresh), list(pending), processed)
+        except Exception: return  # فشل الحفظ لا يوقف التحليل
+        fresh.clear()
+        last_ckpt = processed
+
+    def _fallback_src(score):
+        """AI غير متاح: مرشح قوي يُسعّر، والأضعف للمراجعة"""
+        if score >= AI_FALLBACK_ACCEPT_SCORE:
+            cnt["ai_fallback_accepted"] += 1; return "auto"
+        cnt["ai_fallback_fuzzy"] += 1; return "fuzzy"
 
     def _flush():
         if not pending: return
-        idxs = _ai_batch(pending)
+        cnt["ai_batches"] += 1
+        with report.stage("ai"):
+            idxs = _ai_batch(pending, report=report)
         for j, it in enumerate(pending):
+            if idxs is None:
+                # AI غير متاح → أفضل مرشح fuzzy (مسعّر فوق العتبة، وإلا تحت المراجعة)
+                best = it["candidates"][0]
+                _emit(int(it.get("i", -1)), _row(it["product"],it["our_price"],it["our_id"],
+                      it["brand"],it["size"],it["ptype"],it["gender"],
+                      best,src=_fallback_src(best["score"]),all_cands=it["all_cands"]))
+                continue
             ci = idxs[j] if j<len(idxs) else 0
             if ci < 0:
-                results.append(_row(it["product"],it["our_price"],it["our_id"],
-                                    it["brand"],it["size"],it["ptype"],it["gender"],
-                                    None,"🔍 منتجات مفقودة","gemini_no_match"))
+                cnt["ai_no_match"] += 1
+                row = _row(it["product"],it["our_price"],it["our_id"],
+                           it["brand"],it["size"],it["ptype"],it["gender"],
+                           None,"🔍 منتجات مفقودة","gemini_no_match")
             else:
                 best = it["candidates"][ci]
-                results.append(_row(it["product"],it["our_price"],it["our_id"],
-                                    it["brand"],it["size"],it["ptype"],it["gender"],
-                                    best,src="gemini",all_cands=it["all_cands"]))
+                row = _row(it["product"],it["our_price"],it["our_id"],
+                           it["brand"],it["size"],it["ptype"],it["gender"],
+                           best,src="gemini",all_cands=it["all_cands"])
+            _emit(int(it.get("i", -1)), row)
         pending.clear()
+        queued.clear()
+
+    # زمن المراحل داخل الحلقة: مجاميع محلية تُضاف للتقرير مرة واحدة في النهاية
+    clock  = lambda: (time.perf_counter(), time.thread_time())
+    t_feat = [0.0, 0.0]; t_search = [0.0, 0.0]; t_prog = [0.0, 0.0]
+
+    def _progress(p):
+        if not progress_callback: return
+        t0 = clock(); progress_callback(p); t1 = clock()
+        t_prog[0] += t1[0] - t0[0]; t_prog[1] += t1[1] - t0[1]
 
     for i, (_, row) in enumerate(our_df.iterrows()):
+        if i in done or i in queued:
+            # محسوم في تشغيل سابق → تخطي
+            cnt["resumed_skipped"] += 1
+            _progress((i+1)/total)
+            continue
+
         product = str(row.get(our_col,"")).strip()
         if not product or is_sample(product):
-            if progress_callback: progress_callback((i+1)/total)
+            cnt["sample_skipped"] += 1
+            _progress((i+1)/total)
             continue
+        cnt["products"] += 1
+        t0 = clock()
 
         our_price = 0.0
         if our_price_col:
@@ -831,133 +1085,163 @@ def run_full_analysis(our_df, comp_dfs, progress_callback=None, use_ai=True):
         ptype   = extract_type(product)
         gender  = extract_gender(product)
         our_n   = normalize(product)
-        our_pl  = extract_product_line(product, brand)
+        our_pl  = extract_product_line(our_n, brand)
+        t1 = clock()
 
         # ── جمع المرشحين من كل الفهارس ──
         all_cands = []
         for idx_obj in indices.values():
-            all_cands.extend(idx_obj.search(our_n, brand, size, ptype, gender, our_pline=our_pl, top_n=5))
+            all_cands.extend(idx_obj.search(our_n, brand, size, ptype, gender, our_pline=our_pl,
+                                            top_n=5, report=report))
+        t2 = clock()
+        t_feat[0] += t1[0] - t0[0]; t_feat[1] += t1[1] - t0[1]
+        t_search[0] += t2[0] - t1[0]; t_search[1] += t2[1] - t1[1]
 
         if not all_cands:
-            results.append(_row(product,our_price,our_id,brand,size,ptype,gender,
-                                None,"🔍 منتجات مفقودة"))
-            if progress_callback: progress_callback((i+1)/total)
-            continue
-
-        all_cands.sort(key=lambda x: x["score"], reverse=True)
-        top5  = all_cands[:5]
-        best0 = top5[0]
-
-        if best0["score"] >= 97 or not use_ai:
-            # واضح تماماً → لا حاجة AI
-            results.append(_row(product,our_price,our_id,brand,size,ptype,gender,
-                                best0,src="auto",all_cands=all_cands))
+            cnt["no_candidates"] += 1
+            _emit(i, _row(product,our_price,our_id,brand,size,ptype,gender,
+                          None,"🔍 منتجات مفقودة"))
         else:
-            # غامض → AI batch
-            pending.append(dict(product=product,our_price=our_price,our_id=our_id,
-                                brand=brand,size=size,ptype=ptype,gender=gender,
-                                candidates=top5,all_cands=all_cands,
-                                our=product,price=our_price))
-            if len(pending) >= BATCH: _flush()
-
-        if progress_callback: progress_callback((i+1)/total)
+            all_cands.sort(key=lambda x: x["score"], reverse=True)
+            top5  = all_cands[:5]
+            best0 = top5[0]
+
+            if best0["score"] >= 97 or not use_ai or ai_down():
+                # واضح تماماً → لا حاجة AI | قاطع Gemini مفتوح → fuzzy فوراً بدل الانتظار
+                if best0["score"] >= 97:  cnt["auto_accepted"] += 1; src = "auto"
+                elif not use_ai:          cnt["fuzzy_only"] += 1; src = "auto"
+                else:                     src = _fallback_src(best0["score"])
+                _emit(i, _row(product,our_price,our_id,brand,size,ptype,gender,
+                              best0,src=src,all_cands=all_cands))
+            else:
+                # غامض → AI batch
+                cnt["sent_to_ai"] += 1
+                pending.append(dict(i=i,product=product,our_price=our_price,our_id=our_id,
+                                    brand=brand,size=size,ptype=ptype,gender=gender,
+                                    candidates=top5,all_cands=all_cands,
+                                    our=product,price=our_price))
+                queued.add(i)
+                if len(pending) >= BATCH:
+                    _flush()
+                    _checkpoint(i+1)
+
+        if i+1 - last_ckpt >= checkpoint_every: _checkpoint(i+1)
+        _progress((i+1)/total)
 
     _flush()
-    return pd.DataFrame(results)
+    _checkpoint(total)
+    report.add_time("features", *t_feat, calls=cnt["products"])
+    report.add_time("search", *t_search, calls=cnt["products"])
+    if progress_callback: report.add_time("progress", *t_prog, calls=total)
+    with report.stage("assemble"):
+        # بترتيب صفوف ملفنا: المستأنف والمؤجل لـ AI يُصدران متأخرين → نفس إطار التشغيل غير المنقطع
+        results.sort(key=lambda x: x[0])
+        df = pd.DataFrame([r for _, r in results])
+        if not df.empty:
+            df["القرار"] = decision_categorical(df["القرار"].tolist())
+    df.attrs["run_report"] = report.to_dict()
+    return df
 
 
 # ═══════════════════════════════════════════════════════
 #  المنتجات المفقودة (محدثة - الإصدار المتوازن والدقيق)
 # ═══════════════════════════════════════════════════════
-def find_missing_products(our_df, comp_dfs):
-    our_col  = _fcol(our_df, ["المنتج","اسم المنتج","Product","Name","name"])
-    
+def find_missing_products(our_df, comp_dfs, report=None):
+    """report: RunReport اختياري — مراحل missing_* وعدادات missing_* (→ df.attrs["run_report"])"""
+    report = report or RunReport("missing")
+    cnt    = report.counters
+    our_col  = _fcol(our_df, NAME_COLS)
+
     # تجهيز بيانات منتجاتنا للبحث السريع
     our_items = []
-    for _, r in our_df.iterrows():
-        name = str(r.get(our_col, "")).strip()
-        if not name or is_sample(name): continue
-        brand = extract_brand(name)
-        our_items.append({
-            "norm": normalize(name),
-            "brand": brand,
-            "pline": extract_product_line(name, brand),
-            "size": extract_size(name),
-            "type": extract_type(name),
-            "gender": extract_gender(name)
-        })
+    with report.stage("missing_features"):
+        for _, r in our_df.iterrows():
+            name = str(r.get(our_col, "")).strip()
+            if not name or is_sample(name): continue
+            brand, norm = extract_brand(name), normalize(name)
+            our_items.append({
+                "norm": norm,
+                "brand": brand,
+                "pline": extract_product_line(norm, brand),
+                "size": extract_size(name),
+                "type": extract_type(name),
+                "gender": extract_gender(name)
+            })
 
     missing, seen = [], set()
-    for cname, cdf in comp_dfs.items():
-        ccol = _fcol(cdf, ["المنتج","اسم المنتج","Product","Name","name"])
-        icol = _fcol(cdf, [
-            "رقم المنتج","معرف المنتج","المعرف","معرف","رقم_المنتج","معرف_المنتج",
-            "product_id","Product ID","Product_ID","ID","id","Id",
-            "SKU","sku","Sku","رمز المنتج","رمز_المنتج","رمز المنتج sku",
-            "الكود","كود","Code","code","الرقم","رقم","Barcode","barcode","الباركود"
-        ])
+    with report.stage("missing_scan"):
+        for cname, cdf in comp_dfs.items():
+            ccol = _fcol(cdf, NAME_COLS)
+            icol = _fcol(cdf, ID_COLS)
         
-        for _, row in cdf.iterrows():
-            cp = str(row.get(ccol, "")).strip()
-            if not cp or is_sample(cp): continue
-            cn = normalize(cp)
-            if not cn: continue
+            for _, row in cdf.iterrows():
+                cp = str(row.get(ccol, "")).strip()
+                cnt["missing_competitor_rows"] += 1
+                if not cp or is_sample(cp): cnt["missing_sample_skipped"] += 1; continue
+                cn = normalize(cp)
+                if not cn: continue
             
-            c_brand = extract_brand(cp)
-            c_pline = extract_product_line(cp, c_brand)
-            c_size = extract_size(cp)
-            c_type = extract_type(cp)
-            c_gender = extract_gender(cp)
+                c_brand = extract_brand(cp)
+                c_pline = extract_product_line(cn, c_brand)
+                c_size = extract_size(cp)
+                c_type = extract_type(cp)
+                c_gender = extract_gender(cp)
             
-            # تصفية المقارنة حسب الماركة لتسريع البحث وزيادة الدقة
-            if c_brand:
-                candidates = [o for o in our_items if not o["brand"] or normalize(o["brand"]) == normalize(c_brand)]
-            else:
-                candidates = our_items
+                # تصفية المقارنة حسب الماركة لتسريع البحث وزيادة الدقة
+                if c_brand:
+                    candidates = [o for o in our_items if not o["brand"] or normalize(o["brand"]) == normalize(c_brand)]
+                else:
+                    candidates = our_items
             
-            is_missing = True
-            if candidates:
-                norms = [c["norm"] for c in candidates]
-                # استخدام token_sort_ratio لأنه أدق في ترتيب الكلمات من token_set
-                matches = rf_process.extract(cn, norms, scorer=fuzz.token_sort_ratio, limit=3)
+                is_missing = True
+                if candidates:
+                    norms = [c["norm"] for c in candidates]
+                    cnt["missing_candidates_scanned"] += len(norms)
+                    # استخدام token_sort_ratio لأنه أدق في ترتيب الكلمات من token_set
+                    matches = rf_process.extract(cn, norms, scorer=fuzz.token_sort_ratio, limit=3)
                 
-                for match_norm, match_score, match_idx in matches:
-                    if match_score >= 70:  # إذا كان هناك تشابه مبدئي، نقوم بالتدقيق
-                        matched_item = candidates[match_idx]
-                        penalty = 0
+                    for match_norm, match_score, match_idx in matches:
+                        if match_score >= 70:  # إذا كان هناك تشابه مبدئي، نقوم بالتدقيق
+                            matched_item = candidates[match_idx]
+                            penalty = 0
                         
-                        # تطبيق عقوبات في حال اختلاف المواصفات الجوهرية
-                        if c_size > 0 and matched_item["size"] > 0 and abs(c_size - matched_item["size"]) > 10:
-                            penalty += 25  # حجم مختلف
-                        if c_type and matched_item["type"] and c_type != matched_item["type"]:
-                            penalty += 15  # تركيز مختلف (EDP vs EDT)
-                        if c_gender and matched_item["gender"] and c_gender != matched_item["gender"]:
-                            penalty += 25  # جنس مختلف
+                            # تطبيق عقوبات في حال اختلاف المواصفات الجوهرية
+                            if c_size > 0 and matched_item["size"] > 0 and abs(c_size - matched_item["size"]) > 10:
+                                penalty += 25  # حجم مختلف
+                            if c_type and matched_item["type"] and c_type != matched_item["type"]:
+                                penalty += 15  # تركيز مختلف (EDP vs EDT)
+                            if c_gender and matched_item["gender"] and c_gender != matched_item["gender"]:
+                                penalty += 25  # جنس مختلف
                             
-                        if c_pline and matched_item["pline"]:
-                            pl_score = fuzz.token_sort_ratio(c_pline, matched_item["pline"])
-                            if pl_score < 75:
-                                penalty += 20  # خط إنتاج مختلف
+                            if c_pline and matched_item["pline"]:
+                                pl_score = fuzz.token_sort_ratio(c_pline, matched_item["pline"])
+                                if pl_score < 75:
+                                    penalty += 20  # خط إنتاج مختلف
                                 
-                        final_score = match_score - penalty
+                            final_score = match_score - penalty
                         
-                        # إذا بقي السكور أعلى من 68 بعد العقوبات، إذن المنتج موجود لدينا فعلاً
-                        if final_score >= 85:
-                            is_missing = False
-                            break  # توقف عن البحث، المنتج ليس مفقوداً
+                            # إذا بقي السكور أعلى من 68 بعد العقوبات، إذن المنتج موجود لدينا فعلاً
+                            if final_score >= 85:
+                                is_missing = False
+                                break  # توقف عن البحث، المنتج ليس مفقوداً
                             
-            if is_missing:
-                seen.add(cn)
-                missing.append({
-                    "منتج_المنافس": cp, "معرف_المنافس": _pid(row, icol),
-                    "سعر_المنافس": _price(row), "المنافس": cname,
-                    "الماركة": c_brand,
-                    "الحجم": f"{int(c_size)}ml" if c_size else "",
-                    "النوع": c_type, "الجنس": c_gender,
-                    "تاريخ_الرصد": datetime.now().strftime("%Y-%m-%d"),
-                })
-                
-    return pd.DataFrame(missing) if missing else pd.DataFrame()
+                if is_missing:
+                    seen.add(cn)
+                    missing.append({
+                        "منتج_المنافس": cp, "معرف_المنافس": _pid(row, icol),
+                        "سعر_المنافس": _price(row), "المنافس": cname,
+                        "الماركة": c_brand,
+                        "الحجم": f"{int(c_size)}ml" if c_size else "",
+                        "النوع": c_type, "الجنس": c_gender,
+                        "تاريخ_الرصد": datetime.now().strftime("%Y-%m-%d"),
+                    })
+
+    cnt["missing_found"] += len(missing)
+    df = pd.DataFrame(missing) if missing else pd.DataFrame()
+    df.attrs["run_report"] = report.to_dict()
+    return df
+
+
 # ═══════════════════════════════════════════════════════
 #  تصدير Excel ملوّن
 # ═══════════════════════════════════════════════════════
@@ -0,0 +1,219 @@
+"""
+engines/enrichment.py - إثراء المنتجات المفقودة في الخلفية
+- بعد find_missing_products: أعلى ENRICH_TOP_N منتج بالأولوية → Fragrantica (صورة + مكونات)
+  ثم أوصاف مهووس بالدفعات مبنية على نفس البيانات (بدون استدعاء Fragrantica ثانٍ)
+- الأولوية: عدد المنافسين الذين يبيعون المنتج ↓ ثم أعلى سعر ↓
+- مهمة واحدة في JobManager (أولوية مجدولة) وداخلها ENRICH_WORKERS طلب متزامن فقط
+- النتائج في جدول enrichment — صفحة المفقودات تقرأ منه فوراً
+- الأقدم من ENRICH_STALE_DAYS يُعاد جلبه، والفشل المتكرر (MAX_ATTEMPTS) لا يُعاد حتى يقدم
+- "وصف الكل": كل المفقودات المعروضة → إثراء + أوصاف بالدفعات → صندوق Make (منتجات جديدة)
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from engines.engine import normalize
+from engines.ai_engine import (fetch_fragrantica_info, generate_mahwous_description,
+                               generate_mahwous_descriptions)
+from engines.circuit import breaker
+from utils.db_manager import get_enrichment_bulk, save_enrichment, close_db
+from utils.helpers import safe_float
+from utils.job_manager import (get_job_manager, JobCancelled, PRIORITY_SCHEDULED,
+                               PRIORITY_INTERACTIVE)
+from utils.make_helper import export_to_make_format
+from utils.make_outbox import enqueue_make_delivery
+
+try:
+    from config import ENRICH_TOP_N, ENRICH_WORKERS, ENRICH_STALE_DAYS, GEMINI_API_KEYS
+except:
+    ENRICH_TOP_N, ENRICH_WORKERS, ENRICH_STALE_DAYS = 50, 3, 30
+    GEMINI_API_KEYS = []
+
+NAME_COL, PRICE_COL, COMP_COL = "منتج_المنافس", "سعر_المنافس", "المنافس"
+MAX_ATTEMPTS = 3
+
+
+def enrichment_key(name):
+    """نفس المنتج بكتابات مختلفة (عربي/إنجليزي، مسافات) → نفس السجل"""
+    return normalize(str(name)) or str(name).strip().lower()
+
+
+def is_stale(rec, days=None):
+    days = ENRICH_STALE_DAYS if days is None else days
+    ts = (rec or {}).get("fetched_at")
+    if not ts: return True
+    try: return datetime.now() - datetime.strptime(ts, "%Y-%m-%d %H:%M:%S") > timedelta(days=days)
+    except: return True
+
+
+def needs_work(rec, describe=True):
+    if not rec or is_stale(rec): return True
+    if rec.get("status") != "ok": return rec.get("attempts", 0) < MAX_ATTEMPTS
+    return describe and not rec.get("description")
+
+
+def prioritize(missing_df, top_n=None):
+    """[(key, name, price)] مرتبة: يبيعه منافسون أكثر أولاً، ثم الأغلى"""
+    if missing_df is None or missing_df.empty or NAME_COL not in missing_df.columns:
+        return []
+    comps  = missing_df[COMP_COL].astype(str) if COMP_COL in missing_df.columns else [""] * len(missing_df)
+    prices = missing_df[PRICE_COL] if PRICE_COL in missing_df.columns else [0] * len(missing_df)
+    groups = {}
+    for name, price, comp in zip(missing_df[NAME_COL].astype(str), prices, comps):
+        if not name.strip(): continue
+        g = groups.setdefault(enrichment_key(name), {"name": name, "price": 0.0, "comps": set()})
+        g["comps"].add(comp)
+        g["price"] = max(g["price"], safe_float(price))
+    ranked = sorted(groups.items(), key=lambda kv: (-len(kv[1]["comps"]), -kv[1]["price"]))
+    return [(k, g["name"], g["price"]) for k, g in ranked[:top_n or None]]
+
+
+def enrich_one(key, name, price, describe=True, refresh=False):
+    """
+    جلب منتج واحد وتخزينه → السجل المحدّث
+    Fragrantica فقط إذا لم يوجد سجل ناجح حديث؛ الوصف يستخدم info المخزن
+    """
+    rec = get_enrichment_bulk([key]).get(key)
+    info, fetched = (rec or {}).get("info"), False
+    if refresh or not rec or rec.get("status") != "ok" or is_stale(rec):
+        try:
+            # قديم/تحديث يدوي → تجاوز كاش AI أيضاً
+            info = fetch_fragrantica_info(name, refresh=refresh or bool(rec))
+            save_enrichment(key, name, info=info)
+            fetched = True
+        except Exception as e:
+            save_enrichment(key, name, error=str(e)[:200])
+            return get_enrichment_bulk([key]).get(key)
+    if describe and info and info.get("success") and \
+            (fetched or refresh or not (rec or {}).get("description")):
+        desc = generate_mahwous_description(name, price, info, refresh=refresh, fallback=False)
+        if desc: save_enrichment(key, name, description=desc)
+    return get_enrichment_bulk([key]).get(key)
+
+
+def _worker(key, name, price):
+    try:
+        return enrich_one(key, name, price, describe=False)
+    finally:
+        close_db()
+
+
+def _fetch_all(job, todo, workers, out):
+    """Fragrantica بالتوازي (ENRICH_WORKERS) — يتوقف مبكراً إذا فُتح قاطع Gemini"""
+    ex = ThreadPoolExecutor(max_workers=max(1, int(workers or ENRICH_WORKERS)),
+                            thread_name_prefix="enrich")
+    try:
+        futs = [ex.submit(_worker, k, n, p) for k, n, p in todo]
+        for done, f in enumerate(as_completed(futs), 1):
+            try: rec = f.result()
+            except Exception: rec = None
+            out["ok" if rec and rec.get("status") == "ok" else "failed"] += 1
+            if breaker("gemini").is_open():
+                out["stopped"] = "circuit_open"
+                for other in futs: other.cancel()
+                break
+            job.progress(done, len(todo), f"Fragrantica {done}/{len(todo)}")
+    except JobCancelled:
+        out["stopped"] = "cancelled"
+        raise
+    finally:
+        ex.shutdown(wait=True, cancel_futures=True)
+
+
+def describe_pending(items, refresh=False, progress=None):
+    """
+    أوصاف مهووس بالدفعات للسجلات الناجحة بلا وصف (أو كلها مع refresh)
+    items = [(key, name, price)] → عدد الأوصاف المحفوظة
+    """
+    recs = get_enrichment_bulk([k for k, _, _ in items])
+    todo = [(k, n, p, recs[k]["info"]) for k, n, p in items
+            if k in recs and recs[k].get("status") == "ok" and (refresh or not recs[k].get("description"))]
+    if not todo: return 0
+    descs = generate_mahwous_descriptions([(n, p, info) for _, n, p, info in todo],
+                                          refresh=refresh, progress=progress)
+    saved = 0
+    for (k, n, _, _), desc in zip(todo, descs):
+        if desc:
+            save_enrichment(k, n, description=desc); saved += 1
+    return saved
+
+
+def enrichment_job(job, items, workers=None, describe=True):
+    """
+    مهمة JobManager: items = prioritize(...) — يتخطى الحديث
+    1) Fragrantica بالتوازي  2) أوصاف بالدفعات لكل ناجح بلا وصف
+    تُرجع {"total", "queued", "ok", "failed", "skipped", "described", "stopped"}
+    """
+    known = get_enrichment_bulk([k for k, _, _ in items])
+    todo  = [it for it in items if needs_work(known.get(it[0]), describe)]
+    out   = {"total": len(items), "queued": len(todo), "ok": 0, "failed": 0,
+             "skipped": len(items) - len(todo), "described": 0, "stopped": ""}
+    job.progress(0, len(todo), "إثراء المفقودات")
+    if not todo: return out
+
+    fetch = [it for it in todo if not known.get(it[0]) or known[it[0]].get("status") != "ok"
+             or is_stale(known[it[0]])]
+    _fetch_all(job, fetch, workers, out)
+    if describe and not out["stopped"]:
+        out["described"] = describe_pending(
+            todo, progress=lambda d, t: job.progress(d, t, f"أوصاف مهووس {d}/{t}"))
+    return out
+
+
+def describe_all_job(job, missing_df, workers=None):
+    """
+    "وصف الكل": كل المفقودات → إثراء الناقص → أوصاف بالدفعات → صندوق Make (missing)
+    منتج واحد لكل اسم موحد؛ بلا وصف AI → القالب المختصر (الإرسال لا يتوقف على AI)
+    """
+    items = prioritize(missing_df)
+    out   = {"total": len(items), "ok": 0, "failed": 0, "described": 0, "stopped": ""}
+    known = get_enrichment_bulk([k for k, _, _ in items])
+    _fetch_all(job, [it for it in items if needs_work(known.get(it[0]), describe=False)],
+               workers, out)
+    if not out["stopped"]:
+        out["described"] = describe_pending(
+            items, progress=lambda d, t: job.progress(d, t, f"أوصاف مهووس {d}/{t}"))
+
+    recs, products, seen = get_enrichment_bulk([k for k, _, _ in items]), [], set()
+    for p in export_to_make_format(missing_df, "missing"):
+        k = enrichment_key(p.get("name", ""))
+        if not p.get("name") or k in seen: continue
+        seen.add(k)
+        p["description"] = ((recs.get(k) or {}).get("description")
+                            or f"🌟 {p['name']}\n💰 السعر: {safe_float(p.get('price')):.0f} ر.س")
+        products.append(p)
+    out["make"] = enqueue_make_delivery("missing", products)
+    return out
+
+
+def start_enrichment(missing_df, top_n=None, describe=True):
+    """
+    يرسل مهمة الإثراء للطابور (أولوية مجدولة → بعد أي تحليل تفاعلي)
+    None إذا لا توجد مفاتيح AI أو القاطع مفتوح أو لا شيء للإثراء
+    """
+    if not GEMINI_API_KEYS or breaker("gemini").is_open():
+        return None
+    items = prioritize(missing_df, top_n or ENRICH_TOP_N)
+    if not items: return None
+    dk = "enrich:" + hashlib.md5("|".join(k for k, _, _ in items).encode()).hexdigest()[:12]
+    return get_job_manager().submit(enrichment_job, items, kind="enrich", describe=describe,
+                                    priority=PRIORITY_SCHEDULED, dedupe_key=dk,
+                                    meta={"items": len(items)})
+
+
+def start_describe_all(missing_df):
+    """مهمة "وصف الكل" (تفاعلية — طلبها المستخدم) → Job أو None إذا لا يوجد شيء"""
+    if missing_df is None or missing_df.empty:
+        return None
+    names = "|".join(sorted(missing_df[NAME_COL].astype(str))) if NAME_COL in missing_df.columns else ""
+    return get_job_manager().submit(describe_all_job, missing_df, kind="describe",
+                                    priority=PRIORITY_INTERACTIVE,
+                                    dedupe_key="describe:" + hashlib.md5(names.encode()).hexdigest()[:12],
+                                    meta={"items": len(missing_df)})
+
+
+def get_enrichment(names):
+    """{name: سجل أو None} لأسماء الصفحة الحالية — استعلام واحد"""
+    keys = {n: enrichment_key(n) for n in names}
+    recs = get_enrichment_bulk(list(keys.values()))
+    return {n: recs.get(k) for n, k in keys.items()}
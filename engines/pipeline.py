@@ -0,0 +1,87 @@
+"""
+engines/pipeline.py - خط التحليل الكامل (بدون Streamlit)
+run_full_analysis → upsert_price_history → find_missing_products → حفظ المهمة + السجل
+يُشغَّل كمهمة في utils.job_manager من الواجهة، أو مباشرة من سطر الأوامر
+"""
+from engines.engine import run_full_analysis, find_missing_products, RunReport
+from utils.db_manager import (save_job_progress, save_job_checkpoint, upsert_price_history,
+                              log_analysis, transaction)
+from utils.helpers import safe_float
+
+
+def save_price_history(analysis_df):
+    """تاريخ الأسعار لكل صف مطابق — معاملة واحدة لكل الصفوف"""
+    n = 0
+    with transaction():
+        for row in analysis_df.to_dict("records"):
+            if safe_float(row.get("نسبة_التطابق", 0)) > 0:
+                upsert_price_history(
+                    str(row.get("المنتج", "")),
+                    str(row.get("المنافس", "")),
+                    safe_float(row.get("سعر_المنافس", 0)),
+                    safe_float(row.get("السعر", 0)),
+                    safe_float(row.get("الفرق", 0)),
+                    safe_float(row.get("نسبة_التطابق", 0)),
+                    str(row.get("القرار", ""))
+                )
+                n += 1
+    return n
+
+
+def analysis_job(job, our_df, comp_dfs, our_file_name, comp_names,
+                 fingerprint="", resume=None, use_ai=True):
+    """
+    مهمة التحليل: التقدم عبر job.progress (ذاكرة + لقطة DB)، نقطة استئناف كل 200 صف،
+    الإلغاء/المهلة تُفحص مع كل صف. تُرجع {"analysis": df, "missing": df, "report": dict}
+    """
+    report = RunReport("analysis")
+    total = len(our_df)
+    job.progress(len(resume["rows"]) if resume else 0, total, "مطابقة")
+
+    if not resume:
+        save_job_progress(job.id, total, 0, [], "running",
+                          our_file_name, comp_names, fingerprint=fingerprint)
+
+    def checkpoint_cb(rows, pending, done):
+        save_job_checkpoint(job.id, rows, pending, done, total)
+
+    analysis_df = run_full_analysis(our_df, comp_dfs,
+                                    progress_callback=lambda p: job.progress(int(p * total)),
+                                    use_ai=use_ai,
+                                    resume=resume,
+                                    checkpoint_callback=checkpoint_cb,
+                                    report=report)
+    job.progress(total, total, "المنتجات المفقودة")
+    missing_df = find_missing_products(our_df, comp_dfs, report=report)
+
+    job.progress(total, total, "الحفظ")
+    finish_analysis(job.id, total, analysis_df, missing_df, our_file_name, comp_names,
+                    report=report)
+    if use_ai and not missing_df.empty:
+        try:
+            # إثراء المفقودات في الخلفية (أولوية مجدولة → لا يزاحم التحليلات)
+            from engines.enrichment import start_enrichment
+            start_enrichment(missing_df)
+        except Exception:
+            pass
+    return {"analysis": analysis_df, "missing": missing_df, "report": report.to_dict()}
+
+
+def finish_analysis(job_id, total, analysis_df, missing_df, our_file_name, comp_names,
+                    report=None):
+    """
+    حفظ نتيجة تحليل مكتمل: تاريخ الأسعار + المهمة (done، تُستعاد من الواجهة) + السجل
+    مشتركة بين مهمة الواجهة وbatch_run.py — report (RunReport) يُحفظ مع السجل
+    """
+    report = report or RunReport("analysis")
+    with report.stage("save_history"):
+        save_price_history(analysis_df)
+    with report.stage("save_job"):
+        save_job_progress(job_id, total, total,
+                          analysis_df.to_dict("records"),
+                          "done", our_file_name, comp_names,
+                          missing=missing_df.to_dict("records") if not missing_df.empty else [])
+    analysis_df.attrs["run_report"] = report.to_dict()
+    log_analysis(our_file_name, comp_names, total,
+                 int((analysis_df["نسبة_التطابق"] > 0).sum()) if not analysis_df.empty else 0,
+                 len(missing_df), report=analysis_df.attrs["run_report"])
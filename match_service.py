@@ -0,0 +1,281 @@
+"""
+match_service.py - خدمة مطابقة HTTP محلية فوق CompIndex v1.0
+- تُحمّل ملفات المنافسين مرة واحدة وتبقي فهارسها في الذاكرة (نفس تقييم CompIndex.search)
+- إعادة تحميل تلقائية: ملف جديد/معدّل في المجلد → فهرس جديد يُبنى جانباً ثم يُبدّل دفعة واحدة
+- بدون Streamlit وبدون مكتبات إضافية (http.server + ThreadingHTTPServer)
+
+النقاط:
+    GET  /health                      حالة الفهارس
+    GET  /match?q=<اسم>&top_n=5       مطابقة منتج واحد
+    POST /match        {"name", "top_n", "competitors"}
+    POST /match/batch  {"items": [{"id", "name"} | "name", ...], "top_n", "competitors"}
+                                      (search_many: cdist واحد لكل فهرس بدل بحث لكل عنصر)
+    POST /reload                      إعادة فحص المجلد فوراً
+    GET  /stats                       عدد الطلبات + p50/p99 زمن الاستعلام (ms)
+
+تشغيل:
+    python match_service.py competitors/ --port 8765
+    MATCH_SERVICE_TOKEN=... → يُطلب Authorization: Bearer <token>
+"""
+import argparse, json, os, sys, threading, time
+from collections import deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from engines.engine import read_file, CompIndex, prepare_query
+
+SNAPSHOT_EXTS = (".csv", ".xlsx", ".xls")
+MAX_BATCH     = 500
+AUTO_SCORE    = 97       # نفس حد القبول التلقائي في run_full_analysis
+TOKEN         = os.environ.get("MATCH_SERVICE_TOKEN", "")
+
+
+def _log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}", file=sys.stderr, flush=True)
+
+
+# ─── الفهارس ───────────────────────────────
+class IndexRegistry:
+    """ملف → (mtime, size, CompIndex). القراءة بدون قفل: self.indices يُستبدل ولا يُعدّل"""
+
+    def __init__(self, paths):
+        self.paths   = paths
+        self.indices = {}     # comp_name → CompIndex
+        self.meta    = {}     # comp_name → {"path", "mtime", "size", "rows", "loaded_at", "build_ms"}
+        self._lock   = threading.Lock()
+
+    def _files(self):
+        out = []
+        for p in self.paths:
+            if os.path.isdir(p):
+                out += [os.path.join(p, f) for f in sorted(os.listdir(p))
+                        if f.lower().endswith(SNAPSHOT_EXTS) and not f.startswith((".", "~$"))]
+            elif os.path.isfile(p):
+                out.append(p)
+        return out
+
+    def refresh(self):
+        """يعيد بناء الملفات الجديدة/المعدلة فقط؛ يُرجع أسماء ما تغيّر"""
+        with self._lock:
+            indices, meta, changed = dict(self.indices), dict(self.meta), []
+            files = self._files()
+            seen = set()
+            for path in files:
+                name = os.path.basename(path)
+                seen.add(name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                old = meta.get(name)
+                if old and (old["mtime"], old["size"]) == (st.st_mtime, st.st_size):
+                    continue
+                t0 = time.perf_counter()
+                with open(path, "rb") as f:
+                    df, err = read_file(f)
+                if err or df is None or df.empty:
+                    _log(f"⚠️ {name}: {err or 'ملف فارغ'}"); continue
+                indices[name] = CompIndex.from_df(df, name)
+                meta[name] = {"path": path, "mtime": st.st_mtime, "size": st.st_size,
+                              "rows": len(df), "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                              "build_ms": round((time.perf_counter() - t0) * 1000, 1)}
+                changed.append(name)
+            for name in set(indices) - seen:
+                indices.pop(name, None); meta.pop(name, None); changed.append(name)
+            if changed:
+                self.indices, self.meta = indices, meta
+                _log(f"🔄 فهارس: {', '.join(changed)} ({len(indices)} منافس)")
+            return changed
+
+    def watch(self, every):
+        def loop():
+            while True:
+                time.sleep(every)
+                try: self.refresh()
+                except Exception as e: _log(f"⚠️ إعادة التحميل: {e}")
+        threading.Thread(target=loop, name="index-reload", daemon=True).start()
+
+
+@lru_cache(maxsize=8192)
+def _prepared(name):
+    return tuple(prepare_query(name).items())
+
+
+def match(registry, name, top_n=5, competitors=None):
+    """نفس جمع المرشحين في run_full_analysis: كل الفهارس → ترتيب بالدرجة → top_n"""
+    q = dict(_prepared(str(name or "").strip()))
+    if not q["our_norm"]:
+        return []
+    cands = []
+    for cname, idx in registry.indices.items():
+        if competitors and cname not in competitors: continue
+        cands.extend(idx.search(**q, top_n=top_n))
+    cands.sort(key=lambda x: x["score"], reverse=True)
+    for c in cands:
+        c["auto"] = c["score"] >= AUTO_SCORE
+    return cands[:top_n]
+
+
+def match_many(registry, names, top_n=5, competitors=None):
+    """مثل match لعدة أسماء: search_many (cdist) لكل فهرس بدل search لكل اسم"""
+    qs = [dict(_prepared(str(n or "").strip())) for n in names]
+    live = [i for i, q in enumerate(qs) if q["our_norm"]]
+    out = [[] for _ in qs]
+    for cname, idx in registry.indices.items():
+        if competitors and cname not in competitors: continue
+        for i, cands in zip(live, idx.search_many([qs[i] for i in live], top_n=top_n)):
+            out[i].extend(cands)
+    for cands in out:
+        cands.sort(key=lambda x: x["score"], reverse=True)
+        del cands[top_n:]
+        for c in cands:
+            c["auto"] = c["score"] >= AUTO_SCORE
+    return out
+
+
+# ─── القياس ────────────────────────────────
+class Stats:
+    def __init__(self, window=5000):
+        self.lat      = deque(maxlen=window)   # ms لكل استعلام منتج
+        self.requests = 0
+        self.queries  = 0
+        self.errors   = 0
+        self.started  = time.time()
+        self._lock    = threading.Lock()
+
+    def add(self, ms, n=1):
+        with self._lock:
+            self.queries += n
+            self.lat.append(ms / max(n, 1))
+
+    def snapshot(self):
+        with self._lock:
+            lat = sorted(self.lat)
+        pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else 0.0
+        return {"requests": self.requests, "queries": self.queries, "errors": self.errors,
+                "window": len(lat), "p50_ms": pct(0.50), "p99_ms": pct(0.99),
+                "max_ms": round(lat[-1], 2) if lat else 0.0,
+                "uptime_secs": round(time.time() - self.started)}
+
+
+# ─── HTTP ──────────────────────────────────
+def make_handler(registry, stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive للعملاء المتكررين
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, code, body):
+            data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _auth(self):
+            if TOKEN and self.headers.get("Authorization", "") != f"Bearer {TOKEN}":
+                self._send(401, {"error": "unauthorized"}); return False
+            return True
+
+        def _body(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+        def _route(self, method):
+            stats.requests += 1
+            url = urlparse(self.path)
+            if url.path == "/health":
+                return self._send(200, {"status": "ok" if registry.indices else "empty",
+                                        "competitors": registry.meta})
+            if not self._auth(): return
+            if url.path == "/stats":
+                return self._send(200, stats.snapshot())
+            if url.path == "/reload" and method == "POST":
+                return self._send(200, {"changed": registry.refresh()})
+
+            if url.path == "/match":
+                if method == "GET":
+                    qs = parse_qs(url.query)
+                    body = {"name": qs.get("q", [""])[0], "top_n": qs.get("top_n", [5])[0],
+                            "competitors": qs.get("competitor")}
+                else:
+                    body = self._body()
+                name = body.get("name") or body.get("q") or ""
+                if not str(name).strip():
+                    return self._send(400, {"error": "name مطلوب"})
+                t0 = time.perf_counter()
+                cands = match(registry, name, int(body.get("top_n") or 5), body.get("competitors"))
+                ms = (time.perf_counter() - t0) * 1000
+                stats.add(ms)
+                return self._send(200, {"query": name, "best": cands[0] if cands else None,
+                                        "candidates": cands, "ms": round(ms, 2)})
+
+            if url.path == "/match/batch" and method == "POST":
+                body  = self._body()
+                items = body.get("items") or []
+                if not isinstance(items, list) or len(items) > MAX_BATCH:
+                    return self._send(400, {"error": f"items: قائمة حتى {MAX_BATCH} عنصر"})
+                top_n, comps = int(body.get("top_n") or 5), body.get("competitors")
+                items = [it if isinstance(it, dict) else {"id": k, "name": it}
+                         for k, it in enumerate(items)]
+                t0 = time.perf_counter()
+                found = match_many(registry, [it.get("name", "") for it in items], top_n, comps)
+                out = [{"id": it.get("id", k), "query": it.get("name", ""),
+                        "best": cands[0] if cands else None, "candidates": cands}
+                       for k, (it, cands) in enumerate(zip(items, found))]
+                ms = (time.perf_counter() - t0) * 1000
+                stats.add(ms, len(items))
+                return self._send(200, {"results": out, "ms": round(ms, 2)})
+
+            self._send(404, {"error": "not found"})
+
+        def _safe(self, method):
+            try:
+                self._route(method)
+            except (ValueError, TypeError) as e:
+                stats.errors += 1
+                self._send(400, {"error": str(e)})
+            except Exception as e:
+                stats.errors += 1
+                self._send(500, {"error": str(e)})
+
+        def do_GET(self):  self._safe("GET")
+        def do_POST(self): self._safe("POST")
+
+    return Handler
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="match_service",
+                                description="خدمة مطابقة منتجات المنافسين عبر HTTP")
+    p.add_argument("snapshots", nargs="+", help="ملفات المنافسين أو مجلد يحتويها")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8765)))
+    p.add_argument("--reload-secs", type=float, default=30.0,
+                   help="فترة فحص الملفات (0 = بدون إعادة تحميل تلقائية)")
+    args = p.parse_args(argv)
+
+    registry = IndexRegistry(args.snapshots)
+    registry.refresh()
+    if not registry.indices:
+        _log("⚠️ لا توجد فهارس بعد — الخدمة تعمل وتنتظر ملفات")
+    if args.reload_secs > 0:
+        registry.watch(args.reload_secs)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(registry, Stats()))
+    server.daemon_threads = True
+    _log(f"🚀 match_service على http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+utils/db_maintenance.py - صيانة pricing_v18.db
+- حذف الأحداث والتحليلات الأقدم من مدة الاحتفاظ
+- تاريخ الأسعار: يومي → أسبوعي بعد 90 يوم مع الاحتفاظ بكل نقطة تغير سعر
+- أرشفة نتائج المهام القديمة مضغوطة (zlib) وتفريغها من job_progress
+- حذف رسائل صندوق Make المُرسلة/الميتة القديمة
+- حذف ردود AI المخزنة (ai_cache) الأقدم من مدة الاحتفاظ
+- incremental VACUUM + ANALYZE + تقرير بالمساحة المستعادة
+- تعمل تلقائياً كل 24 ساعة (thread خلفي) أو يدوياً من صفحة الإعدادات
+"""
+import json, zlib, threading, time
+from datetime import datetime, timedelta
+
+from utils.db_manager import get_db, close_db, transaction, _ts
+
+try:
+    from config import DB_RETENTION, DB_MAINTENANCE_INTERVAL_HOURS
+except:
+    DB_RETENTION = {"events": 90, "price_history": 90, "job_payloads": 14,
+                    "job_archive": 180, "analysis_history": 365, "make_outbox": 30,
+                    "ai_cache": 30}
+    DB_MAINTENANCE_INTERVAL_HOURS = 24
+
+_run_lock  = threading.Lock()
+_last_check = 0.0
+
+
+def _cutoff(days, fmt="%Y-%m-%d %H:%M:%S"):
+    return (datetime.now() - timedelta(days=days)).strftime(fmt)
+
+
+def _db_bytes(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages     = conn.execute("PRAGMA page_count").fetchone()[0]
+    free      = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size * pages, page_size * free
+
+
+# ─── الاحتفاظ ─────────────────────────────
+def prune_events(days):
+    with transaction() as conn:
+        return conn.execute("DELETE FROM events WHERE timestamp < ?",
+                            (_cutoff(days),)).rowcount
+
+
+def prune_analysis_history(days):
+    with transaction() as conn:
+        return conn.execute("DELETE FROM analysis_history WHERE timestamp < ?",
+                            (_cutoff(days),)).rowcount
+
+
+def prune_make_outbox(days):
+    with transaction() as conn:
+        return conn.execute(
+            "DELETE FROM make_outbox WHERE status IN ('sent','dead') AND updated_at < ?",
+            (_cutoff(days),)).rowcount
+
+
+def prune_ai_cache(days):
+    with transaction() as conn:
+        return conn.execute("DELETE FROM ai_cache WHERE timestamp < ?",
+                            (_cutoff(days),)).rowcount
+
+
+def downsample_price_history(days):
+    """
+    السجلات الأقدم من X يوم: يبقى آخر سجل في كل أسبوع لكل (منتج، منافس)
+    + كل سجل تغير فيه السعر عن السجل الذي قبله (نقاط التغيير لا تُحذف أبداً)
+    """
+    with transaction() as conn:
+        return conn.execute(
+            """DELETE FROM price_history WHERE id IN (
+                 SELECT id FROM (
+                   SELECT id, date, price,
+                          LAG(price) OVER (PARTITION BY product_name, competitor
+                                           ORDER BY date, id) AS prev_price,
+                          ROW_NUMBER() OVER (PARTITION BY product_name, competitor,
+                                                          strftime('%Y-%W', date)
+                                             ORDER BY date DESC, id DESC) AS rn_week
+                   FROM price_history)
+                 WHERE date < ? AND rn_week > 1
+                   AND prev_price IS NOT NULL AND abs(price - prev_price) <= 0.01)""",
+            (_cutoff(days, "%Y-%m-%d"),)
+        ).rowcount
+
+
+def archive_job_payloads(days):
+    """
+    ينقل results_json/missing_json للمهام المنتهية الأقدم من X يوم إلى job_archive
+    مضغوطة، ويفرغها من job_progress. آخر مهمة مكتملة تبقى (زر الاستعادة في اللوحة).
+    """
+    cutoff = _cutoff(days)
+    archived = raw_total = 0
+    with transaction() as conn:
+        keep = conn.execute(
+            "SELECT MAX(id) FROM job_progress WHERE status='done'"
+        ).fetchone()[0] or -1
+        rows = conn.execute(
+            """SELECT job_id, results_json, missing_json FROM job_progress
+               WHERE status!='running' AND updated_at < ? AND id != ?
+                 AND (length(results_json) > 2 OR length(missing_json) > 2)""",
+            (cutoff, keep)
+        ).fetchall()
+        for r in rows:
+            raw = json.dumps({"results_json": r["results_json"] or "[]",
+                              "missing_json": r["missing_json"] or "[]"},
+                             ensure_ascii=False).encode("utf-8")
+            conn.execute(
+                "INSERT OR REPLACE INTO job_archive (job_id,archived_at,raw_bytes,payload) VALUES (?,?,?,?)",
+                (r["job_id"], _ts(), len(raw), zlib.compress(raw, 9))
+            )
+            conn.execute(
+                """UPDATE job_progress SET results_json='[]', missing_json='[]',
+                   checkpoint_json='{}' WHERE job_id=?""", (r["job_id"],)
+            )
+            archived += 1; raw_total += len(raw)
+        # صفوف استئناف يتيمة لمهام لم تعد قيد التشغيل
+        orphans = conn.execute(
+            """DELETE FROM job_rows WHERE job_id IN (
+                 SELECT job_id FROM job_progress
+                 WHERE status!='running' OR updated_at < ?)""", (cutoff,)
+        ).rowcount
+    return {"archived": archived, "raw_bytes": raw_total, "orphan_rows": orphans}
+
+
+def prune_job_archive(days):
+    with transaction() as conn:
+        return conn.execute("DELETE FROM job_archive WHERE archived_at < ?",
+                            (_cutoff(days),)).rowcount
+
+
+def load_archived_job(job_id):
+    """فك ضغط نتائج مهمة مؤرشفة → {"results": [...], "missing": [...]}"""
+    try:
+        row = get_db().execute(
+            "SELECT payload FROM job_archive WHERE job_id=?", (job_id,)
+        ).fetchone()
+        if not row: return None
+        data = json.loads(zlib.decompress(row["payload"]).decode("utf-8"))
+        return {"results": json.loads(data.get("results_json", "[]")),
+                "missing": json.loads(data.get("missing_json", "[]"))}
+    except: return None
+
+
+# ─── الضغط ─────────────────────────────────
+def compact(full_vacuum_if_needed=True):
+    """
+    incremental VACUUM يحتاج auto_vacuum=INCREMENTAL — قواعد البيانات القديمة (NONE)
+    تتحول مرة واحدة بـ VACUUM كامل، ثم تكفي incremental_vacuum في كل مرة.
+    """
+    conn = get_db()
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2 and full_vacuum_if_needed:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    elif mode == 2:
+        # PRAGMA يحرر صفحة واحدة لكل خطوة، وexecute() تخطو مرة واحدة (بلا أعمدة → fetchall لا يكمل)
+        # executescript → sqlite3_exec يخطو حتى تفرغ قائمة الصفحات الحرة
+        conn.executescript("PRAGMA incremental_vacuum;")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+# ─── التشغيل الكامل ───────────────────────
+def run_maintenance(retention=None, vacuum=True):
+    """يُرجع تقريراً: عدد الصفوف لكل جدول + المساحة قبل/بعد + المستعاد"""
+    if not _run_lock.acquire(blocking=False):
+        return {"skipped": "maintenance already running"}
+    try:
+        ret = dict(DB_RETENTION, **(retention or {}))
+        t0 = time.perf_counter()
+        before, _ = _db_bytes(get_db())
+        report = {
+            "events_deleted":            prune_events(ret["events"]),
+            "price_history_downsampled": downsample_price_history(ret["price_history"]),
+            "jobs":                      archive_job_payloads(ret["job_payloads"]),
+            "job_archive_deleted":       prune_job_archive(ret["job_archive"]),
+            "analysis_history_deleted":  prune_analysis_history(ret["analysis_history"]),
+            "make_outbox_deleted":       prune_make_outbox(ret.get("make_outbox", 30)),
+            "ai_cache_deleted":          prune_ai_cache(ret.get("ai_cache", 30)),
+        }
+        if vacuum: compact()
+        after, free = _db_bytes(get_db())
+        report.update(bytes_before=before, bytes_after=after,
+                      bytes_reclaimed=max(0, before - after), bytes_free=free,
+                      duration_s=round(time.perf_counter() - t0, 2), retention=ret)
+        with transaction() as conn:
+            conn.execute("INSERT INTO maintenance_log (ran_at,report_json) VALUES (?,?)",
+                         (_ts(), json.dumps(report, ensure_ascii=False)))
+        return report
+    finally:
+        _run_lock.release()
+
+
+def last_maintenance():
+    try:
+        row = get_db().execute(
+            "SELECT ran_at, report_json FROM maintenance_log ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        if row:
+            return {"ran_at": row["ran_at"], **json.loads(row["report_json"] or "{}")}
+    except: pass
+    return None
+
+
+def maybe_run_maintenance(interval_hours=None):
+    """
+    جدولة ذاتية: تُستدعى مع كل تشغيل للتطبيق — تفحص قاعدة البيانات مرة كل 10 دقائق
+    على الأكثر، وتشغّل الصيانة في thread خلفي إذا مرّ interval_hours منذ آخر تشغيل
+    """
+    global _last_check
+    if time.monotonic() - _last_check < 600: return False
+    _last_check = time.monotonic()
+    hours = interval_hours or DB_MAINTENANCE_INTERVAL_HOURS
+    last = last_maintenance()
+    if last and last.get("ran_at", "") > _cutoff(hours / 24): return False
+    threading.Thread(target=_run_scheduled, name="db-maintenance", daemon=True).start()
+    return True
+
+
+def _run_scheduled():
+    try: run_maintenance()
+    except Exception: pass
+    finally: close_db()
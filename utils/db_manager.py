@@ -4,12 +4,20 @@ utils/db_manager.py - v18.0
 - حفظ نقاط استئناف للمعالجة الخلفية
 - قرارات لكل منتج (موافق/تأجيل/إزالة)
 - سجل كامل بالتاريخ والوقت
+- اتصال واحد مُعاد الاستخدام لكل thread (WAL) + معاملات عبر transaction()
+- سجل أحداث غير متزامن (طابور محدود + كاتب خلفي بالدفعات)
+- ai_cache: ردود AI المخزنة (المفتاح والـ TTL يحددهما engines.ai_engine)
+- enrichment: صورة/مكونات/وصف المنتجات المفقودة (يملؤها engines.enrichment في الخلفية)
 """
-import sqlite3, json
-from datetime import datetime
+import sqlite3, json, uuid, threading, queue, atexit, time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 DB_PATH = "pricing_v18.db"
 
+# معرّف هذه العملية — مهمة "running" بمالك مختلف = عملية ماتت (إعادة تشغيل/Redeploy)
+_BOOT_ID = uuid.uuid4().hex[:12]
+
 
 def _ts():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -19,107 +27,324 @@ def _date():
     return datetime.now().strftime("%Y-%m-%d")
 
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# ─── إدارة الاتصالات ───────────────────────
+# اتصال لكل thread: الـ thread الخلفي وواجهة Streamlit يكتبان بالتوازي
+# WAL → القراءة لا تنتظر الكتابة | busy_timeout → الكتابة تنتظر بدل أن تفشل
+_local = threading.local()
+BUSY_TIMEOUT_MS   = 30000
+STATEMENT_CACHE   = 256   # prepared statements مُعادة لكل اتصال
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False,
+                           timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None,  # autocommit — المعاملات صريحة عبر transaction()
+                           cached_statements=STATEMENT_CACHE)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
 
-def init_db():
+def get_db():
+    """اتصال هذا الـ thread (يُنشأ مرة واحدة ويُعاد استخدامه) — لا تغلقه يدوياً"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            try: conn.close()
+            except: pass
+        conn = _connect(DB_PATH)
+        _local.conn, _local.path, _local.depth = conn, DB_PATH, 0
+    return conn
+
+
+def close_db():
+    """إغلاق اتصال هذا الـ thread (عند انتهاء thread خلفي مثلاً)"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        try: conn.close()
+        except: pass
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """
+    معاملة كتابة: BEGIN IMMEDIATE → COMMIT، أو ROLLBACK عند الخطأ.
+    المعاملات المتداخلة تنضم للخارجية.
+        with transaction() as conn:
+            conn.execute(...)
+    """
     conn = get_db()
-    c = conn.cursor()
-
-    # أحداث عامة
-    c.execute("""CREATE TABLE IF NOT EXISTS events (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT, page TEXT,
-        event_type TEXT, details TEXT,
-        product_name TEXT, action_taken TEXT
-    )""")
-
-    # قرارات المستخدم (موافق/تأجيل/إزالة)
-    c.execute("""CREATE TABLE IF NOT EXISTS decisions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT, product_name TEXT,
-        our_price REAL, comp_price REAL,
-        diff REAL, competitor TEXT,
-        old_status TEXT, new_status TEXT,
-        reason TEXT, decided_by TEXT DEFAULT 'user'
-    )""")
-
-    # تاريخ الأسعار لكل منتج عند كل منافس
-    c.execute("""CREATE TABLE IF NOT EXISTS price_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        date TEXT, product_name TEXT,
-        competitor TEXT, price REAL,
-        our_price REAL, diff REAL,
-        match_score REAL, decision TEXT,
-        product_id TEXT DEFAULT ''
-    )""")
-
-    # نقطة الاستئناف للمعالجة الخلفية
-    c.execute("""CREATE TABLE IF NOT EXISTS job_progress (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        job_id TEXT UNIQUE,
-        started_at TEXT, updated_at TEXT,
-        status TEXT DEFAULT 'running',
-        total INTEGER DEFAULT 0,
-        processed INTEGER DEFAULT 0,
-        results_json TEXT DEFAULT '[]',
-        missing_json TEXT DEFAULT '[]',
-        our_file TEXT, comp_files TEXT
-    )""")
-    # إضافة عمود missing_json إذا لم يكن موجوداً (للتوافق مع قواعد البيانات القديمة)
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    _local.depth = 1
     try:
-        c.execute("ALTER TABLE job_progress ADD COLUMN missing_json TEXT DEFAULT '[]'")
-    except:
-        pass  # العمود موجود بالفعل
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        _local.depth = 0
 
-    # تاريخ التحليلات
-    c.execute("""CREATE TABLE IF NOT EXISTS analysis_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT, our_file TEXT,
-        comp_file TEXT, total_products INTEGER,
-        matched INTEGER, missing INTEGER, summary TEXT
-    )""")
 
-    # AI cache
-    c.execute("""CREATE TABLE IF NOT EXISTS ai_cache (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT, prompt_hash TEXT UNIQUE,
-        response TEXT, source TEXT
-    )""")
+def init_db():
+    with transaction() as conn:
+        c = conn.cursor()
+
+        # أحداث عامة
+        c.execute("""CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT, page TEXT,
+            event_type TEXT, details TEXT,
+            product_name TEXT, action_taken TEXT
+        )""")
+
+        # قرارات المستخدم (موافق/تأجيل/إزالة)
+        c.execute("""CREATE TABLE IF NOT EXISTS decisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT, product_name TEXT,
+            our_price REAL, comp_price REAL,
+            diff REAL, competitor TEXT,
+            old_status TEXT, new_status TEXT,
+            reason TEXT, decided_by TEXT DEFAULT 'user'
+        )""")
+
+        # تاريخ الأسعار لكل منتج عند كل منافس
+        c.execute("""CREATE TABLE IF NOT EXISTS price_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT, product_name TEXT,
+            competitor TEXT, price REAL,
+            our_price REAL, diff REAL,
+            match_score REAL, decision TEXT,
+            product_id TEXT DEFAULT ''
+        )""")
+
+        # نقطة الاستئناف للمعالجة الخلفية
+        c.execute("""CREATE TABLE IF NOT EXISTS job_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT UNIQUE,
+            started_at TEXT, updated_at TEXT,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            processed INTEGER DEFAULT 0,
+            results_json TEXT DEFAULT '[]',
+            missing_json TEXT DEFAULT '[]',
+            our_file TEXT, comp_files TEXT
+        )""")
+        # إضافة عمود missing_json إذا لم يكن موجوداً (للتوافق مع قواعد البيانات القديمة)
+        try:
+            c.execute("ALTER TABLE job_progress ADD COLUMN missing_json TEXT DEFAULT '[]'")
+        except:
+            pass  # العمود موجود بالفعل
+        # أعمدة الاستئناف: بصمة ملفات الإدخال + دفعات AI المعلقة + مالك المهمة
+        for col in ["fingerprint TEXT DEFAULT ''", "checkpoint_json TEXT DEFAULT '{}'",
+                    "owner TEXT DEFAULT ''"]:
+            try:
+                c.execute(f"ALTER TABLE job_progress ADD COLUMN {col}")
+            except:
+                pass
+
+        # صفوف منجزة لكل مهمة (نقاط حفظ تراكمية — لا نعيد كتابة كل النتائج كل مرة)
+        c.execute("""CREATE TABLE IF NOT EXISTS job_rows (
+            job_id TEXT, row_idx INTEGER, row_json TEXT,
+            PRIMARY KEY (job_id, row_idx)
+        )""")
+
+        # تاريخ التحليلات
+        c.execute("""CREATE TABLE IF NOT EXISTS analysis_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT, our_file TEXT,
+            comp_file TEXT, total_products INTEGER,
+            matched INTEGER, missing INTEGER, summary TEXT
+        )""")
+        # تقرير التشغيل (زمن المراحل + العدادات) — RunReport.to_dict()
+        try:
+            c.execute("ALTER TABLE analysis_history ADD COLUMN report_json TEXT DEFAULT ''")
+        except:
+            pass
+
+        # فهرس البحث في تاريخ الأسعار (منتج + منافس + تاريخ) — للاستعلامات المجمعة
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_ph_prod_comp_date
+                     ON price_history (product_name, competitor, date)""")
+
+        # أرشيف مضغوط لنتائج المهام القديمة (zlib) + سجل الصيانة
+        c.execute("""CREATE TABLE IF NOT EXISTS job_archive (
+            job_id TEXT PRIMARY KEY, archived_at TEXT,
+            raw_bytes INTEGER, payload BLOB
+        )""")
+        c.execute("""CREATE TABLE IF NOT EXISTS maintenance_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ran_at TEXT, report_json TEXT
+        )""")
+
+        # صندوق إرسال Make (outbox) — كل payload صف؛ الإرسال من thread خلفي
+        c.execute("""CREATE TABLE IF NOT EXISTS make_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT, updated_at TEXT, batch_id TEXT,
+            kind TEXT, label TEXT, items INTEGER DEFAULT 0,
+            payload TEXT, idem_key TEXT,
+            status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0,
+            next_attempt_at TEXT, last_error TEXT, status_code INTEGER DEFAULT 0,
+            owner TEXT DEFAULT '', sent_at TEXT
+        )""")
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_outbox_status_next
+                     ON make_outbox (status, next_attempt_at)""")
+
+        # آخر سعر أُرسل فعلاً لكل منتج (لإرسال المتغير فقط)
+        c.execute("""CREATE TABLE IF NOT EXISTS push_ledger (
+            product_id TEXT PRIMARY KEY, name TEXT,
+            price REAL, pushed_at TEXT
+        )""")
+
+        # AI cache
+        c.execute("""CREATE TABLE IF NOT EXISTS ai_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT, prompt_hash TEXT UNIQUE,
+            response TEXT, source TEXT
+        )""")
+        # إثراء المنتجات المفقودة: Fragrantica (info_json) + وصف مهووس — مفتاح = الاسم المطبّع
+        c.execute("""CREATE TABLE IF NOT EXISTS enrichment (
+            product_key TEXT PRIMARY KEY, name TEXT,
+            info_json TEXT DEFAULT '', description TEXT DEFAULT '',
+            status TEXT DEFAULT '', error TEXT DEFAULT '',
+            attempts INTEGER DEFAULT 0, fetched_at TEXT, described_at TEXT
+        )""")
+
+        # اسم الدالة المخزَّنة (verify_match, ...) — للإحصاءات والمسح الانتقائي
+        try:
+            c.execute("ALTER TABLE ai_cache ADD COLUMN fn TEXT DEFAULT ''")
+        except:
+            pass
 
-    conn.commit()
-    conn.close()
 
 
 # ─── أحداث ────────────────────────────────
+# log_event يُستدعى مع كل عرض صفحة وأغلب الأزرار → لا نكتب في SQLite على thread الواجهة.
+# الحدث يدخل طابوراً محدوداً، وكاتب خلفي واحد يفرغه دفعات (حجم أو زمن) في معاملة واحدة.
+# عند الامتلاء (ضغط مفاجئ) يُسقط الحدث ويُعدّ بدل أن تنتظر الواجهة.
+EVENT_QUEUE_MAX  = 5000
+EVENT_BATCH_SIZE = 200
+EVENT_FLUSH_SECS = 2.0
+
+
+class _EventSink:
+    def __init__(self, maxsize, batch_size, flush_secs):
+        self.q          = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_secs = flush_secs
+        self.written = self.dropped = self.failed = 0
+        self._lock   = threading.Lock()
+        self._stop   = threading.Event()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive(): return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive(): return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="event-sink", daemon=True)
+            self._thread.start()
+
+    def put(self, row):
+        if self._stop.is_set():
+            self.dropped += 1; return
+        self._ensure_started()
+        try:
+            self.q.put_nowait(row)
+        except queue.Full:
+            with self._lock: self.dropped += 1
+
+    def _take(self):
+        """دفعة حتى batch_size أو حتى مرور flush_secs — عند الإيقاف: تفريغ فوري"""
+        batch = []
+        deadline = time.monotonic() + self.flush_secs
+        while len(batch) < self.batch_size:
+            wait = 0 if self._stop.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self.q.get(timeout=wait) if wait > 0 else self.q.get_nowait())
+            except queue.Empty:
+                if self._stop.is_set() or time.monotonic() >= deadline: break
+        return batch
+
+    def _write(self, batch):
+        try:
+            with transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO events (timestamp,page,event_type,details,product_name,action_taken) VALUES (?,?,?,?,?,?)",
+                    batch
+                )
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+        finally:
+            for _ in batch: self.q.task_done()
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch:
+                self._write(batch)
+            elif self._stop.is_set():
+                break
+        close_db()
+
+    def flush(self, timeout=2.0):
+        """انتظار حتى تُكتب كل الأحداث المعلقة (للقراءة الفورية في صفحة السجل)"""
+        end = time.monotonic() + timeout
+        while self.q.unfinished_tasks and time.monotonic() < end:
+            time.sleep(0.02)
+        return self.q.unfinished_tasks == 0
+
+    def shutdown(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {"queued": self.q.qsize(), "written": self.written,
+                "dropped": self.dropped, "failed": self.failed}
+
+
+_events = _EventSink(EVENT_QUEUE_MAX, EVENT_BATCH_SIZE, EVENT_FLUSH_SECS)
+atexit.register(_events.shutdown)
+
+
 def log_event(page, event_type, details="", product_name="", action=""):
-    try:
-        conn = get_db()
-        conn.execute(
-            "INSERT INTO events (timestamp,page,event_type,details,product_name,action_taken) VALUES (?,?,?,?,?,?)",
-            (_ts(), page, event_type, details, product_name, action)
-        )
-        conn.commit(); conn.close()
-    except: pass
+    """غير متزامن — يعود فوراً دون أي I/O"""
+    _events.put((_ts(), page, event_type, details, product_name, action))
+
+
+def flush_events(timeout=2.0):
+    return _events.flush(timeout)
+
+
+def get_event_sink_stats():
+    return _events.stats()
 
 
 # ─── قرارات ────────────────────────────────
 def log_decision(product_name, old_status, new_status, reason="",
                  our_price=0, comp_price=0, diff=0, competitor=""):
     try:
-        conn = get_db()
-        conn.execute(
-            """INSERT INTO decisions
-               (timestamp,product_name,our_price,comp_price,diff,competitor,
-                old_status,new_status,reason)
-               VALUES (?,?,?,?,?,?,?,?,?)""",
-            (_ts(), product_name, our_price, comp_price, diff,
-             competitor, old_status, new_status, reason)
-        )
-        conn.commit(); conn.close()
+        with transaction() as conn:
+            conn.execute(
+                """INSERT INTO decisions
+                   (timestamp,product_name,our_price,comp_price,diff,competitor,
+                    old_status,new_status,reason)
+                   VALUES (?,?,?,?,?,?,?,?,?)""",
+                (_ts(), product_name, our_price, comp_price, diff,
+                 competitor, old_status, new_status, reason)
+            )
     except: pass
 
 
@@ -140,7 +365,6 @@ def get_decisions(product_name=None, status=None, limit=100):
             rows = conn.execute(
                 "SELECT * FROM decisions ORDER BY id DESC LIMIT ?", (limit,)
             ).fetchall()
-        conn.close()
         return [dict(r) for r in rows]
     except: return []
 
@@ -154,34 +378,44 @@ def upsert_price_history(product_name, competitor, price,
     إذا كان أمس → يضيف سجلاً جديداً لتتبع التغيير.
     يرجع True إذا تغير السعر عن آخر تسجيل.
     """
-    conn = get_db()
-    today = _date()
-
-    # آخر سعر مسجل لهذا المنتج/المنافس
-    last = conn.execute(
-        """SELECT price, date FROM price_history
-           WHERE product_name=? AND competitor=?
-           ORDER BY id DESC LIMIT 1""",
-        (product_name, competitor)
-    ).fetchone()
-
-    price_changed = False
-    if last:
-        last_price = last["price"]
-        last_date  = last["date"]
-        price_changed = abs(float(price) - float(last_price)) > 0.01
-
-        if last_date == today:
-            # نفس اليوم → حدّث فقط
-            conn.execute(
-                """UPDATE price_history SET price=?,our_price=?,diff=?,
-                   match_score=?,decision=?,product_id=?
-                   WHERE product_name=? AND competitor=? AND date=?""",
-                (price, our_price, diff, match_score, decision,
-                 product_id, product_name, competitor, today)
-            )
+    with transaction() as conn:
+        today = _date()
+
+        # آخر سعر مسجل لهذا المنتج/المنافس
+        last = conn.execute(
+            """SELECT price, date FROM price_history
+               WHERE product_name=? AND competitor=?
+               ORDER BY id DESC LIMIT 1""",
+            (product_name, competitor)
+        ).fetchone()
+
+        price_changed = False
+        if last:
+            last_price = last["price"]
+            last_date  = last["date"]
+            price_changed = abs(float(price) - float(last_price)) > 0.01
+
+            if last_date == today:
+                # نفس اليوم → حدّث فقط
+                conn.execute(
+                    """UPDATE price_history SET price=?,our_price=?,diff=?,
+                       match_score=?,decision=?,product_id=?
+                       WHERE product_name=? AND competitor=? AND date=?""",
+                    (price, our_price, diff, match_score, decision,
+                     product_id, product_name, competitor, today)
+                )
+            else:
+                # يوم جديد → أضف سجل
+                conn.execute(
+                    """INSERT INTO price_history
+                       (date,product_name,competitor,price,our_price,diff,
+                        match_score,decision,product_id)
+                       VALUES (?,?,?,?,?,?,?,?,?)""",
+                    (today, product_name, competitor, price, our_price,
+                     diff, match_score, decision, product_id)
+                )
         else:
-            # يوم جديد → أضف سجل
+            # أول مرة
             conn.execute(
                 """INSERT INTO price_history
                    (date,product_name,competitor,price,our_price,diff,
@@ -190,18 +424,7 @@ def upsert_price_history(product_name, competitor, price,
                 (today, product_name, competitor, price, our_price,
                  diff, match_score, decision, product_id)
             )
-    else:
-        # أول مرة
-        conn.execute(
-            """INSERT INTO price_history
-               (date,product_name,competitor,price,our_price,diff,
-                match_score,decision,product_id)
-               VALUES (?,?,?,?,?,?,?,?,?)""",
-            (today, product_name, competitor, price, our_price,
-             diff, match_score, decision, product_id)
-        )
 
-    conn.commit(); conn.close()
     return price_changed
 
 
@@ -221,11 +444,43 @@ def get_price_history(product_name, competitor="", limit=30):
                    ORDER BY date DESC LIMIT ?""",
                 (product_name, limit)
             ).fetchall()
-        conn.close()
         return [dict(r) for r in rows]
     except: return []
 
 
+def get_price_history_bulk(keys, limit=2):
+    """
+    آخر N تسجيلات لعدة (منتج، منافس) باستعلام واحد — بدل استعلام لكل صف معروض.
+    keys → [(product_name, competitor)] — competitor فارغ = كل المنافسين (مثل get_price_history)
+    يُرجع {(product_name, competitor): [rows الأحدث أولاً]}
+    """
+    keys = list(dict.fromkeys((str(p), str(c or "")) for p, c in keys))
+    out  = {k: [] for k in keys}
+    if not keys: return out
+    try:
+        conn = get_db()
+        for s in range(0, len(keys), 400):  # حد متغيرات SQLite
+            chunk = keys[s:s + 400]
+            rows = conn.execute(
+                f"""WITH k(p, c) AS (VALUES {",".join(["(?,?)"] * len(chunk))})
+                    SELECT * FROM (
+                      SELECT ph.*, k.p AS _kp, k.c AS _kc,
+                             ROW_NUMBER() OVER (PARTITION BY k.p, k.c
+                                                ORDER BY ph.date DESC, ph.id DESC) AS _rn
+                      FROM k JOIN price_history ph
+                        ON ph.product_name = k.p AND (k.c = '' OR ph.competitor = k.c))
+                    WHERE _rn <= ?
+                    ORDER BY _kp, _kc, _rn""",
+                [v for kv in chunk for v in kv] + [limit]
+            ).fetchall()
+            for r in rows:
+                d = dict(r)
+                key = (d.pop("_kp"), d.pop("_kc")); d.pop("_rn")
+                out[key].append(d)
+        return out
+    except: return out
+
+
 def get_price_changes(days=7):
     """منتجات تغير سعرها خلال X يوم"""
     try:
@@ -246,29 +501,107 @@ def get_price_changes(days=7):
                LIMIT 100""",
             (f"-{days} days",)
         ).fetchall()
-        conn.close()
         return [dict(r) for r in rows]
     except: return []
 
 
 # ─── المعالجة الخلفية ──────────────────────
 def save_job_progress(job_id, total, processed, results, status="running",
-                      our_file="", comp_files="", missing=None):
-    conn = get_db()
-    missing_data = json.dumps(missing if missing else [], ensure_ascii=False, default=str)
-    conn.execute(
-        """INSERT OR REPLACE INTO job_progress
-           (job_id,started_at,updated_at,status,total,processed,
-            results_json,missing_json,our_file,comp_files)
-           VALUES (?,
-               COALESCE((SELECT started_at FROM job_progress WHERE job_id=?), ?),
-               ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (job_id, job_id, _ts(), _ts(), status, total, processed,
-         json.dumps(results, ensure_ascii=False, default=str),
-         missing_data,
-         our_file, comp_files)
-    )
-    conn.commit(); conn.close()
+                      our_file="", comp_files="", missing=None, fingerprint=""):
+    with transaction() as conn:
+        missing_data = json.dumps(missing if missing else [], ensure_ascii=False, default=str)
+        # UPSERT بدل REPLACE حتى لا تُمسح نقطة الاستئناف والبصمة عند كل تحديث
+        conn.execute(
+            """INSERT INTO job_progress
+               (job_id,started_at,updated_at,status,total,processed,
+                results_json,missing_json,our_file,comp_files,fingerprint,owner)
+               VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+               ON CONFLICT(job_id) DO UPDATE SET
+                 updated_at=excluded.updated_at, status=excluded.status,
+                 total=excluded.total, processed=excluded.processed,
+                 results_json=excluded.results_json, missing_json=excluded.missing_json,
+                 our_file=excluded.our_file, comp_files=excluded.comp_files,
+                 fingerprint=CASE WHEN excluded.fingerprint!='' THEN excluded.fingerprint
+                                  ELSE job_progress.fingerprint END,
+                 owner=excluded.owner""",
+            (job_id, _ts(), _ts(), status, total, processed,
+             json.dumps(results, ensure_ascii=False, default=str),
+             missing_data,
+             our_file, comp_files, fingerprint, _BOOT_ID)
+        )
+        if status == "done":
+            # النتائج الكاملة محفوظة → لا حاجة لصفوف الاستئناف
+            conn.execute("DELETE FROM job_rows WHERE job_id=?", (job_id,))
+
+
+def update_job_progress(job_id, processed, total=None, status="running"):
+    """تحديث خفيف للتقدم فقط — بدون لمس results_json"""
+    try:
+        with transaction() as conn:
+            conn.execute(
+                """UPDATE job_progress SET processed=?, total=COALESCE(?,total),
+                   status=?, updated_at=?, owner=? WHERE job_id=?""",
+                (processed, total, status, _ts(), _BOOT_ID, job_id)
+            )
+    except: pass
+
+
+def save_job_checkpoint(job_id, rows, pending, processed, total):
+    """
+    نقطة استئناف تراكمية:
+    rows    → [(row_idx, row_dict)] الصفوف التي حُسم قرارها منذ آخر نقطة
+    pending → دفعة AI المعلقة (تُستبدل كاملة)
+    """
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO job_rows (job_id,row_idx,row_json) VALUES (?,?,?)",
+            [(job_id, int(i), json.dumps(r, ensure_ascii=False, default=str))
+             for i, r in rows]
+        )
+        conn.execute(
+            """UPDATE job_progress SET processed=?, total=?, updated_at=?,
+               checkpoint_json=?, owner=? WHERE job_id=?""",
+            (processed, total, _ts(),
+             json.dumps({"pending": pending}, ensure_ascii=False, default=str),
+             _BOOT_ID, job_id)
+        )
+
+
+def load_job_checkpoint(job_id):
+    """يُرجع {"rows": [(row_idx, row)], "pending": [...]} لاستئناف run_full_analysis"""
+    try:
+        conn = get_db()
+        rows = conn.execute(
+            "SELECT row_idx, row_json FROM job_rows WHERE job_id=? ORDER BY row_idx",
+            (job_id,)
+        ).fetchall()
+        job = conn.execute(
+            "SELECT checkpoint_json FROM job_progress WHERE job_id=?", (job_id,)
+        ).fetchone()
+        try: pending = json.loads(job["checkpoint_json"] or "{}").get("pending", []) if job else []
+        except: pending = []
+        return {"rows": [(r["row_idx"], json.loads(r["row_json"])) for r in rows],
+                "pending": pending}
+    except:
+        return {"rows": [], "pending": []}
+
+
+def find_resumable_job(fingerprint):
+    """
+    آخر مهمة لنفس ملفات الإدخال انقطعت قبل اكتمالها:
+    حالتها running لكن مالكها عملية سابقة (أُعيد تشغيل Streamlit)
+    """
+    if not fingerprint: return None
+    try:
+        conn = get_db()
+        row = conn.execute(
+            """SELECT job_id, processed, total, updated_at FROM job_progress
+               WHERE fingerprint=? AND status='running' AND owner!=?
+               ORDER BY id DESC LIMIT 1""",
+            (fingerprint, _BOOT_ID)
+        ).fetchone()
+        return dict(row) if row else None
+    except: return None
 
 
 def get_job_progress(job_id):
@@ -277,25 +610,39 @@ def get_job_progress(job_id):
         row = conn.execute(
             "SELECT * FROM job_progress WHERE job_id=?", (job_id,)
         ).fetchone()
-        conn.close()
         if row:
             d = dict(row)
             try: d["results"] = json.loads(d.get("results_json", "[]"))
             except: d["results"] = []
             try: d["missing"] = json.loads(d.get("missing_json", "[]"))
             except: d["missing"] = []
+            if not d["results"] and not d["missing"] and d.get("status") != "running":
+                # نُقلت النتائج لـ job_archive بالصيانة → فك الضغط عند الطلب
+                from utils.db_maintenance import load_archived_job
+                arc = load_archived_job(job_id)
+                if arc: d.update(arc, archived=True)
             return d
     except: pass
     return None
 
 
+def get_job_status(job_id):
+    """الحالة والتقدم فقط — بدون فك results_json (للاستطلاع المتكرر من الواجهة)"""
+    try:
+        row = get_db().execute(
+            """SELECT job_id, status, processed, total, updated_at, fingerprint
+               FROM job_progress WHERE job_id=?""", (job_id,)
+        ).fetchone()
+        return dict(row) if row else None
+    except: return None
+
+
 def get_last_job():
     try:
         conn = get_db()
         row = conn.execute(
             "SELECT * FROM job_progress ORDER BY id DESC LIMIT 1"
         ).fetchone()
-        conn.close()
         if row:
             d = dict(row)
             try: d["results"] = json.loads(d.get("results_json", "[]"))
@@ -307,17 +654,140 @@ def get_last_job():
     return None
 
 
-# ─── سجل التحليلات ─────────────────────────
-def log_analysis(our_file, comp_file, total, matched, missing, summary=""):
+# ─── سجل الأسعار المُرسلة (push ledger) ──────
+def get_pushed_prices(product_ids):
+    """{product_id: آخر سعر أُرسل بنجاح} لمجموعة منتجات (استعلامات بدفعات)"""
+    ids, out = [str(p) for p in product_ids if str(p)], {}
     try:
         conn = get_db()
-        conn.execute(
-            """INSERT INTO analysis_history
-               (timestamp,our_file,comp_file,total_products,matched,missing,summary)
-               VALUES (?,?,?,?,?,?,?)""",
-            (_ts(), our_file, comp_file, total, matched, missing, summary)
-        )
-        conn.commit(); conn.close()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = conn.execute(
+                f"SELECT product_id, price FROM push_ledger WHERE product_id IN "
+                f"({','.join('?' * len(chunk))})", chunk).fetchall()
+            out.update({r["product_id"]: r["price"] for r in rows})
+    except: pass
+    return out
+
+
+def record_pushed_prices(products):
+    """تسجيل المنتجات التي وصلت لـ Make بنجاح: [{"product_id","name","price"}]"""
+    rows = [(str(p.get("product_id", "")), str(p.get("name", "")), float(p.get("price") or 0), _ts())
+            for p in products if str(p.get("product_id", "")).strip()]
+    if not rows: return 0
+    with transaction() as conn:
+        conn.executemany(
+            """INSERT INTO push_ledger (product_id,name,price,pushed_at) VALUES (?,?,?,?)
+               ON CONFLICT(product_id) DO UPDATE SET name=excluded.name,
+               price=excluded.price, pushed_at=excluded.pushed_at""", rows)
+    return len(rows)
+
+
+# ─── كاش AI ───────────────────────────────
+def ai_cache_get(key, max_age_hours):
+    """(response_json, timestamp) إذا كان المفتاح موجوداً وأحدث من max_age_hours، وإلا None"""
+    try:
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).strftime("%Y-%m-%d %H:%M:%S")
+        r = get_db().execute(
+            "SELECT response, timestamp FROM ai_cache WHERE prompt_hash=? AND timestamp >= ?",
+            (key, cutoff)).fetchone()
+        return (r["response"], r["timestamp"]) if r else None
+    except: return None
+
+
+def ai_cache_put(key, fn, response, source=""):
+    try:
+        with transaction() as conn:
+            conn.execute(
+                """INSERT INTO ai_cache (timestamp,prompt_hash,response,source,fn) VALUES (?,?,?,?,?)
+                   ON CONFLICT(prompt_hash) DO UPDATE SET timestamp=excluded.timestamp,
+                   response=excluded.response, source=excluded.source, fn=excluded.fn""",
+                (_ts(), key, response, source, fn))
+    except: pass
+
+
+def ai_cache_summary():
+    """{fn: {"rows", "newest"}} من الجدول"""
+    try:
+        rows = get_db().execute(
+            "SELECT fn, COUNT(*) AS n, MAX(timestamp) AS newest FROM ai_cache GROUP BY fn"
+        ).fetchall()
+        return {r["fn"] or "": {"rows": r["n"], "newest": r["newest"]} for r in rows}
+    except: return {}
+
+
+def ai_cache_clear(fn=None):
+    with transaction() as conn:
+        if fn:
+            return conn.execute("DELETE FROM ai_cache WHERE fn=?", (fn,)).rowcount
+        return conn.execute("DELETE FROM ai_cache").rowcount
+
+
+# ─── إثراء المنتجات المفقودة ─────────────────
+def get_enrichment_bulk(keys):
+    """{product_key: {"name", "info", "description", "status", "error", "attempts",
+    "fetched_at", "described_at"}} — استعلام واحد لكل 500 مفتاح"""
+    keys, out = [k for k in dict.fromkeys(keys) if k], {}
+    try:
+        conn = get_db()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = conn.execute(
+                f"SELECT * FROM enrichment WHERE product_key IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall()
+            for r in rows:
+                d = dict(r)
+                try: d["info"] = json.loads(d.pop("info_json") or "null")
+                except: d["info"] = None
+                out[d.pop("product_key")] = d
+    except: pass
+    return out
+
+
+def save_enrichment(key, name, info=None, description=None, error=""):
+    """
+    يحدّث ما وصل فقط: info/error → fetched_at، description → described_at
+    status = ok إذا كان عندنا info ناجح، وإلا failed (attempts تزيد مع كل فشل)
+    """
+    now = _ts()
+    ok  = bool(info and info.get("success"))
+    with transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO enrichment (product_key, name) VALUES (?,?)",
+                     (key, name))
+        if info is not None:
+            conn.execute(
+                """UPDATE enrichment SET name=?, info_json=?, fetched_at=?, status=?, error=?,
+                   attempts=CASE WHEN ?='ok' THEN 0 ELSE attempts+1 END WHERE product_key=?""",
+                (name, json.dumps(info, ensure_ascii=False), now,
+                 "ok" if ok else "failed", error, "ok" if ok else "failed", key))
+        elif error:
+            # fetched_at = وقت المحاولة → MAX_ATTEMPTS يسري، ويُعاد بعد ENRICH_STALE_DAYS فقط
+            conn.execute("""UPDATE enrichment SET status='failed', error=?, fetched_at=?,
+                            attempts=attempts+1 WHERE product_key=?""", (error, now, key))
+        if description:
+            conn.execute("UPDATE enrichment SET description=?, described_at=? WHERE product_key=?",
+                         (description, now, key))
+
+
+def enrichment_counts():
+    try:
+        rows = get_db().execute(
+            "SELECT status, COUNT(*) AS n FROM enrichment GROUP BY status").fetchall()
+        return {r["status"] or "": r["n"] for r in rows}
+    except: return {}
+
+
+# ─── سجل التحليلات ─────────────────────────
+def log_analysis(our_file, comp_file, total, matched, missing, summary="", report=None):
+    try:
+        with transaction() as conn:
+            conn.execute(
+                """INSERT INTO analysis_history
+                   (timestamp,our_file,comp_file,total_products,matched,missing,summary,report_json)
+                   VALUES (?,?,?,?,?,?,?,?)""",
+                (_ts(), our_file, comp_file, total, matched, missing, summary,
+                 json.dumps(report, ensure_ascii=False) if report else "")
+            )
     except: pass
 
 
@@ -327,8 +797,13 @@ def get_analysis_history(limit=20):
         rows = conn.execute(
             "SELECT * FROM analysis_history ORDER BY id DESC LIMIT ?", (limit,)
         ).fetchall()
-        conn.close()
-        return [dict(r) for r in rows]
+        out = []
+        for r in rows:
+            d = dict(r)
+            try: d["report"] = json.loads(d.pop("report_json", "") or "null")
+            except: d["report"] = None
+            out.append(d)
+        return out
     except: return []
 
 
@@ -344,7 +819,6 @@ def get_events(page=None, limit=50):
             rows = conn.execute(
                 "SELECT * FROM events ORDER BY id DESC LIMIT ?", (limit,)
             ).fetchall()
-        conn.close()
         return [dict(r) for r in rows]
     except: return []
 
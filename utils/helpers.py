@@ -6,6 +6,8 @@ import pandas as pd
 import io
 from typing import Optional, Dict, List
 
+from utils.results_index import get_results_index, SectionView
+
 
 # ===== safe_float =====
 def safe_float(val, default=0.0) -> float:
@@ -40,7 +42,7 @@ def format_diff(diff) -> str:
 
 # ===== get_filter_options =====
 def get_filter_options(df: pd.DataFrame) -> dict:
-    """استخراج خيارات الفلاتر من DataFrame"""
+    """استخراج خيارات الفلاتر من DataFrame (من فهرس النتائج — تُحسب مرة واحدة)"""
     opts = {
         "brands": ["الكل"],
         "competitors": ["الكل"],
@@ -48,76 +50,32 @@ def get_filter_options(df: pd.DataFrame) -> dict:
     }
     if df is None or df.empty:
         return opts
+    if isinstance(df, SectionView):
+        return df.filter_options()
 
-    # الماركات
-    if "الماركة" in df.columns:
-        brands = df["الماركة"].dropna().unique().tolist()
-        brands = sorted([str(b) for b in brands if str(b).strip() and str(b) != "nan"])
-        opts["brands"] = ["الكل"] + brands
-
-    # المنافسون
-    if "المنافس" in df.columns:
-        comps = df["المنافس"].dropna().unique().tolist()
-        comps = sorted([str(c) for c in comps if str(c).strip() and str(c) != "nan"])
-        opts["competitors"] = ["الكل"] + comps
-
-    # الأنواع
-    if "النوع" in df.columns:
-        types = df["النوع"].dropna().unique().tolist()
-        types = sorted([str(t) for t in types if str(t).strip() and str(t) != "nan"])
-        opts["types"] = ["الكل"] + types
-
+    idx = get_results_index(df)
+    opts["brands"]      = idx.options("brand")
+    opts["competitors"] = idx.options("competitor")
+    opts["types"]       = idx.options("type")
     return opts
 
 
 # ===== apply_filters =====
 def apply_filters(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
-    """تطبيق الفلاتر على DataFrame"""
+    """
+    تطبيق الفلاتر على DataFrame
+    البحث + الماركة/المنافس/النوع/القرار + التطابق + السعر → مواضع صفوف من الفهرس
+    ثم take واحد (بدون نسخ الجدول كاملاً أو str.contains في كل rerun)
+    """
     if df is None or df.empty:
         return df
+    if isinstance(df, SectionView):
+        return df.query(filters)
 
-    result = df.copy()
-
-    # بحث نصي
-    search = filters.get("search", "").strip()
-    if search:
-        mask = pd.Series([False] * len(result))
-        for col in ["المنتج", "منتج_المنافس", "الماركة"]:
-            if col in result.columns:
-                mask = mask | result[col].astype(str).str.contains(search, case=False, na=False)
-        result = result[mask]
-
-    # فلتر الماركة
-    brand = filters.get("brand", "الكل")
-    if brand and brand != "الكل" and "الماركة" in result.columns:
-        result = result[result["الماركة"].astype(str) == brand]
-
-    # فلتر المنافس
-    competitor = filters.get("competitor", "الكل")
-    if competitor and competitor != "الكل" and "المنافس" in result.columns:
-        result = result[result["المنافس"].astype(str) == competitor]
-
-    # فلتر النوع
-    ptype = filters.get("type", "الكل")
-    if ptype and ptype != "الكل" and "النوع" in result.columns:
-        result = result[result["النوع"].astype(str) == ptype]
-
-    # فلتر نسبة التطابق
-    match_min = filters.get("match_min")
-    if match_min and "نسبة_التطابق" in result.columns:
-        result = result[result["نسبة_التطابق"] >= float(match_min)]
-
-    # فلتر أقل سعر
-    price_min = filters.get("price_min", 0.0)
-    if price_min and price_min > 0 and "السعر" in result.columns:
-        result = result[result["السعر"] >= float(price_min)]
-
-    # فلتر أعلى سعر
-    price_max = filters.get("price_max")
-    if price_max and price_max > 0 and "السعر" in result.columns:
-        result = result[result["السعر"] <= float(price_max)]
-
-    return result.reset_index(drop=True)
+    rows = get_results_index(df).filter(filters)
+    if len(rows) == len(df):
+        return df.reset_index(drop=True)
+    return df.take(rows).reset_index(drop=True)
 
 
 # ===== export_to_excel =====
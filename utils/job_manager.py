@@ -0,0 +1,232 @@
+"""
+utils/job_manager.py - مدير المهام الخلفية v1.1
+- worker pool واحد للعملية (بدل thread جديد لكل ضغطة زر)
+- طابور أولويات مشترك بين كل الجلسات: تفاعلي قبل المجدول، ثم بالترتيب
+- حد تزامن JOB_CONCURRENCY + منع التكرار (نفس بصمة الملفات → نفس المهمة)
+- سجل مهام في الذاكرة: الحالة + التقدم + النتيجة (الواجهة تقرأ منه بدون فك JSON)
+- إلغاء تعاوني (Event) ومهلة قصوى لكل مهمة — تُفحص مع كل تحديث تقدم
+- لقطة تقدم في قاعدة البيانات كل SNAPSHOT_SECS على الأكثر (للاستئناف بعد إعادة التشغيل)
+"""
+import heapq, itertools, threading, time, uuid
+
+from utils.db_manager import update_job_progress, close_db
+
+try:
+    from config import JOB_CONCURRENCY, JOB_TIMEOUT_SECS
+except:
+    JOB_CONCURRENCY  = 2
+    JOB_TIMEOUT_SECS = 3 * 3600
+
+SNAPSHOT_SECS = 2.0
+KEEP_FINISHED = 20     # مهام منتهية تبقى في السجل (الأقدم تُحذف)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SCHEDULED   = 10
+
+ACTIVE   = ("queued", "running")
+FINISHED = ("done", "error", "cancelled", "timeout")
+
+
+class JobCancelled(Exception):
+    """تُرفع داخل المهمة عند الإلغاء أو تجاوز المهلة"""
+
+
+class Job:
+    def __init__(self, job_id, kind, timeout, priority=PRIORITY_INTERACTIVE, dedupe_key=""):
+        self.id        = job_id
+        self.kind      = kind
+        self.timeout   = timeout
+        self.priority  = priority
+        self.dedupe_key = dedupe_key
+        self.status    = "queued"
+        self.processed = 0
+        self.total     = 0
+        self.message   = ""
+        self.result    = None
+        self.error     = ""
+        self.created   = time.time()
+        self.started   = None
+        self.finished  = None
+        self.meta      = {}
+        self._cancel   = threading.Event()
+        self._last_snap = 0.0
+
+    # ─── داخل المهمة ───────────────────────
+    def check(self):
+        """يرفع JobCancelled إذا أُلغيت المهمة أو تجاوزت مهلتها"""
+        if self._cancel.is_set():
+            raise JobCancelled("cancelled")
+        if self.timeout and self.started and time.time() - self.started > self.timeout:
+            self.status = "timeout"
+            raise JobCancelled("timeout")
+
+    def progress(self, processed, total=None, message=""):
+        """قناة التقدم: تحديث في الذاكرة دائماً + لقطة DB كل SNAPSHOT_SECS"""
+        self.processed = int(processed)
+        if total is not None: self.total = int(total)
+        if message: self.message = message
+        now = time.monotonic()
+        if now - self._last_snap >= SNAPSHOT_SECS or self.processed >= self.total:
+            self._last_snap = now
+            self.snapshot()
+        self.check()
+
+    def snapshot(self, status="running"):
+        try: update_job_progress(self.id, self.processed, self.total or None, status)
+        except Exception: pass
+
+    # ─── من الواجهة ────────────────────────
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def pct(self):
+        return self.processed / max(self.total, 1)
+
+    @property
+    def elapsed(self):
+        if not self.started: return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def info(self):
+        return {"job_id": self.id, "kind": self.kind, "status": self.status,
+                "priority": self.priority,
+                "processed": self.processed, "total": self.total, "pct": self.pct,
+                "message": self.message, "error": self.error,
+                "elapsed": round(self.elapsed, 1), **self.meta}
+
+
+class JobManager:
+    """
+    طابور أولويات (priority, ترتيب الإدخال) + workers بعدد JOB_CONCURRENCY.
+    المهام الزائدة تنتظر في الطابور بدل أن تتنافس على المعالج وحصة Gemini.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = max(1, int(workers or JOB_CONCURRENCY))
+        self._jobs    = {}
+        self._heap    = []
+        self._seq     = itertools.count()
+        self._lock    = threading.Lock()
+        self._cv      = threading.Condition(self._lock)
+        self._threads = []
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for i in range(self.workers - len(self._threads)):
+            t = threading.Thread(target=self._worker, name=f"job-{len(self._threads)}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn, *args, job_id=None, kind="analysis", timeout=None, meta=None,
+               priority=PRIORITY_INTERACTIVE, dedupe_key="", **kwargs):
+        """
+        fn(job, *args, **kwargs) تعمل في أحد الـ workers — تستدعي job.progress(...) دورياً
+        القيمة المُرجعة → job.result | الاستثناء → status=error
+        dedupe_key (بصمة الملفات): مهمة نشطة بنفس المفتاح → تُعاد هي بدل مهمة جديدة
+        """
+        with self._cv:
+            for old in self._jobs.values():
+                if old.status in ACTIVE and (old.id == job_id or
+                                             (dedupe_key and old.dedupe_key == dedupe_key)):
+                    old.meta["deduped"] = old.meta.get("deduped", 0) + 1
+                    return old
+            job = Job(job_id or uuid.uuid4().hex[:8], kind,
+                      JOB_TIMEOUT_SECS if timeout is None else timeout,
+                      priority, dedupe_key)
+            job.meta = dict(meta or {})
+            self._jobs[job.id] = job
+            self._trim()
+            heapq.heappush(self._heap, (priority, next(self._seq), job, fn, args, kwargs))
+            self._ensure_workers()
+            self._cv.notify()
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._heap:
+                    self._cv.wait()
+                _, _, job, fn, args, kwargs = heapq.heappop(self._heap)
+            self._run(job, fn, args, kwargs)
+
+    def _run(self, job, fn, args, kwargs):
+        job.started = time.time()
+        try:
+            job.check()
+            job.status = "running"
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except JobCancelled as e:
+            job.status = "timeout" if str(e) == "timeout" else "cancelled"
+            job.snapshot(job.status)
+        except Exception as e:
+            job.status, job.error = "error", str(e)
+            job.snapshot(f"error: {e}")
+        finally:
+            job.finished = time.time()
+            close_db()
+
+    def _trim(self):
+        done = sorted((j for j in self._jobs.values() if j.status in FINISHED),
+                      key=lambda j: j.finished or 0)
+        for j in done[:max(0, len(done) - KEEP_FINISHED)]:
+            self._jobs.pop(j.id, None)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def find_active(self, dedupe_key):
+        for j in list(self._jobs.values()):
+            if j.status in ACTIVE and dedupe_key and j.dedupe_key == dedupe_key:
+                return j
+        return None
+
+    def position(self, job_id):
+        """ترتيب المهمة في الطابور (1 = التالية) — 0 إذا بدأت أو انتهت"""
+        with self._lock:
+            waiting = sorted((p, seq, j.id) for p, seq, j, *_ in self._heap
+                             if j.status == "queued" and not j.cancelled)
+        for i, (_, _, jid) in enumerate(waiting):
+            if jid == job_id:
+                return i + 1
+        return 0
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job and job.status in ACTIVE:
+            job.cancel()
+            return True
+        return False
+
+    def jobs(self):
+        return sorted(self._jobs.values(), key=lambda j: j.created, reverse=True)
+
+    def active(self):
+        return [j for j in self.jobs() if j.status in ACTIVE]
+
+    def queue(self):
+        """المهام النشطة بترتيب التنفيذ: الجارية أولاً ثم المنتظرة حسب الطابور"""
+        running = [j.info() for j in self.active() if j.status == "running"]
+        with self._lock:
+            waiting = [j for _, _, j, *_ in sorted(self._heap, key=lambda e: e[:2])
+                       if j.status == "queued" and not j.cancelled]
+        return running + [dict(j.info(), position=i + 1) for i, j in enumerate(waiting)]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """مدير واحد لكل عملية — مشترك بين كل جلسات Streamlit"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager()
+    return _manager
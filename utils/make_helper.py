@@ -1,14 +1,28 @@
 """
-utils/make_helper.py - دوال إرسال البيانات إلى Make.com v2.0
+utils/make_helper.py - دوال إرسال البيانات إلى Make.com v2.1
 ✅ إرسال السعر + اسم المنتج + رقم المنتج إلى سلة عبر Make Webhooks
 ✅ دعم إرسال منتج واحد أو مجموعة منتجات
 ✅ معالجة أخطاء شاملة
+✅ جلسة keep-alive مشتركة + إعادة محاولة (429/5xx/timeout) بتأخير أُسّي
+✅ إرسال متوازي محدود + حد معدل اختياري (عمليات Make بالدقيقة)
+✅ تحديثات الأسعار على دفعات (عدد + حجم) بمفتاح idempotency لكل دفعة
+✅ سجل آخر سعر أُرسل لكل منتج (push_ledger) → خيار إرسال المتغير فقط
 """
 import requests
+import hashlib
 import json
+import numpy as np
+import pandas as pd
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from typing import List, Dict, Any, Optional
 
+from utils.db_manager import get_pushed_prices, record_pushed_prices
+
 
 # ── قراءة Webhook URLs من البيئة أو القيم الافتراضية ──────────────────────
 def _get_webhook_url(key: str, default: str) -> str:
@@ -27,41 +41,202 @@ WEBHOOK_NEW_PRODUCTS = _get_webhook_url(
 TIMEOUT = 15  # ثانية
 
 
+def _env_num(key: str, default: float) -> float:
+    try:
+        return float(os.environ.get(key, "") or default)
+    except (ValueError, TypeError):
+        return default
+
+
+MAKE_CONCURRENCY  = max(1, int(_env_num("MAKE_CONCURRENCY", 8)))   # طلبات متزامنة
+MAKE_RATE_PER_MIN = _env_num("MAKE_RATE_PER_MIN", 0)               # 0 = بدون حد
+MAKE_MAX_RETRIES  = max(0, int(_env_num("MAKE_MAX_RETRIES", 4)))
+MAKE_BACKOFF_BASE = _env_num("MAKE_BACKOFF_BASE", 1.0)             # ثانية، يتضاعف
+MAKE_BACKOFF_MAX  = 30.0
+MAKE_CHUNK_ITEMS  = max(1, int(_env_num("MAKE_CHUNK_ITEMS", 200)))      # منتج/دفعة
+MAKE_CHUNK_BYTES  = max(4096, int(_env_num("MAKE_CHUNK_BYTES", 256_000)))  # بايت/دفعة
+PUSH_TOLERANCE    = _env_num("PUSH_TOLERANCE", 0.5)   # ر.س — أقل من هذا = لم يتغير
+
+_OK_CODES    = (200, 201, 202, 204)
+_RETRY_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+
+# ── جلسة HTTP مشتركة (keep-alive) ─────────────────────────────────────────
+_session_obj  = None
+_session_lock = threading.Lock()
+
+
+def _session() -> requests.Session:
+    """جلسة واحدة للعملية — تعيد استخدام اتصالات TLS بدل فتح اتصال لكل منتج"""
+    global _session_obj
+    if _session_obj is None:
+        with _session_lock:
+            if _session_obj is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4,
+                                      pool_maxsize=max(MAKE_CONCURRENCY, 10))
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers.update({"Content-Type": "application/json"})
+                _session_obj = s
+    return _session_obj
+
+
+# ── حد المعدل (token bucket) ─────────────────────────────────────────────
+class _RateLimiter:
+    """rate عملية/دقيقة مع سماح بدفعة بحجم burst — مشترك بين كل الخيوط"""
+
+    def __init__(self, per_minute: float, burst: int = 1):
+        self.rate   = per_minute / 60.0
+        self.burst  = max(1, burst)
+        self.tokens = float(self.burst)
+        self.ts     = time.monotonic()
+        self.lock   = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiter = _RateLimiter(MAKE_RATE_PER_MIN, burst=MAKE_CONCURRENCY)
+
+
+def _backoff(attempt: int, retry_after: str = "") -> float:
+    try:
+        if retry_after:
+            return min(float(retry_after), MAKE_BACKOFF_MAX)
+    except ValueError:
+        pass
+    delay = MAKE_BACKOFF_BASE * (2 ** attempt)
+    return min(delay, MAKE_BACKOFF_MAX) * (0.5 + random.random() / 2)
+
+
 # ── دالة الإرسال الأساسية ─────────────────────────────────────────────────
-def _post_to_webhook(url: str, payload: Any) -> Dict:
+def _post_to_webhook(url: str, payload: Any, retries: Optional[int] = None,
+                     headers: Optional[Dict] = None) -> Dict:
     """
-    إرسال بيانات JSON إلى Webhook URL.
-    يُعيد dict: {"success": bool, "message": str, "status_code": int}
+    إرسال بيانات JSON إلى Webhook URL مع إعادة المحاولة.
+    يُعاد المحاولة فقط على 429/5xx/timeout/انقطاع — أخطاء 4xx الأخرى نهائية.
+    يُعيد dict: {"success": bool, "message": str, "status_code": int, "attempts": int}
     """
     if not url:
-        return {"success": False, "message": "❌ لم يتم تحديد Webhook URL", "status_code": 0}
-
-    try:
-        headers = {"Content-Type": "application/json"}
-        resp = requests.post(url, json=payload, headers=headers, timeout=TIMEOUT)
-
-        if resp.status_code in (200, 201, 202, 204):
-            return {
-                "success": True,
-                "message": f"✅ تم الإرسال بنجاح ({resp.status_code})",
-                "status_code": resp.status_code,
-            }
-        else:
-            return {
+        return {"success": False, "message": "❌ لم يتم تحديد Webhook URL",
+                "status_code": 0, "attempts": 0}
+
+    retries = MAKE_MAX_RETRIES if retries is None else retries
+    result  = {}
+    for attempt in range(retries + 1):
+        retry_after = ""
+        _limiter.acquire()
+        try:
+            resp = _session().post(url, json=payload, headers=headers, timeout=TIMEOUT)
+
+            if resp.status_code in _OK_CODES:
+                return {
+                    "success": True,
+                    "message": f"✅ تم الإرسال بنجاح ({resp.status_code})",
+                    "status_code": resp.status_code,
+                    "attempts": attempt + 1,
+                }
+            result = {
                 "success": False,
                 "message": f"❌ خطأ HTTP {resp.status_code}: {resp.text[:200]}",
                 "status_code": resp.status_code,
             }
-    except requests.exceptions.Timeout:
-        return {"success": False, "message": "❌ انتهت مهلة الاتصال (Timeout)", "status_code": 0}
-    except requests.exceptions.ConnectionError:
-        return {"success": False, "message": "❌ فشل الاتصال بـ Make — تحقق من الإنترنت", "status_code": 0}
-    except Exception as e:
-        return {"success": False, "message": f"❌ خطأ غير متوقع: {str(e)}", "status_code": 0}
+            if resp.status_code not in _RETRY_CODES:
+                break
+            retry_after = resp.headers.get("Retry-After", "")
+        except requests.exceptions.Timeout:
+            result = {"success": False, "message": "❌ انتهت مهلة الاتصال (Timeout)", "status_code": 0}
+        except requests.exceptions.ConnectionError:
+            result = {"success": False, "message": "❌ فشل الاتصال بـ Make — تحقق من الإنترنت", "status_code": 0}
+        except Exception as e:
+            result = {"success": False, "message": f"❌ خطأ غير متوقع: {str(e)}", "status_code": 0}
+            break
+        if attempt < retries:
+            time.sleep(_backoff(attempt, retry_after))
+    result["attempts"] = attempt + 1
+    return result
+
+
+# ── إرسال متوازي ────────────────────────────────────────────────────────
+def dispatch_many(url: str, payloads: List[Any],
+                  concurrency: Optional[int] = None,
+                  headers: Optional[List[Dict]] = None,
+                  retries: Optional[int] = None) -> List[Dict]:
+    """
+    إرسال عدة payloads لنفس الـ webhook بتوازٍ محدود (MAKE_CONCURRENCY)
+    مع الجلسة المشتركة وحد المعدل. يُعيد نتيجة لكل payload بنفس الترتيب.
+    headers: (اختياري) ترويسات لكل payload بنفس الترتيب
+    """
+    if not payloads:
+        return []
+    hdrs    = headers or [None] * len(payloads)
+    send    = lambda ph: _post_to_webhook(url, ph[0], retries=retries, headers=ph[1])
+    workers = max(1, min(concurrency or MAKE_CONCURRENCY, len(payloads)))
+    if workers == 1:
+        return [send(ph) for ph in zip(payloads, hdrs)]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="make") as ex:
+        return list(ex.map(send, zip(payloads, hdrs)))
 
 
 # ── تحويل DataFrame إلى قائمة منتجات لـ Make ─────────────────────────────
-def export_to_make_format(df, section_type: str = "update") -> List[Dict]:
+_ID_COLS    = ("معرف_المنتج", "product_id", "رقم المنتج", "رقم_المنتج", "معرف المنتج", "sku", "SKU")
+_NAME_COLS  = ("المنتج", "أسم المنتج", "اسم المنتج", "name")
+_NEW_NAME_COLS = ("المنتج", "منتج_المنافس", "أسم المنتج", "اسم المنتج", "name")   # منتج_المنافس للمفقودة
+_PRICE_COLS = ("السعر", "سعر المنتج", "price")
+_NULL_STRS  = ("", "nan", "None", "NaN", "<NA>")
+
+
+def _col(df, name):
+    """عمود كـ object Series (أو None إذا غير موجود)"""
+    return df[name].astype(object) if name in df.columns else None
+
+
+def _first_present(df, cols, empty):
+    """
+    أول قيمة "غير فارغة" عبر قائمة أعمدة بالترتيب (بديل سلسلة row.get(a) or row.get(b) ...)
+    empty: Series منطقية → أي القيم تُعتبر فارغة
+    """
+    out = None
+    for c in cols:
+        s = _col(df, c)
+        if s is None: continue
+        out = s if out is None else out.where(~empty(out), s)
+    return out
+
+
+def _str_empty(s):
+    return s.isna() | s.astype(str).isin(_NULL_STRS)
+
+
+def _num(s):
+    """_safe_float لعمود كامل"""
+    if s is None: return None
+    return pd.to_numeric(s, errors="coerce").fillna(0.0).astype(float)
+
+
+def _ids(s):
+    """float → int لإزالة .0 (مثل 1081786650.0 → 1081786650)، والباقي نص كما هو"""
+    txt = s.astype(str).str.strip()
+    num = pd.to_numeric(s, errors="coerce")
+    whole = num.notna() & np.isfinite(num) & (num == np.floor(num))
+    txt = txt.where(~whole, num.where(whole, 0).astype("int64").astype(str))
+    return txt.where(~_str_empty(s), "")
+
+
+def export_to_make_format(df, section_type: str = "update", only_changed: bool = False,
+                          tolerance: Optional[float] = None) -> List[Dict]:
     """
     تحويل DataFrame إلى قائمة منتجات جاهزة للإرسال إلى Make.
     كل منتج يحتوي على:
@@ -69,98 +244,103 @@ def export_to_make_format(df, section_type: str = "update") -> List[Dict]:
       - name       : اسم المنتج
       - price      : السعر الجديد
       - section    : نوع القسم (update / new / missing)
+    only_changed: يُبقي فقط المنتجات التي تغير سعرها المستهدف عن آخر إرسال ناجح
+
+    عمودي: الأعمدة تُحل مرة واحدة والأسعار تُحسب بـ numpy ثم تُبنى السجلات بمرور واحد
     """
     if df is None or (hasattr(df, "empty") and df.empty):
         return []
+    n = len(df)
+    blank = pd.Series([""] * n, index=df.index, dtype=object)
+
+    # ── رقم المنتج ──────────────────────────────────────────────────
+    # نبحث في جميع الأعمدة المحتملة لرقم المنتج (أول قيمة غير فارغة/صفر)
+    pid = _first_present(df, _ID_COLS,
+                         lambda s: _str_empty(s) | (pd.to_numeric(s, errors="coerce") == 0))
+    pids = _ids(pid) if pid is not None else blank
+
+    # ــ اسم المنتج ـــــــــــــــــــــــــــــــــــــــــــــــ
+    # منتج_المنافس كاسم للمفقودة/الجديدة فقط — في الأسعار اسمنا الفارغ يُتخطى (لا يُرسل باسم المنافس)
+    name = _first_present(df, _NEW_NAME_COLS if section_type in ("missing", "new") else _NAME_COLS,
+                          _str_empty)
+    names = (name.astype(str).where(~_str_empty(name), "").str.strip()
+             if name is not None else blank)
+
+    # ــ السعر ـــــــــــــــــــــــــــــــــــــــــــــــ
+    zeros = np.zeros(n)
+    comp  = _num(_col(df, "سعر_المنافس"))
+    comp  = comp.to_numpy() if comp is not None else zeros
+    our   = _first_present(df, _PRICE_COLS, lambda s: _num(s) == 0)
+    our   = _num(our).to_numpy() if our is not None else zeros
+
+    if section_type in ("raise", "lower"):
+        # أعلى → نخفض إلى سعر المنافس - 1 | أقل → نرفع إلى سعر المنافس - 1 (أقل منه بريال)
+        price = np.where(comp > 0, np.round(comp - 1, 2), our)
+    elif section_type in ("approved", "update"):
+        # سعر موافق عليه → نرسل سعرنا الحالي كما هو
+        price = our
+    else:
+        # منتجات جديدة أو مفقودة: نرسل سعر المنافس
+        price = np.where(comp > 0, comp, our)
+
+    # ── حقول إضافية اختيارية (تُضاف فقط إن وُجدت قيمة) ────────────
+    def _opt_str(col, extra=()):
+        s = _col(df, col)
+        if s is None: return [None] * n
+        txt = s.astype(str)
+        drop = (txt.isin(("nan", "None", "") + extra) | s.isna()).to_numpy()
+        return np.where(drop, None, txt.to_numpy(dtype=object)).tolist()
+
+    def _opt_num(col):
+        s = _num(_col(df, col))
+        if s is None: return [None] * n
+        v = s.to_numpy()
+        return np.where(v == 0, None, v.astype(object)).tolist()
+
+    optional = [("comp_name",   _opt_str("منتج_المنافس", ("—",))),
+                ("competitor",  _opt_str("المنافس")),
+                ("price_diff",  _opt_num("الفرق")),
+                ("match_score", _opt_num("نسبة_التطابق")),
+                ("decision",    _opt_str("القرار")),
+                ("brand",       _opt_str("الماركة"))]
+    opt_keys = [k for k, _ in optional]
 
     products = []
+    for pid_v, name_v, price_v, *extra in zip(pids.tolist(), names.tolist(), price.tolist(),
+                                               *[v for _, v in optional]):
+        product = {"product_id": pid_v, "name": name_v, "price": price_v,
+                   "section": section_type}
+        for k, v in zip(opt_keys, extra):
+            if v is not None:
+                product[k] = v
+        products.append(product)
 
-    for _, row in df.iterrows():
-        # ── رقم المنتج ──────────────────────────────────────────────────
-        # نبحث في جميع الأعمدة المحتملة لرقم المنتج
-        _pid_raw = (
-            row.get("معرف_المنتج", "") or
-            row.get("product_id", "") or
-            row.get("رقم المنتج", "") or
-            row.get("رقم_المنتج", "") or
-            row.get("معرف المنتج", "") or
-            row.get("sku", "") or
-            row.get("SKU", "") or ""
-        )
-        # تحويل float إلى int لإزالة .0 (مثل 1081786650.0 → 1081786650)
-        try:
-            _fv = float(_pid_raw)
-            product_id = str(int(_fv)) if _fv == int(_fv) else str(_pid_raw).strip()
-        except (ValueError, TypeError):
-            product_id = str(_pid_raw).strip()
-        if product_id in ("", "nan", "None", "NaN"): product_id = ""
-
-        # ــ اسم المنتج ـــــــــــــــــــــــــــــــــــــــــــــــ
-        name = (
-            str(row.get("المنتج", ""))
-            or str(row.get("منتج_المنافس", ""))  # للمنتجات المفقودة
-            or str(row.get("أسم المنتج", ""))
-            or str(row.get("اسم المنتج", ""))
-            or str(row.get("name", ""))
-            or ""
-        )
-        name = name.strip() if name not in ("", "nan", "None") else ""
-
-                # ــ السعر ـــــــــــــــــــــــــــــــــــــــــــــــ
-        comp_price = _safe_float(row.get("سعر_المنافس", 0))
-        our_price  = _safe_float(row.get("السعر", 0) or row.get("سعر المنتج", 0) or row.get("price", 0) or 0)
-
-        if section_type == "raise":
-            # سعرنا أعلى من المنافس → نخفض سعرنا إلى سعر المنافس - 1 ريال
-            if comp_price > 0:
-                price = round(comp_price - 1, 2)
-            else:
-                price = our_price
-        elif section_type == "lower":
-            # سعرنا أقل من المنافس → نرفع سعرنا إلى سعر المنافس - 1 ريال (أقل منه بريال)
-            if comp_price > 0:
-                price = round(comp_price - 1, 2)
-            else:
-                price = our_price
-        elif section_type in ("approved", "update"):
-            # سعر موافق عليه → نرسل سعرنا الحالي كما هو
-            price = our_price
-        else:
-            # منتجات جديدة أو مفقودة: نرسل سعر المنافس
-            price = comp_price if comp_price > 0 else our_price
+    if only_changed:
+        products = filter_changed_prices(products, tolerance)
+    return products
 
-        # ── تجميع بيانات المنتج ─────────────────────────────────────────
-        product = {
-            "product_id": product_id,
-            "name": name,
-            "price": price,
-            "section": section_type,
-        }
 
-        # حقول إضافية اختيارية
-        comp_name  = str(row.get("منتج_المنافس", ""))
-        comp_src   = str(row.get("المنافس", ""))
-        diff       = _safe_float(row.get("الفرق", 0))
-        match_pct  = _safe_float(row.get("نسبة_التطابق", 0))
-        decision   = str(row.get("القرار", ""))
-        brand      = str(row.get("الماركة", ""))
-
-        if comp_name and comp_name not in ("nan", "None", "—"):
-            product["comp_name"] = comp_name
-        if comp_src and comp_src not in ("nan", "None"):
-            product["competitor"] = comp_src
-        if diff:
-            product["price_diff"] = diff
-        if match_pct:
-            product["match_score"] = match_pct
-        if decision and decision not in ("nan", "None"):
-            product["decision"] = decision
-        if brand and brand not in ("nan", "None"):
-            product["brand"] = brand
+def filter_changed_prices(products: List[Dict], tolerance: Optional[float] = None) -> List[Dict]:
+    """
+    يُبقي المنتجات التي لم تُرسل من قبل أو تغير سعرها عن آخر سعر في push_ledger
+    بأكثر من tolerance. المنتجات بدون product_id تبقى دائماً (لا يمكن تتبعها).
+    """
+    tol  = PUSH_TOLERANCE if tolerance is None else float(tolerance)
+    last = get_pushed_prices({str(p.get("product_id", "")).strip() for p in products})
+    out  = []
+    for p in products:
+        pid = str(p.get("product_id", "")).strip()
+        if not pid or pid not in last or abs(_safe_float(p.get("price", 0)) - last[pid]) > tol:
+            out.append(p)
+    return out
 
-        products.append(product)
 
-    return products
+def _record_delivered(items: List[Dict]):
+    """تسجيل الأسعار التي وصلت لـ Make — فشل السجل لا يُفشل الإرسال"""
+    try:
+        record_pushed_prices(items)
+    except Exception:
+        pass
 
 
 # ── إرسال منتج واحد ──────────────────────────────────────────────────────
@@ -207,15 +387,49 @@ def send_single_product(product: Dict) -> Dict:
 
 
 # ── إرسال تحديثات الأسعار ────────────────────────────────────────────────
-def send_price_updates(products: List[Dict]) -> Dict:
+def send_price_updates(products: List[Dict], only_changed: bool = False,
+                       tolerance: Optional[float] = None) -> Dict:
     """
     إرسال قائمة منتجات لتحديث أسعارها في سلة عبر Make.
     كل منتج: product_id + name + price
+    only_changed: تخطي المنتجات التي لم يتغير سعرها منذ آخر إرسال ناجح
     """
     if not products:
         return {"success": False, "message": "❌ لا توجد منتجات للإرسال"}
 
-    # تنظيف وتحقق من البيانات
+    valid_products, skipped = _valid_price_items(products)
+    if not valid_products:
+        return {
+            "success": False,
+            "message": f"❌ لا توجد منتجات صالحة (تم تخطي {skipped} منتج)"
+        }
+    unchanged = 0
+    if only_changed:
+        changed = filter_changed_prices(valid_products, tolerance)
+        unchanged, valid_products = len(valid_products) - len(changed), changed
+        if not valid_products:
+            return {"success": True, "unchanged": unchanged, "chunks": [],
+                    "failed_chunks": [], "sent_items": 0,
+                    "message": f"✅ لا تغيير — كل الأسعار ({unchanged}) مُرسلة مسبقاً"}
+
+    result = _send_chunks(_build_chunks(valid_products))
+    skip_msg = f" (تم تخطي {skipped})" if skipped else ""
+    if unchanged:
+        skip_msg += f" ({unchanged} بدون تغيير)"
+    result["skipped"], result["unchanged"] = skipped, unchanged
+    if result["success"]:
+        result["message"] = (f"✅ تم إرسال {len(valid_products)} منتج لتحديث الأسعار"
+                             f" في {len(result['chunks'])} دفعة{skip_msg}")
+    else:
+        result["message"] = (f"⚠️ أُرسل {result['sent_items']} من {len(valid_products)} منتج"
+                             f" — فشلت {len(result['failed_chunks'])} دفعة"
+                             f" (أعد إرسالها فقط){skip_msg}")
+    return result
+
+
+# ── دفعات تحديث الأسعار ─────────────────────────────────────────────────
+def _valid_price_items(products: List[Dict]):
+    """تنظيف وتحقق: (المنتجات الصالحة بشكل payload سلة، عدد المتخطاة)"""
     valid_products = []
     skipped = 0
     for p in products:
@@ -239,106 +453,155 @@ def send_price_updates(products: List[Dict]) -> Dict:
             "decision": p.get("decision", ""),
             "brand": p.get("brand", ""),
         })
+    return valid_products, skipped
 
-    if not valid_products:
-        return {
-            "success": False,
-            "message": f"❌ لا توجد منتجات صالحة (تم تخطي {skipped} منتج)"
-        }
 
-    payload = {"products": valid_products}
-    result = _post_to_webhook(WEBHOOK_UPDATE_PRICES, payload)
+def _chunk_key(items: List[Dict]) -> str:
+    """مفتاح idempotency من محتوى الدفعة — نفس المنتجات/الأسعار = نفس المفتاح"""
+    raw = json.dumps(items, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
 
+def _build_chunks(items: List[Dict], max_items: Optional[int] = None,
+                  max_bytes: Optional[int] = None) -> List[Dict]:
+    """
+    تقسيم المنتجات إلى payloads {"products": [...]} لا تتجاوز max_items منتج
+    ولا max_bytes بايت (JSON)، كل payload يحمل idempotency_key خاص به
+    """
+    max_items = max_items or MAKE_CHUNK_ITEMS
+    max_bytes = max_bytes or MAKE_CHUNK_BYTES
+    groups, cur, size = [], [], 0
+    for it in items:
+        n = len(json.dumps(it)) + 1   # نفس ترميز requests (json=) على السلك
+        if cur and (len(cur) >= max_items or size + n > max_bytes - 256):
+            groups.append(cur); cur, size = [], 0
+        cur.append(it); size += n
+    if cur:
+        groups.append(cur)
+    return [{"products": g, "idempotency_key": _chunk_key(g),
+             "chunk": i + 1, "chunks": len(groups)}
+            for i, g in enumerate(groups)]
+
+
+def _send_chunks(chunks: List[Dict]) -> Dict:
+    """
+    إرسال الدفعات بتوازٍ (مع إعادة المحاولة لكل دفعة) → حالة لكل دفعة
+    failed_chunks: payloads الدفعات الفاشلة كما هي (نفس المفتاح) لـ resend_chunks
+    """
+    results = dispatch_many(
+        WEBHOOK_UPDATE_PRICES, chunks,
+        headers=[{"Idempotency-Key": c["idempotency_key"]} for c in chunks])
+    status, failed, sent_items = [], [], 0
+    for c, r in zip(chunks, results):
+        status.append({"chunk": c.get("chunk", 0), "key": c["idempotency_key"],
+                       "items": len(c["products"]), "success": r["success"],
+                       "status_code": r.get("status_code", 0),
+                       "attempts": r.get("attempts", 0), "message": r["message"]})
+        if r["success"]:
+            sent_items += len(c["products"])
+            _record_delivered(c["products"])
+        else:
+            failed.append(c)
+    return {"success": bool(chunks) and not failed, "chunks": status,
+            "failed_chunks": failed, "sent_items": sent_items,
+            "status_code": results[-1].get("status_code", 0) if results else 0}
+
+
+def resend_chunks(failed_chunks: List[Dict]) -> Dict:
+    """إعادة إرسال الدفعات الفاشلة فقط — بنفس مفاتيح idempotency"""
+    if not failed_chunks:
+        return {"success": False, "message": "❌ لا توجد دفعات فاشلة", "chunks": [],
+                "failed_chunks": [], "sent_items": 0}
+    result = _send_chunks(failed_chunks)
+    total  = sum(len(c["products"]) for c in failed_chunks)
     if result["success"]:
-        skip_msg = f" (تم تخطي {skipped})" if skipped else ""
-        result["message"] = f"✅ تم إرسال {len(valid_products)} منتج لتحديث الأسعار{skip_msg}"
+        result["message"] = f"✅ أُعيد إرسال {len(failed_chunks)} دفعة ({total} منتج)"
+    else:
+        result["message"] = (f"⚠️ ما زالت {len(result['failed_chunks'])} دفعة فاشلة"
+                             f" — أُرسل {result['sent_items']} من {total} منتج")
     return result
 
 
-# ── إرسال منتجات جديدة ───────────────────────────────────────────────────
-def send_new_products(products: List[Dict]) -> Dict:
-    """
-    إرسال قائمة منتجات جديدة إلى Make لإضافتها في سلة.
-    يُرسل كل منتج في طلب منفصل كـ {"data": [{...}]}
-    Iterator في Make يقرأ data[] ويُخرج كل عنصر لـ Salla.
-    """
-    if not products:
-        return {"success": False, "message": "❌ لا توجد منتجات للإرسال"}
-    sent = 0
-    skipped = 0
-    errors = []
+# ── إرسال منتجات جديدة / مفقودة ─────────────────────────────────────────
+def _new_product_item(p: Dict, name_keys, price_keys) -> Optional[Dict]:
+    """منتج → عنصر Make لإنشاء منتج في سلة (None إذا لا يوجد اسم)"""
+    name = ""
+    for k in name_keys:
+        if k in p:
+            name = str(p.get(k, "")).strip(); break
+    price = 0.0
+    for k in price_keys:
+        price = _safe_float(p.get(k, 0))
+        if price: break
+    if not name:
+        return None
+    return {
+        "أسم المنتج": name,
+        "سعر المنتج": price,
+        "رمز المنتج sku": "",
+        "الوزن": 1,
+        "سعر التكلفة": _safe_float(p.get("cost_price", 0)),
+        "السعر المخفض": _safe_float(p.get("sale_price", 0)),
+        "الوصف": str(p.get("الوصف", p.get("description", ""))).strip(),
+    }
+
+
+def _product_items(products: List[Dict], name_keys, price_keys):
+    items, skipped = [], 0
     for p in products:
-        name  = str(p.get("name", p.get("أسم المنتج", ""))).strip()
-        price = _safe_float(
-            p.get("price", 0)
-            or p.get("سعر المنتج", 0)
-            or p.get("السعر", 0)
-        )
-        pid   = str(p.get("product_id", p.get("معرف_المنتج", ""))).strip()
-        if not name:
+        item = _new_product_item(p, name_keys, price_keys)
+        if item is None:
             skipped += 1
-            continue
-        item = {
-            "أسم المنتج": name,
-            "سعر المنتج": price,
-            "رمز المنتج sku": "",
-            "الوزن": 1,
-            "سعر التكلفة": _safe_float(p.get("cost_price", 0)),
-            "السعر المخفض": _safe_float(p.get("sale_price", 0)),
-            "الوصف": str(p.get("الوصف", p.get("description", ""))).strip(),
-        }
-        payload = {"data": [item]}
-        result = _post_to_webhook(WEBHOOK_NEW_PRODUCTS, payload)
-        if result["success"]:
-            sent += 1
         else:
-            errors.append(name)
+            items.append(item)
+    return items, skipped
+
+
+NEW_NAME_KEYS,     NEW_PRICE_KEYS     = ("name", "أسم المنتج"), ("price", "سعر المنتج", "السعر")
+MISSING_NAME_KEYS, MISSING_PRICE_KEYS = ("name", "المنتج"), ("price", "السعر")
+
+
+def _send_product_items(products: List[Dict], label: str, name_keys, price_keys) -> Dict:
+    """
+    كل منتج في طلب منفصل كـ {"data": [{...}]} — Iterator في Make يقرأ data[]
+    ويُخرج كل عنصر لـ Salla. الطلبات تُرسل بتوازٍ عبر dispatch_many.
+    """
+    items, skipped = _product_items(products, name_keys, price_keys)
+    results = dispatch_many(WEBHOOK_NEW_PRODUCTS, [{"data": [it]} for it in items])
+    per_item = [dict(r, name=it["أسم المنتج"]) for it, r in zip(items, results)]
+    sent   = sum(1 for r in per_item if r["success"])
+    errors = [r["name"] for r in per_item if not r["success"]]
+
+    out = {"sent": sent, "failed": len(errors), "skipped": skipped, "results": per_item}
     if sent == 0:
-        return {"success": False, "message": f"❌ فشل إرسال جميع المنتجات. تم تخطي {skipped}"}
+        return dict(out, success=False,
+                    message=f"❌ فشل إرسال جميع المنتجات. تم تخطي {skipped}")
     skip_msg = f" (تم تخطي {skipped})" if skipped else ""
     err_msg  = f" (فشل {len(errors)})" if errors else ""
-    return {"success": True, "message": f"✅ تم إرسال {sent} منتج جديد إلى Make{skip_msg}{err_msg}"}
+    return dict(out, success=True,
+                message=f"✅ تم إرسال {sent} {label} إلى Make{skip_msg}{err_msg}")
+
+
+def send_new_products(products: List[Dict]) -> Dict:
+    """
+    إرسال قائمة منتجات جديدة إلى Make لإضافتها في سلة.
+    يُعيد أيضاً results: نتيجة لكل منتج (success/status_code/attempts/name)
+    """
+    if not products:
+        return {"success": False, "message": "❌ لا توجد منتجات للإرسال"}
+    return _send_product_items(products, "منتج جديد", NEW_NAME_KEYS, NEW_PRICE_KEYS)
 
 
 # ── إرسال المنتجات المفقودة ─────────────────────────────────────────
 def send_missing_products(products: List[Dict]) -> Dict:
     """
     إرسال قائمة المنتجات المفقودة إلى Make.
-    يُرسل كل منتج في طلب منفصل كـ {"data": [{...}]}
-    Iterator في Make يقرأ data[] ويُخرج كل عنصر لـ Salla.
+    يُعيد أيضاً results: نتيجة لكل منتج (success/status_code/attempts/name)
     """
     if not products:
         return {"success": False, "message": "❌ لا توجد منتجات مفقودة للإرسال"}
-    sent = 0
-    skipped = 0
-    errors = []
-    for p in products:
-        name  = str(p.get("name", p.get("المنتج", ""))).strip()
-        price = _safe_float(p.get("price", p.get("السعر", 0)))
-        pid   = str(p.get("product_id", p.get("معرف_المنتج", ""))).strip()
-        if not name:
-            skipped += 1
-            continue
-        item = {
-            "أسم المنتج": name,
-            "سعر المنتج": price,
-            "رمز المنتج sku": "",
-            "الوزن": 1,
-            "سعر التكلفة": _safe_float(p.get("cost_price", 0)),
-            "السعر المخفض": _safe_float(p.get("sale_price", 0)),
-            "الوصف": str(p.get("الوصف", p.get("description", ""))).strip(),
-        }
-        payload = {"data": [item]}
-        result = _post_to_webhook(WEBHOOK_NEW_PRODUCTS, payload)
-        if result["success"]:
-            sent += 1
-        else:
-            errors.append(name)
-    if sent == 0:
-        return {"success": False, "message": f"❌ فشل إرسال جميع المنتجات. تم تخطي {skipped}"}
-    skip_msg = f" (تم تخطي {skipped})" if skipped else ""
-    err_msg  = f" (فشل {len(errors)})" if errors else ""
-    return {"success": True, "message": f"✅ تم إرسال {sent} منتج مفقود إلى Make{skip_msg}{err_msg}"}
+    return _send_product_items(products, "منتج مفقود",
+                               MISSING_NAME_KEYS, MISSING_PRICE_KEYS)
 
 
 # ── فحص حالة الاتصال بـ Webhooks ─────────────────────────────────────────
@@ -360,7 +623,7 @@ def verify_webhook_connection() -> Dict:
     results = {}
 
     # فحص Webhook تحديث الأسعار
-    r1 = _post_to_webhook(WEBHOOK_UPDATE_PRICES, test_payload)
+    r1 = _post_to_webhook(WEBHOOK_UPDATE_PRICES, test_payload, retries=0)
     results["update_prices"] = {
         "success": r1["success"],
         "message": r1["message"],
@@ -368,7 +631,7 @@ def verify_webhook_connection() -> Dict:
     }
 
     # فحص Webhook المنتجات الجديدة
-    r2 = _post_to_webhook(WEBHOOK_NEW_PRODUCTS, test_payload)
+    r2 = _post_to_webhook(WEBHOOK_NEW_PRODUCTS, test_payload, retries=0)
     results["new_products"] = {
         "success": r2["success"],
         "message": r2["message"],
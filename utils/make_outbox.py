@@ -0,0 +1,264 @@
+"""
+utils/make_outbox.py - صندوق إرسال Make الدائم (outbox) v1.0
+- الأزرار تُدخل payloads في جدول make_outbox بمعاملة واحدة وتعود فوراً
+- thread خلفي واحد يفرغ الصندوق بتوازٍ (dispatch_many) ويعيد المحاولة بتأخير أُسّي
+- بعد OUTBOX_MAX_ATTEMPTS محاولة → 'dead' (يُعاد يدوياً من صفحة أتمتة Make)
+- صفوف 'sending' لم تُحدَّث منذ OUTBOX_STALE_SECS (عملية ماتت أو علقت) → تعود 'pending' تلقائياً
+  (بالعمر فقط: عمليات أخرى حية — worker ثانٍ أو batch_run — قد ترسل صفوفها الآن)
+- دفعات الأسعار المُسلّمة تُسجل في push_ledger (آخر سعر أُرسل لكل منتج)
+"""
+import json, threading, time, uuid
+from datetime import datetime, timedelta
+
+from utils.db_manager import get_db, close_db, transaction, _ts, _BOOT_ID
+import utils.make_helper as _mh
+from utils.make_helper import (_env_num, dispatch_many, filter_changed_prices,
+                               _valid_price_items, _build_chunks, _product_items,
+                               NEW_NAME_KEYS, NEW_PRICE_KEYS,
+                               MISSING_NAME_KEYS, MISSING_PRICE_KEYS)
+
+OUTBOX_MAX_ATTEMPTS = max(1, int(_env_num("OUTBOX_MAX_ATTEMPTS", 8)))
+OUTBOX_BACKOFF_BASE = _env_num("OUTBOX_BACKOFF_BASE", 5.0)     # ثانية، يتضاعف
+OUTBOX_BACKOFF_MAX  = 900.0
+OUTBOX_BATCH        = 50      # صفوف تُحجز في كل دورة
+OUTBOX_IDLE_SECS    = 5.0
+OUTBOX_STALE_SECS   = 300     # 'sending' أقدم من هذا → تعود pending
+
+# نوع الإرسال → (webhook, وصف)
+KINDS = {
+    "price":   (lambda: _mh.WEBHOOK_UPDATE_PRICES, "تحديث أسعار"),
+    "new":     (lambda: _mh.WEBHOOK_NEW_PRODUCTS,  "منتج جديد"),
+    "missing": (lambda: _mh.WEBHOOK_NEW_PRODUCTS,  "منتج مفقود"),
+}
+
+_wake   = threading.Event()
+_thread = None
+_start_lock = threading.Lock()
+
+
+def _at(seconds):
+    return (datetime.now() + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _payloads(kind, products):
+    """منتجات export_to_make_format → [(payload, idem_key, label, items)], skipped"""
+    if kind == "price":
+        valid, skipped = _valid_price_items(products)
+        return [(c, c["idempotency_key"], f"دفعة {c['chunk']}/{c['chunks']}", len(c["products"]))
+                for c in _build_chunks(valid)], skipped
+    keys = (NEW_NAME_KEYS, NEW_PRICE_KEYS) if kind == "new" else (MISSING_NAME_KEYS, MISSING_PRICE_KEYS)
+    items, skipped = _product_items(products, *keys)
+    return [({"data": [it]}, "", it["أسم المنتج"], 1) for it in items], skipped
+
+
+def _in_flight_prices():
+    """{product_id: [أسعار]} في دفعات أسعار بالصندوق لم تُسلّم بعد (pending/sending)"""
+    out = {}
+    for r in get_db().execute(
+            "SELECT payload FROM make_outbox WHERE kind='price' AND status IN ('pending','sending')"):
+        try: items = json.loads(r["payload"]).get("products", [])
+        except: continue
+        for p in items:
+            pid = str(p.get("product_id", "")).strip()
+            if pid: out.setdefault(pid, []).append(_mh._safe_float(p.get("price", 0)))
+    return out
+
+
+def _drop_unchanged(products, tolerance=None):
+    """
+    only_changed: يُسقط ما أُرسل بنفس السعر (push_ledger) أو ينتظر في الصندوق بنفس السعر
+    (السجل لا يُكتب إلا بعد التسليم → ضغطة ثانية قبل تفريغ الصندوق لا تكرر الإرسال)
+    """
+    tol     = _mh.PUSH_TOLERANCE if tolerance is None else float(tolerance)
+    changed = filter_changed_prices(products, tol)
+    queued  = _in_flight_prices() if changed else {}
+    return [p for p in changed
+            if not any(abs(_mh._safe_float(p.get("price", 0)) - q) <= tol
+                       for q in queued.get(str(p.get("product_id", "")).strip(), ()))]
+
+
+# ─── الإدخال ───────────────────────────────
+def enqueue_make_delivery(kind, products, only_changed=False, tolerance=None):
+    """
+    إدخال كل payloads الإرسال في make_outbox بمعاملة واحدة (كلها أو لا شيء)
+    only_changed (أسعار فقط): تخطي غير المتغير منذ آخر تسليم أو الموجود في الصندوق
+    يُعيد {"success", "message", "batch_id", "queued", "items", "skipped", "unchanged"}
+    """
+    if kind not in KINDS:
+        return {"success": False, "message": f"❌ نوع غير معروف: {kind}"}
+    if not products:
+        return {"success": False, "message": "❌ لا توجد منتجات للإرسال"}
+    unchanged = 0
+    if only_changed and kind == "price":
+        changed = _drop_unchanged(products, tolerance)
+        unchanged, products = len(products) - len(changed), changed
+        if not products:
+            # لا شيء تغير = نجاح لا خطأ
+            return {"success": True, "queued": 0, "items": 0, "skipped": 0,
+                    "unchanged": unchanged,
+                    "message": f"✅ لا تغيير — كل الأسعار ({unchanged}) مُرسلة أو في الصندوق مسبقاً"}
+    rows, skipped = _payloads(kind, products)
+    if not rows:
+        return {"success": False, "message": f"❌ لا توجد منتجات صالحة (تم تخطي {skipped} منتج)"}
+    batch_id, now = uuid.uuid4().hex[:12], _ts()
+    with transaction() as conn:
+        conn.executemany(
+            """INSERT INTO make_outbox
+               (created_at,updated_at,batch_id,kind,label,items,payload,idem_key,
+                status,attempts,next_attempt_at)
+               VALUES (?,?,?,?,?,?,?,?,'pending',0,?)""",
+            [(now, now, batch_id, kind, label, n,
+              json.dumps(payload, ensure_ascii=False), key, now)
+             for payload, key, label, n in rows])
+    start_outbox_dispatcher()
+    _wake.set()
+    items = sum(r[3] for r in rows)
+    skip_msg = f" (تم تخطي {skipped})" if skipped else ""
+    if unchanged:
+        skip_msg += f" ({unchanged} بدون تغيير)"
+    return {"success": True, "batch_id": batch_id, "queued": len(rows), "items": items,
+            "skipped": skipped, "unchanged": unchanged,
+            "message": f"📮 أُضيف {items} {KINDS[kind][1]} ({len(rows)} طلب) لصندوق الإرسال{skip_msg}"}
+
+
+# ─── الحجز والتحديث ────────────────────────
+def _recover_stale():
+    with transaction() as conn:
+        return conn.execute(
+            """UPDATE make_outbox SET status='pending', owner='', updated_at=?
+               WHERE status='sending' AND updated_at < ?""",
+            (_ts(), _at(-OUTBOX_STALE_SECS))
+        ).rowcount
+
+
+def _heartbeat(rows):
+    """تحديث updated_at لصفوف هذه العملية قبل إرسالها → لا تُعد عالقة أثناء دورة طويلة"""
+    with transaction() as conn:
+        conn.executemany("UPDATE make_outbox SET updated_at=? WHERE id=? AND owner=?",
+                         [(_ts(), r["id"], _BOOT_ID) for r in rows])
+
+
+def _claim(limit=OUTBOX_BATCH):
+    now = _ts()
+    with transaction() as conn:
+        rows = conn.execute(
+            """SELECT id, kind, payload, idem_key, attempts FROM make_outbox
+               WHERE status='pending' AND next_attempt_at <= ?
+               ORDER BY id LIMIT ?""", (now, limit)
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE make_outbox SET status='sending', owner=?, updated_at=? WHERE id=?",
+                [(_BOOT_ID, now, r["id"]) for r in rows])
+    return [dict(r) for r in rows]
+
+
+def _record(rows, results):
+    now, updates = _ts(), []
+    for r, res in zip(rows, results):
+        attempts = r["attempts"] + 1
+        if res.get("success"):
+            updates.append(("sent", attempts, now, "", res.get("status_code", 0), now, r["id"]))
+        else:
+            dead = attempts >= OUTBOX_MAX_ATTEMPTS or res.get("status_code", 0) in (400, 401, 403, 404, 410, 422)
+            delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)))
+            updates.append(("dead" if dead else "pending", attempts, _at(delay),
+                            res.get("message", "")[:300], res.get("status_code", 0), None, r["id"]))
+    with transaction() as conn:
+        conn.executemany(
+            """UPDATE make_outbox SET status=?, attempts=?, next_attempt_at=?, last_error=?,
+               status_code=?, sent_at=COALESCE(?, sent_at), updated_at=?, owner='' WHERE id=?""",
+            [(st, a, nxt, err, code, sent, now, i) for st, a, nxt, err, code, sent, i in updates])
+
+
+def drain_once(limit=OUTBOX_BATCH):
+    """دورة واحدة: حجز المستحق → إرسال متوازٍ لكل نوع → تسجيل النتائج. يُعيد عدد المرسَل"""
+    rows = _claim(limit)
+    for kind in {r["kind"] for r in rows}:
+        group = [r for r in rows if r["kind"] == kind]
+        url   = KINDS.get(kind, (lambda: "", ""))[0]()
+        _heartbeat(group)
+        # محاولة واحدة + إعادة سريعة داخل الطلب؛ التأخير الطويل يتولاه الصندوق
+        results = dispatch_many(
+            url, [json.loads(r["payload"]) for r in group],
+            headers=[{"Idempotency-Key": r["idem_key"]} if r["idem_key"] else None
+                     for r in group],
+            retries=1)
+        _record(group, results)
+        if kind == "price":
+            for r, res in zip(group, results):
+                if res.get("success"):
+                    _mh._record_delivered(json.loads(r["payload"]).get("products", []))
+    return len(rows)
+
+
+# ─── الـ thread الخلفي ──────────────────────
+def _run():
+    last_recover = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_recover > 60:
+                _recover_stale(); last_recover = time.monotonic()
+            if drain_once():
+                continue
+        except Exception:
+            close_db()
+        _wake.wait(OUTBOX_IDLE_SECS)
+        _wake.clear()
+
+
+def start_outbox_dispatcher():
+    """يُشغّل الموزّع مرة واحدة لكل عملية (يُستدعى عند بدء التطبيق ومع كل إدخال)"""
+    global _thread
+    with _start_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="make-outbox", daemon=True)
+            _thread.start()
+    return _thread
+
+
+# ─── الاستعلام والإدارة (صفحة أتمتة Make) ──
+def outbox_stats():
+    try:
+        rows = get_db().execute(
+            "SELECT status, COUNT(*) AS n, COALESCE(SUM(items),0) AS items "
+            "FROM make_outbox GROUP BY status").fetchall()
+        out = {s: {"n": 0, "items": 0} for s in ("pending", "sending", "sent", "dead")}
+        for r in rows:
+            out[r["status"]] = {"n": r["n"], "items": r["items"]}
+        return out
+    except: return {}
+
+
+def list_outbox(status=None, limit=200):
+    try:
+        q = """SELECT id, created_at, updated_at, kind, label, items, status, attempts,
+                      next_attempt_at, status_code, last_error, sent_at
+               FROM make_outbox"""
+        args = ()
+        if status:
+            q += " WHERE status=?"; args = (status,)
+        rows = get_db().execute(q + " ORDER BY id DESC LIMIT ?", args + (limit,)).fetchall()
+        return [dict(r) for r in rows]
+    except: return []
+
+
+def retry_dead(ids=None):
+    """إعادة الرسائل الميتة إلى pending (كلها أو ids محددة)"""
+    q = """UPDATE make_outbox SET status='pending', attempts=0, next_attempt_at=?,
+           updated_at=? WHERE status='dead'"""
+    args = [_ts(), _ts()]
+    if ids:
+        q += f" AND id IN ({','.join('?' * len(ids))})"; args += list(ids)
+    with transaction() as conn:
+        n = conn.execute(q, args).rowcount
+    _wake.set()
+    return n
+
+
+def purge_outbox(days=30, statuses=("sent",)):
+    with transaction() as conn:
+        return conn.execute(
+            f"DELETE FROM make_outbox WHERE status IN ({','.join('?' * len(statuses))}) "
+            "AND updated_at < ?", (*statuses, _at(-days * 86400))
+        ).rowcount
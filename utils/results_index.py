@@ -0,0 +1,281 @@
+"""
+utils/results_index.py - طبقة استعلام النتائج v1.1
+- تُبنى مرة واحدة لكل DataFrame نتائج (تحليل/قسم) ثم تُعاد في كل rerun
+- فهرس مقلوب: كلمة → صفوف، وثلاثيات أحرف (trigrams) → كلمات لبحث الأجزاء
+- رموز فئوية (codes) للماركة/المنافس/النوع/القرار → فلترة بمقارنة أعداد
+- الفلاتر تُدمج كمصفوفات صفوف وأقنعة numpy بدل نسخ الجدول وstr.contains
+- AnalysisResults: جدول واحد + الأقسام كمصفوفات صفوف (بدل 5 نسخ في الجلسة)
+"""
+import threading, weakref
+import numpy as np
+import pandas as pd
+
+TEXT_COLS = ["المنتج", "منتج_المنافس", "الماركة"]
+CAT_COLS  = {"brand": "الماركة", "competitor": "المنافس",
+             "type": "النوع", "decision": "القرار"}
+NUM_COLS  = {"match": "نسبة_التطابق", "price": "السعر"}
+_ALL      = "الكل"
+_EMPTY    = np.zeros(0, dtype=np.int64)
+
+
+def _grams(s, n=3):
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+
+class ResultsIndex:
+    """
+    البحث: النص يُقسم على المسافات، كل جزء يجب أن يكون جزءاً من كلمة في الصف
+    → مرشحون (تقاطع قوائم الصفوف) ثم تحقق حرفي واحد على المرشحين فقط
+    النتيجة مطابقة تماماً لـ str.contains(case=False) على الأعمدة الثلاثة
+    """
+
+    def __init__(self, df):
+        self.n    = len(df)
+        self.cols = list(df.columns)
+        # نصوص الأعمدة بحروف صغيرة (للتحقق النهائي)
+        self._text = [df[c].astype(str).fillna("").str.lower().tolist()
+                      for c in TEXT_COLS if c in df.columns]
+
+        # كلمة → صفوف
+        vocab, posting = {}, []
+        for col in self._text:
+            for i, s in enumerate(col):
+                for tok in s.split():
+                    k = vocab.get(tok)
+                    if k is None:
+                        k = vocab[tok] = len(posting); posting.append([])
+                    if not posting[k] or posting[k][-1] != i:
+                        posting[k].append(i)
+        self._vocab    = list(vocab)
+        self._postings = [np.unique(np.asarray(p, dtype=np.int64)) for p in posting]
+
+        # trigram → كلمات (للبحث بجزء من كلمة)
+        grams = {}
+        for k, tok in enumerate(self._vocab):
+            for g in _grams(tok):
+                grams.setdefault(g, []).append(k)
+        self._grams = {g: np.asarray(v, dtype=np.int64) for g, v in grams.items()}
+
+        # رموز فئوية
+        self._codes, self._cats = {}, {}
+        for key, col in CAT_COLS.items():
+            if col not in df.columns: continue
+            cat = pd.Categorical(df[col].astype(str))
+            self._codes[key] = np.asarray(cat.codes)
+            self._cats[key]  = {v: i for i, v in enumerate(cat.categories)}
+
+        # أعمدة رقمية
+        self._nums = {key: pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+                      for key, col in NUM_COLS.items() if col in df.columns}
+
+        self._tok_cache = {}
+        self._lock      = threading.Lock()
+
+    # ─── خيارات الفلاتر ─────────────────────
+    def options(self, key, rows=None):
+        cats = self._cats.get(key)
+        if not cats: return [_ALL]
+        vals = list(cats)
+        if rows is not None:
+            used = np.unique(self._codes[key][np.asarray(rows, dtype=np.int64)])
+            vals = [vals[c] for c in used if c >= 0]
+        return [_ALL] + sorted(v for v in vals if v.strip() and v != "nan")
+
+    def filter_options(self, rows=None):
+        """نفس شكل helpers.get_filter_options"""
+        return {"brands":      self.options("brand", rows),
+                "competitors": self.options("competitor", rows),
+                "types":       self.options("type", rows)}
+
+    # ─── البحث ───────────────────────────────
+    def _token_rows(self, part):
+        """صفوف فيها كلمة تحتوي part (مع ذاكرة — الكتابة حرفاً حرفاً تعيد نفس الأجزاء)"""
+        hit = self._tok_cache.get(part)
+        if hit is not None: return hit
+        if len(part) >= 3:
+            cand = None
+            for g in _grams(part):
+                ids = self._grams.get(g)
+                if ids is None: cand = _EMPTY; break
+                cand = ids if cand is None else np.intersect1d(cand, ids, assume_unique=True)
+                if not len(cand): break
+            toks = [k for k in cand if part in self._vocab[k]]
+        else:
+            toks = [k for k, t in enumerate(self._vocab) if part in t]
+        rows = (np.unique(np.concatenate([self._postings[k] for k in toks]))
+                if toks else _EMPTY)
+        with self._lock:
+            if len(self._tok_cache) > 512: self._tok_cache.clear()
+            self._tok_cache[part] = rows
+        return rows
+
+    def search(self, text):
+        q = str(text or "").strip().lower()
+        if not q: return np.arange(self.n)
+        cand = None
+        for part in sorted(set(q.split()), key=len, reverse=True):
+            rows = self._token_rows(part)
+            cand = rows if cand is None else np.intersect1d(cand, rows, assume_unique=True)
+            if not len(cand): return _EMPTY
+        if q.split() == [q]:
+            return cand  # كلمة واحدة: وجودها داخل كلمة = وجودها في النص
+        return np.asarray([i for i in cand if any(q in col[i] for col in self._text)],
+                          dtype=np.int64)
+
+    # ─── الفلترة ─────────────────────────────
+    def mask(self, filters, rows=None):
+        """قناع منطقي بطول الجدول لكل الفلاتر (rows: تقييد مسبق بصفوف قسم مثلاً)"""
+        m = np.ones(self.n, dtype=bool)
+        if rows is not None:
+            m[:] = False; m[np.asarray(rows, dtype=np.int64)] = True
+        for key in ("brand", "competitor", "type", "decision"):
+            val = filters.get(key, _ALL)
+            if not val or val == _ALL or key not in self._codes: continue
+            code = self._cats[key].get(str(val))
+            if code is None: return np.zeros(self.n, dtype=bool)
+            m &= self._codes[key] == code
+        with np.errstate(invalid="ignore"):
+            if filters.get("match_min") and "match" in self._nums:
+                m &= self._nums["match"] >= float(filters["match_min"])
+            if filters.get("price_min") and filters["price_min"] > 0 and "price" in self._nums:
+                m &= self._nums["price"] >= float(filters["price_min"])
+            if filters.get("price_max") and filters["price_max"] > 0 and "price" in self._nums:
+                m &= self._nums["price"] <= float(filters["price_max"])
+        search = str(filters.get("search", "") or "").strip()
+        if search and m.any():
+            hit = np.zeros(self.n, dtype=bool); hit[self.search(search)] = True
+            m &= hit
+        return m
+
+    def filter(self, filters, rows=None):
+        """مواضع الصفوف المطابقة (مرتبة) — df.take(...) لاستخراجها"""
+        return np.flatnonzero(self.mask(filters, rows))
+
+
+# ─── ذاكرة الفهارس ─────────────────────────
+# مفتاح = id(df) + weakref: الفهرس يُحذف تلقائياً مع الجدول، ولا يُخلط بجدول جديد بنفس id
+_cache, _cache_lock = {}, threading.RLock()
+
+
+def _drop(key, ref):
+    with _cache_lock:
+        if key in _cache and _cache[key][0] is ref: del _cache[key]
+
+
+def get_results_index(df):
+    key = id(df)
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and hit[0]() is df and hit[1].n == len(df) and hit[1].cols == list(df.columns):
+            return hit[1]
+    idx = ResultsIndex(df)
+    try:
+        ref = weakref.ref(df, lambda r, k=key: _drop(k, r))
+    except TypeError:
+        return idx
+    with _cache_lock:
+        _cache[key] = (ref, idx)
+    return idx
+
+
+# ═══════════════════════════════════════════════════════
+#  نتائج التحليل — جدول واحد + أقسام كمصفوفات صفوف
+# ═══════════════════════════════════════════════════════
+# القسم ← كلمة في نص القرار (يُطابق على الفئات القليلة لا على الصفوف)
+SECTION_KEYWORDS = {"price_raise": "أعلى", "price_lower": "أقل",
+                    "approved": "موافق", "review": "مراجعة"}
+
+
+class SectionView:
+    """
+    عرض قسم بدون نسخ: len/empty/columns + فلترة عبر فهرس الجدول الكامل.
+    أي استخدام آخر كـ DataFrame (head, iterrows, ["عمود"] ...) يُنشئ الجدول عند الطلب.
+    """
+
+    def __init__(self, results, key):
+        self._results, self.key = results, key
+        self.rows = results.rows(key)
+
+    def __len__(self):         return len(self.rows)
+    @property
+    def empty(self):           return len(self.rows) == 0
+    @property
+    def columns(self):         return self._results.frame.columns
+    def filter_options(self):  return self._results.index.filter_options(self.rows)
+
+    def query(self, filters):
+        rows = self._results.index.filter(filters, self.rows)
+        return self._results.frame.take(rows).reset_index(drop=True)
+
+    def to_frame(self):
+        return self._results.materialize(self.key)
+
+    def __getitem__(self, item):  return self.to_frame()[item]
+    def __getattr__(self, name):
+        if name.startswith("_"): raise AttributeError(name)
+        return getattr(self.to_frame(), name)
+
+
+class AnalysisResults:
+    """
+    يحل محل dict الأقسام في st.session_state.results:
+    r["price_raise"] / r.get(...) → SectionView | r["all"] → الجدول | r["missing"] → المفقودات
+    r.count(key) → O(1)
+    """
+    SECTIONS = tuple(SECTION_KEYWORDS)
+
+    def __init__(self, frame, missing=None):
+        self.frame   = frame if frame is not None else pd.DataFrame()
+        self.missing = missing if missing is not None else pd.DataFrame()
+        self._rows   = {k: _EMPTY for k in self.SECTIONS}
+        if "القرار" in self.frame.columns and len(self.frame):
+            dec = self.frame["القرار"]
+            if not isinstance(dec.dtype, pd.CategoricalDtype):
+                # نتائج مستعادة من JSON → نصوص؛ تُحوَّل مرة واحدة
+                self.frame["القرار"] = dec = dec.astype(str).astype("category")
+            cat = dec.array
+            codes = np.asarray(cat.codes)
+            for key, word in SECTION_KEYWORDS.items():
+                hit = [i for i, c in enumerate(cat.categories) if word in str(c)]
+                self._rows[key] = np.flatnonzero(np.isin(codes, hit))
+        self._slot = (None, None)   # آخر قسم تم إنشاؤه كجدول (نسخة واحدة فقط)
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        return get_results_index(self.frame)
+
+    def rows(self, key):
+        return self._rows.get(key, _EMPTY)
+
+    def count(self, key):
+        if key == "all":     return len(self.frame)
+        if key == "missing": return len(self.missing)
+        return len(self._rows.get(key, _EMPTY))
+
+    def materialize(self, key):
+        with self._lock:
+            if self._slot[0] == key: return self._slot[1]
+            df = self.frame.take(self.rows(key)).reset_index(drop=True)
+            self._slot = (key, df)
+            return df
+
+    # ─── واجهة dict (توافق مع الصفحات) ─────
+    def __getitem__(self, key):
+        if key == "all":     return self.frame
+        if key == "missing": return self.missing
+        if key in self._rows: return SectionView(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try: return self[key]
+        except KeyError: return default
+
+    def __contains__(self, key):
+        return key in ("all", "missing") or key in self._rows
+
+    def keys(self):
+        return list(self.SECTIONS) + ["missing", "all"]
+
+    def __bool__(self):
+        return True